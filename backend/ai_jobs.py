@@ -0,0 +1,153 @@
+"""
+Background jobs for the slow AI endpoints.
+
+POST creates a job and returns its id at once; the computation runs on a
+small per-worker pool (AI_JOB_WORKERS concurrent jobs) and the result is
+persisted in the ai_jobs collection for AI_JOB_RESULT_TTL_SECONDS (Mongo TTL
+index). Any worker can answer status/result reads.
+
+Identical requests (same kind + params) share one job while it is queued or
+running: the job holds a unique `active_key` until it finishes. A job whose
+worker died is taken over once its lease (AI_JOB_TIMEOUT_SECONDS) runs out.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from pymongo.errors import DuplicateKeyError
+
+
+logger = logging.getLogger(__name__)
+
+JOBS_COLLECTION = "ai_jobs"
+
+AI_JOB_WORKERS = int(os.getenv("AI_JOB_WORKERS", "2"))
+AI_JOB_TIMEOUT_SECONDS = float(os.getenv("AI_JOB_TIMEOUT_SECONDS", "180"))
+AI_JOB_RESULT_TTL_SECONDS = int(os.getenv("AI_JOB_RESULT_TTL_SECONDS", "3600"))
+
+FINISHED = ("done", "failed")
+
+
+def job_key(kind: str, params: Dict[str, Any]) -> str:
+    payload = json.dumps([kind, params], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def public_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "job_id": job["_id"],
+        "kind": job["kind"],
+        "params": job["params"],
+        "status": job["status"],
+        "created_at": job.get("created_at"),
+        "started_at": job.get("started_at"),
+        "finished_at": job.get("finished_at"),
+        "expires_at": job.get("expires_at"),
+        "result": job.get("result"),
+        "error": job.get("error")
+    }
+
+
+class JobRunner:
+    def __init__(self, workers: int = AI_JOB_WORKERS):
+        self.handlers: Dict[str, Callable[..., Awaitable[Any]]] = {}
+        self.workers = workers
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._tasks: set = set()
+        self._indexes_ready = False
+
+    def register(self, kind: str, handler: Callable[..., Awaitable[Any]]) -> None:
+        self.handlers[kind] = handler
+
+    async def _ensure_indexes(self, db) -> None:
+        if not self._indexes_ready:
+            from indexes import INDEXES
+            # Dedupe relies on the unique active_key index; cheap no-op once it exists
+            await db[JOBS_COLLECTION].create_indexes(INDEXES[JOBS_COLLECTION])
+            self._indexes_ready = True
+
+    async def submit(self, db, kind: str, params: Dict[str, Any]) -> Tuple[Dict[str, Any], bool]:
+        """Create (or join) a job; returns (job, deduplicated)"""
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        await self._ensure_indexes(db)
+
+        key = job_key(kind, params)
+        now = datetime.utcnow()
+        job = {
+            "_id": uuid.uuid4().hex,
+            "kind": kind,
+            "params": params,
+            "key": key,
+            "active_key": key,
+            "status": "queued",
+            "created_at": now,
+            # Queued jobs may wait behind a full pool before their own run starts
+            "lease_until": now + timedelta(seconds=2 * AI_JOB_TIMEOUT_SECONDS),
+            "expires_at": now + timedelta(seconds=AI_JOB_RESULT_TTL_SECONDS)
+        }
+
+        for _ in range(2):
+            try:
+                await db[JOBS_COLLECTION].insert_one(job)
+                break
+            except DuplicateKeyError:
+                existing = await db[JOBS_COLLECTION].find_one({"active_key": key})
+                if existing is None:
+                    continue  # finished in between; try again
+                if existing["lease_until"] > datetime.utcnow():
+                    return existing, True
+                # Its worker is gone: fail it and take the key over
+                await db[JOBS_COLLECTION].update_one(
+                    {"_id": existing["_id"], "active_key": key},
+                    {"$set": {"status": "failed", "error": "Job abandoned (lease expired)", "finished_at": datetime.utcnow()},
+                     "$unset": {"active_key": ""}}
+                )
+        else:
+            raise RuntimeError("Could not create job")
+
+        task = asyncio.get_running_loop().create_task(self._run(db, job))
+        # Keep a reference so the task isn't garbage collected mid-flight
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job, False
+
+    async def _run(self, db, job: Dict[str, Any]) -> None:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.workers)
+        async with self._semaphore:
+            now = datetime.utcnow()
+            await db[JOBS_COLLECTION].update_one(
+                {"_id": job["_id"]},
+                {"$set": {"status": "running", "started_at": now, "lease_until": now + timedelta(seconds=AI_JOB_TIMEOUT_SECONDS)}}
+            )
+            update: Dict[str, Any]
+            try:
+                result = await asyncio.wait_for(self.handlers[job["kind"]](**job["params"]), timeout=AI_JOB_TIMEOUT_SECONDS)
+                update = {"status": "done", "result": result}
+            except asyncio.TimeoutError:
+                update = {"status": "failed", "error": f"Timed out after {AI_JOB_TIMEOUT_SECONDS}s"}
+            except Exception as e:
+                logger.exception(f"AI job {job['_id']} ({job['kind']}) failed")
+                update = {"status": "failed", "error": str(getattr(e, "detail", None) or e)}
+
+            finished = datetime.utcnow()
+            update.update({"finished_at": finished, "expires_at": finished + timedelta(seconds=AI_JOB_RESULT_TTL_SECONDS)})
+            await db[JOBS_COLLECTION].update_one(
+                {"_id": job["_id"]},
+                {"$set": update, "$unset": {"active_key": ""}}
+            )
+
+    async def get(self, db, job_id: str) -> Optional[Dict[str, Any]]:
+        return await db[JOBS_COLLECTION].find_one({"_id": job_id})
+
+    def stats(self) -> Dict[str, Any]:
+        return {"workers": self.workers, "in_process": len(self._tasks), "kinds": sorted(self.handlers)}
+
+
+job_runner = JobRunner()
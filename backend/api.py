@@ -1,8 +1,16 @@
 from itertools import count
+import base64
+import csv
+import io
+import json
 import logging
 import os
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple, Union
 from fastapi import APIRouter, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from response_cache import cached_response, response_cache
+from metrics import render_metrics, track_llm, track_supabase
 
 
 logger = logging.getLogger(__name__)
@@ -11,11 +19,12 @@ router = APIRouter()
 
 #--------------------------------------------------Header Api endpoints ----------------------------------------------
 @router.get("/api/analytics/store-name/{store_id}", tags=["Headers"])
-def get_header(
+@cached_response("store-name")
+async def get_header(
     store_id: str
 ):
     try:
-        store_name=db.sellers.find_one(
+        store_name=await db.sellers.find_one(
             {"_id": ObjectId(store_id)},
             {"storeName": 1}
         )
@@ -32,9 +41,217 @@ def get_header(
 
 
 from bson import ObjectId
-from database import db , supabase_client 
+from database import async_db as db, get_supabase_client
+from category_cache import (
+    LRUTTLCache,
+    resolve_category_product_ids,
+    invalidate_category_products,
+    category_product_cache,
+    category_distribution
+)
+from rollups import plan_rollup_query, rollup_totals, rollup_monthly, rollup_unique_customers
+from live_kpis import LIVE_KPIS_ENABLED, live_kpi_status, read_live_kpis
+from order_search import build_search_filter, get_search_watermark
+from substitute_graph import get_substitute_rows
+
+ROLLUPS_ENABLED = os.getenv("ROLLUPS_ENABLED", "true").lower() in ("1", "true", "yes")
+
+
+async def build_orders_match_stage(
+    store_id: str,
+    date_from: str = None,
+    date_to: str = None,
+    status: str = None,
+    category_id: str = None
+) -> Dict[str, Any]:
+    """Build the orders $match shared by the KPI and chart endpoints"""
+    match_stage = {
+        "seller": ObjectId(store_id)
+    }
+
+    if status:
+        match_stage["status"] = status
+
+    if date_from or date_to:
+        date_filter = {}
+        if date_from:
+            date_filter["$gte"] = datetime.fromisoformat(date_from)
+        if date_to:
+            date_filter["$lte"] = datetime.fromisoformat(date_to)
+        match_stage["createdAt"] = date_filter
+
+    if category_id:
+        product_id_list = await resolve_category_product_ids(db, category_id)
+        match_stage["items._id"] = {"$in": product_id_list}
+
+    return match_stage
+
+
+async def get_rollup_plan(
+    match_stage: Dict[str, Any],
+    store_id: Union[str, List[str]],
+    date_from: str = None,
+    date_to: str = None,
+    status: str = None,
+    category_id: str = None
+) -> Optional[Dict[str, Any]]:
+    """Rollup-backed plan for the request, or None to aggregate raw orders"""
+    if not ROLLUPS_ENABLED:
+        return None
+    return await plan_rollup_query(db, match_stage, store_id, date_from, date_to, status, category_id)
+
+
+@router.get("/api/analytics/kpis/{store_id}", tags=["KPIS Cards"])
+async def get_kpis(
+    store_id: str,
+    date_from: str = Query(None),
+    date_to: str = Query(None),
+    status: str = Query(None),
+    category_id: str = Query(None)
+):
+    """All header KPI cards; unfiltered requests read the live counters when a consumer keeps them current"""
+    if LIVE_KPIS_ENABLED and not (date_from or date_to or status or category_id):
+        try:
+            live = await read_live_kpis(db, store_id)
+            if live is not None:
+                products_count = await db.products.count_documents({"seller": ObjectId(store_id)})
+                return {
+                    "store_id": store_id,
+                    "products_count": products_count,
+                    **live,
+                    "source": "live",
+                    "filters_applied": {
+                        "date_from": date_from,
+                        "date_to": date_to,
+                        "status": status,
+                        "category_id": category_id
+                    }
+                }
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to fetch KPIs: {str(e)}")
+
+    return await get_aggregated_kpis(store_id, date_from, date_to, status, category_id)
+
+
+@cached_response("kpis")
+async def get_aggregated_kpis(
+    store_id: str,
+    date_from: str = None,
+    date_to: str = None,
+    status: str = None,
+    category_id: str = None
+):
+    """All header KPI cards from one orders scan ($facet) plus one products count"""
+    try:
+        # Products card keeps its own filter semantics (no status, category OR subCategory)
+        product_match = {"seller": ObjectId(store_id)}
+        if date_from or date_to:
+            date_filter = {}
+            if date_from:
+                date_filter["$gte"] = datetime.fromisoformat(date_from)
+            if date_to:
+                date_filter["$lte"] = datetime.fromisoformat(date_to)
+            product_match["createdAt"] = date_filter
+        if category_id:
+            product_match["$or"] = [
+                {"category": ObjectId(category_id)},
+                {"subCategory": ObjectId(category_id)}
+            ]
+
+        products_count = await db.products.count_documents(product_match)
+
+        match_stage = await build_orders_match_stage(store_id, date_from, date_to, status, category_id)
+
+        pipeline = [
+            {"$match": match_stage},
+            {
+                "$facet": {
+                    "totals": [
+                        {
+                            "$group": {
+                                "_id": None,
+                                "totalOrders": {"$sum": 1},
+                                "totalRevenue": {"$sum": "$total"}
+                            }
+                        }
+                    ],
+                    "unique_customers": [
+                        {"$group": {"_id": "$customer.id"}},
+                        {"$match": {"_id": {"$ne": None}}},
+                        {"$count": "count"}
+                    ],
+                    "status_mix": [
+                        {"$group": {"_id": "$status", "orders": {"$sum": 1}}}
+                    ],
+                    "top_customer": [
+                        {
+                            "$group": {
+                                "_id": "$customer.id",
+                                "customerName": {"$first": "$customer.customerName"},
+                                "phoneNumber": {"$first": "$customer.phoneNumber"},
+                                "total_spent": {"$sum": "$total"},
+                                "orders_count": {"$sum": 1}
+                            }
+                        },
+                        # Guest orders pool under a null id; they aren't a customer (same as the live counters)
+                        {"$match": {"_id": {"$ne": None}}},
+                        {"$sort": {"total_spent": -1}},
+                        {"$limit": 1},
+                        {
+                            "$project": {
+                                "_id": 0,
+                                "customer_id": {"$toString": "$_id"},
+                                "customerName": 1,
+                                "phoneNumber": 1,
+                                "total_spent": 1,
+                                "orders_count": 1
+                            }
+                        }
+                    ]
+                }
+            }
+        ]
+
+        result = await db.orders.aggregate(pipeline).to_list(None)
+        row = result[0] if result else {}
+
+        totals = row.get("totals") or [{}]
+        total_orders = totals[0].get("totalOrders", 0)
+        total_revenue = totals[0].get("totalRevenue", 0)
+        unique = row.get("unique_customers") or [{}]
+        top = row.get("top_customer") or []
+        status_mix = {
+            str(s["_id"]) if s["_id"] is not None else "UNKNOWN": s["orders"]
+            for s in row.get("status_mix") or []
+        }
+
+        return {
+            "store_id": store_id,
+            "products_count": products_count,
+            "sales_count": total_orders,
+            "total_revenue": total_revenue,
+            "avg_order_value": (total_revenue / total_orders) if total_orders else 0,
+            "total_orders": total_orders,
+            "total_customers": total_orders,
+            "unique_customers": unique[0].get("count", 0),
+            "top_customer": top[0] if top else None,
+            "status_mix": status_mix,
+            "source": "orders",
+            "filters_applied": {
+                "date_from": date_from,
+                "date_to": date_to,
+                "status": status,
+                "category_id": category_id
+            }
+        }
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to fetch KPIs: {str(e)}")
+
+
 @router.get("/api/analytics/total-products/{store_id}", tags=["KPIS Cards"])
-def get_product_count(
+@cached_response("total-products")
+async def get_product_count(
     store_id: str,
     date_from: str = Query(None),
     date_to: str = Query(None),
@@ -66,7 +283,7 @@ def get_product_count(
                 {"subCategory": ObjectId(category_id)}
             ]
 
-        filtered_count = db.products.count_documents(match_stage)
+        filtered_count = await db.products.count_documents(match_stage)
 
 
         return {
@@ -89,7 +306,8 @@ def get_product_count(
 
 
 @router.get("/api/analytics/total-sales/{store_id}", tags=["KPIS Cards"])
-def get_total_sales(
+@cached_response("total-sales")
+async def get_total_sales(
     store_id: str,
     date_from: str = Query(None),
     date_to: str = Query(None),
@@ -97,33 +315,9 @@ def get_total_sales(
     category_id: str = Query(None)
 ):
     try:
-        # -------------------------
-        # WITH date filters
-        # -------------------------
-        match_stage = {
-            "seller": ObjectId(store_id)
-        }
-
-        if status:
-            match_stage["status"] = status
-
-        if date_from or date_to:
-            date_filter = {}
-            if date_from:
-                date_filter["$gte"] = datetime.fromisoformat(date_from)
-            if date_to:
-                date_filter["$lte"] = datetime.fromisoformat(date_to)
-            match_stage["createdAt"] = date_filter
-
-        if category_id:
-            product_ids = db.products.find(
-                {"category": ObjectId(category_id)},
-                {"_id": 1}
-            )
-            product_id_list = [p["_id"] for p in product_ids]
-            match_stage["items._id"] = {"$in": product_id_list}
+        match_stage = await build_orders_match_stage(store_id, date_from, date_to, status, category_id)
 
-        filtered_count = db.orders.count_documents(match_stage)
+        filtered_count = await db.orders.count_documents(match_stage)
 
         
 
@@ -143,7 +337,8 @@ def get_total_sales(
 
 
 @router.get("/api/analytics/total-revenue/{store_id}", tags=["KPIS Cards"])
-def get_total_revenue(
+@cached_response("total-revenue")
+async def get_total_revenue(
     store_id: str,
     date_from: str = Query(None),
     date_to: str = Query(None),
@@ -151,45 +346,24 @@ def get_total_revenue(
     category_id: str = Query(None)
 ):
     try:
-        match_stage = {
-            "seller": ObjectId(store_id)
-        }
-        
-        if status:
-            match_stage["status"] = status
-            
-        if date_from or date_to:
-            date_filter = {}
-            if date_from:
-                date_filter["$gte"] = datetime.fromisoformat(date_from)
-            if date_to:
-                date_filter["$lte"] = datetime.fromisoformat(date_to)
-            match_stage["createdAt"] = date_filter
-
-        # If category filter is provided
-        if category_id:
-            # Step 1: Get all product IDs for this category
-            product_ids = db.products.find(
-                {"category": ObjectId(category_id)},
-                {"_id": 1}
-            )
-            product_id_list = [product["_id"] for product in product_ids]
-            
-            # Step 2: Add items array filter to match stage
-            match_stage["items._id"] = {"$in": product_id_list}
+        match_stage = await build_orders_match_stage(store_id, date_from, date_to, status, category_id)
 
-        pipeline = [
-            {"$match": match_stage},
-            {
-                "$group": {
-                    "_id": None,
-                    "totalRevenue": {"$sum": "$total"}
+        plan = await get_rollup_plan(match_stage, store_id, date_from, date_to, status, category_id)
+        if plan:
+            revenue = (await rollup_totals(db, plan))["revenue"]
+        else:
+            pipeline = [
+                {"$match": match_stage},
+                {
+                    "$group": {
+                        "_id": None,
+                        "totalRevenue": {"$sum": "$total"}
+                    }
                 }
-            }
-        ]
+            ]
 
-        result = list(db.orders.aggregate(pipeline))
-        revenue = result[0]["totalRevenue"] if result else 0
+            result = await db.orders.aggregate(pipeline).to_list(None)
+            revenue = result[0]["totalRevenue"] if result else 0
 
         return {
             "store_id": store_id,
@@ -209,7 +383,8 @@ DEFAULT_MONTHS_WINDOW_DAYS = 365  # last 12 months
 
 
 @router.get("/api/analytics/avg-order-value/{store_id}", tags=["KPIS Cards"])
-def get_avg_order_value(
+@cached_response("avg-order-value")
+async def get_avg_order_value(
     store_id: str,
     date_from: str = Query(None),
     date_to: str = Query(None),
@@ -217,41 +392,28 @@ def get_avg_order_value(
     category_id: str = Query(None)
 ):
     try:
-        match_stage = {"seller": ObjectId(store_id)}
-
-        if status:
-            match_stage["status"] = status
-
-        if date_from or date_to:
-            date_filter = {}
-            if date_from:
-                date_filter["$gte"] = datetime.fromisoformat(date_from)
-            if date_to:
-                date_filter["$lte"] = datetime.fromisoformat(date_to)
-            match_stage["createdAt"] = date_filter
-
-        if category_id:
-            product_ids = db.products.find(
-                {"category": ObjectId(category_id)},
-                {"_id": 1}
-            )
-            product_id_list = [p["_id"] for p in product_ids]
-            match_stage["items._id"] = {"$in": product_id_list}
+        match_stage = await build_orders_match_stage(store_id, date_from, date_to, status, category_id)
 
-        pipeline = [
-            {"$match": match_stage},
-            {
-                "$group": {
-                    "_id": None,
-                    "totalOrders": {"$sum": 1},
-                    "totalRevenue": {"$sum": "$total"}
+        plan = await get_rollup_plan(match_stage, store_id, date_from, date_to, status, category_id)
+        if plan:
+            totals = await rollup_totals(db, plan)
+            total_orders = totals["orders"]
+            total_revenue = totals["revenue"]
+        else:
+            pipeline = [
+                {"$match": match_stage},
+                {
+                    "$group": {
+                        "_id": None,
+                        "totalOrders": {"$sum": 1},
+                        "totalRevenue": {"$sum": "$total"}
+                    }
                 }
-            }
-        ]
+            ]
 
-        result = list(db.orders.aggregate(pipeline))
-        total_orders = result[0]["totalOrders"] if result else 0
-        total_revenue = result[0]["totalRevenue"] if result else 0
+            result = await db.orders.aggregate(pipeline).to_list(None)
+            total_orders = result[0]["totalOrders"] if result else 0
+            total_revenue = result[0]["totalRevenue"] if result else 0
         avg_order_value = (total_revenue / total_orders) if total_orders else 0
 
         return {
@@ -272,7 +434,8 @@ def get_avg_order_value(
 
 
 @router.get("/api/analytics/avg-sales-per-month/{store_id}", tags=["KPIS Cards"])
-def get_avg_sales_per_month(
+@cached_response("avg-sales-per-month")
+async def get_avg_sales_per_month(
     store_id: str,
     date_from: str = Query(None),
     date_to: str = Query(None),
@@ -280,57 +443,52 @@ def get_avg_sales_per_month(
     category_id: str = Query(None)
 ):
     try:
-        match_stage = {"seller": ObjectId(store_id)}
-
-        if status:
-            match_stage["status"] = status
-
-        if date_from or date_to:
-            date_filter = {}
-            if date_from:
-                date_filter["$gte"] = datetime.fromisoformat(date_from)
-            if date_to:
-                date_filter["$lte"] = datetime.fromisoformat(date_to)
-            match_stage["createdAt"] = date_filter
-
-        if category_id:
-            product_ids = db.products.find(
-                {"category": ObjectId(category_id)},
-                {"_id": 1}
-            )
-            product_id_list = [p["_id"] for p in product_ids]
-            match_stage["items._id"] = {"$in": product_id_list}
-
-        pipeline = [
-            {"$match": match_stage},
-            {
-                "$group": {
-                    "_id": {
-                        "year": {"$year": "$createdAt"},
-                        "month": {"$month": "$createdAt"}
-                    },
-                    "sales": {"$sum": 1}
-                }
-            },
-            {"$sort": {"_id.year": 1, "_id.month": 1}},
-            {
-                "$group": {
-                    "_id": None,
-                    "months_count": {"$sum": 1},
-                    "total_sales": {"$sum": "$sales"},
-                    "avg_sales_per_month": {"$avg": "$sales"},
-                    "by_month": {
-                        "$push": {
-                            "year": "$_id.year",
-                            "month": "$_id.month",
-                            "sales": "$sales"
+        match_stage = await build_orders_match_stage(store_id, date_from, date_to, status, category_id)
+
+        plan = await get_rollup_plan(match_stage, store_id, date_from, date_to, status, category_id)
+        if plan:
+            by_month = [
+                {"year": m["year"], "month": m["month"], "sales": m["orders"]}
+                for m in await rollup_monthly(db, plan)
+                if m["orders"]
+            ]
+            result = [{
+                "months_count": len(by_month),
+                "total_sales": sum(m["sales"] for m in by_month),
+                "avg_sales_per_month": sum(m["sales"] for m in by_month) / len(by_month),
+                "by_month": by_month
+            }] if by_month else []
+        else:
+            pipeline = [
+                {"$match": match_stage},
+                {
+                    "$group": {
+                        "_id": {
+                            "year": {"$year": "$createdAt"},
+                            "month": {"$month": "$createdAt"}
+                        },
+                        "sales": {"$sum": 1}
+                    }
+                },
+                {"$sort": {"_id.year": 1, "_id.month": 1}},
+                {
+                    "$group": {
+                        "_id": None,
+                        "months_count": {"$sum": 1},
+                        "total_sales": {"$sum": "$sales"},
+                        "avg_sales_per_month": {"$avg": "$sales"},
+                        "by_month": {
+                            "$push": {
+                                "year": "$_id.year",
+                                "month": "$_id.month",
+                                "sales": "$sales"
+                            }
                         }
                     }
                 }
-            }
-        ]
+            ]
 
-        result = list(db.orders.aggregate(pipeline))
+            result = await db.orders.aggregate(pipeline).to_list(None)
         if not result:
             return {
                 "store_id": store_id,
@@ -368,7 +526,8 @@ def get_avg_sales_per_month(
 
 
 @router.get("/api/analytics/total-customers/{store_id}", tags=["KPIS Cards"])
-def get_total_customers(
+@cached_response("total-customers")
+async def get_total_customers(
     store_id: str,
     date_from: str = Query(None),
     date_to: str = Query(None),
@@ -376,31 +535,9 @@ def get_total_customers(
     category_id: str = Query(None)
 ):
     try:
-        match_stage = {
-            "seller": ObjectId(store_id)
-        }
-        
-        if status:
-            match_stage["status"] = status
-
-        # Date range filter using createdAt
-        if date_from or date_to:
-            date_filter = {}
-            if date_from:
-                date_filter["$gte"] = datetime.fromisoformat(date_from)
-            if date_to:
-                date_filter["$lte"] = datetime.fromisoformat(date_to)
-            match_stage["createdAt"] = date_filter
-
-        if category_id:
-            product_ids = db.products.find(
-                {"category": ObjectId(category_id)},
-                {"_id": 1}
-            )
-            product_id_list = [product["_id"] for product in product_ids]
-            match_stage["items._id"] = {"$in": product_id_list}
+        match_stage = await build_orders_match_stage(store_id, date_from, date_to, status, category_id)
 
-        total = db.orders.count_documents(match_stage)
+        total = await db.orders.count_documents(match_stage)
 
         return {
             "store_id": store_id,
@@ -418,71 +555,47 @@ def get_total_customers(
     
 
 @router.get("/api/analytics/unique-customers/{store_id}", tags=["KPIS Cards"])
-def get_unique_customers(
+@cached_response("unique-customers")
+async def get_unique_customers(
     store_id: str,
     date_from: str = Query(None),
     date_to: str = Query(None),
     status: str = Query(None),
-    category_id: str = Query(None)
+    category_id: str = Query(None),
+    mode: str = Query("exact", pattern="^(exact|approx)$", description="approx: merge daily HyperLogLog sketches (~1.6% error)")
 ):
+    """Distinct customer ids; guest orders (no customer id) are not counted, in either mode"""
     try:
-        # Base match
-        match_stage = {
-            "seller": ObjectId(store_id)
-        }
-
-        # Status filter
-        if status:
-            match_stage["status"] = status
-
-        # Date range filter
-        if date_from or date_to:
-            date_filter = {}
-            if date_from:
-                date_filter["$gte"] = datetime.fromisoformat(date_from)
-            if date_to:
-                date_filter["$lte"] = datetime.fromisoformat(date_to)
-            match_stage["createdAt"] = date_filter
-
-        # If category filter is provided
-        if category_id:
-            # Step 1: Get all product IDs for this category
-            product_ids = db.products.find(
-                {"category": ObjectId(category_id)},
-                {"_id": 1}
-            )
-            product_id_list = [product["_id"] for product in product_ids]
-            
-            # Step 2: Add items array filter to match stage
-            match_stage["items._id"] = {"$in": product_id_list}
-
-        pipeline = [
-            {"$match": match_stage},
-            {
-                "$group": {
-                    "_id": None,
-                    "uniqueCustomers": {"$addToSet": "$customer.id"}
-                }
-            },
-            {
-                "$project": {
-                    "_id": 0,
-                    "count": {"$size": "$uniqueCustomers"}
-                }
-            }
-        ]
-
-        result = list(db.orders.aggregate(pipeline))
-        count = result[0]["count"] if result else 0
+        match_stage = await build_orders_match_stage(store_id, date_from, date_to, status, category_id)
+
+        count = None
+        if mode == "approx":
+            plan = await get_rollup_plan(match_stage, store_id, date_from, date_to, status, category_id)
+            if plan is not None:
+                count = await rollup_unique_customers(db, plan)
+
+        approximate = count is not None
+        if count is None:
+            # One group per customer, then count them: no single document holds every id
+            pipeline = [
+                {"$match": match_stage},
+                {"$group": {"_id": "$customer.id"}},
+                {"$match": {"_id": {"$ne": None}}},
+                {"$count": "count"}
+            ]
+            result = await db.orders.aggregate(pipeline).to_list(None)
+            count = result[0]["count"] if result else 0
 
         return {
             "store_id": store_id,
             "unique_customers": count,
+            "approximate": approximate,
             "filters_applied": {
                 "date_from": date_from,
                 "date_to": date_to,
                 "status": status,
-                "category_id": category_id
+                "category_id": category_id,
+                "mode": mode
             }
         }
 
@@ -491,7 +604,8 @@ def get_unique_customers(
     
 
 @router.get("/api/analytics/top-customers/{store_id}", tags=["KPIS Cards"])
-def get_top_customers(
+@cached_response("top-customers")
+async def get_top_customers(
     store_id: str,
     date_from: str = Query(None),
     date_to: str = Query(None),
@@ -500,29 +614,7 @@ def get_top_customers(
     limit: int = Query(10, ge=1, le=100)
 ):
     try:
-        match_stage = {
-            "seller": ObjectId(store_id)
-        }
-
-        if status:
-            match_stage["status"] = status
-
-        if date_from or date_to:
-            date_filter = {}
-            if date_from:
-                date_filter["$gte"] = datetime.fromisoformat(date_from)
-            if date_to:
-                date_filter["$lte"] = datetime.fromisoformat(date_to)
-            match_stage["createdAt"] = date_filter
-
-        # Category filter (same approach as your working endpoints)
-        if category_id:
-            product_ids = db.products.find(
-                {"category": ObjectId(category_id)},
-                {"_id": 1}
-            )
-            product_id_list = [p["_id"] for p in product_ids]
-            match_stage["items._id"] = {"$in": product_id_list}
+        match_stage = await build_orders_match_stage(store_id, date_from, date_to, status, category_id)
 
         pipeline = [
             {"$match": match_stage},
@@ -549,7 +641,7 @@ def get_top_customers(
             }
         ]
 
-        top_customers = list(db.orders.aggregate(pipeline))
+        top_customers = await db.orders.aggregate(pipeline).to_list(None)
 
         return {
             "store_id": store_id,
@@ -574,7 +666,8 @@ def get_top_customers(
 
 
 @router.get("/api/analytics/monthly-revenue/{store_id}", tags=["Analytics"])
-def get_monthly_revenue(
+@cached_response("monthly-revenue")
+async def get_monthly_revenue(
     store_id: str,
     date_from: str = Query(None),
     date_to: str = Query(None),
@@ -582,60 +675,322 @@ def get_monthly_revenue(
     category_id: str = Query(None)
 ):
     try:
-        match_stage = {
-            "seller": ObjectId(store_id)
-        }
-        if status:
-            match_stage["status"] = status
+        match_stage = await build_orders_match_stage(store_id, date_from, date_to, status, category_id)
+
+        plan = await get_rollup_plan(match_stage, store_id, date_from, date_to, status, category_id)
+        if plan:
+            formatted = [
+                {
+                    "year": m["year"],
+                    "month": m["month"],
+                    "total_revenue": m["revenue"]
+                }
+                for m in await rollup_monthly(db, plan)
+                if m["orders"]
+            ]
+        else:
+            pipeline = [
+                {"$match": match_stage},
+                {
+                    "$group": {
+                        "_id": {
+                            "year": {"$year": "$createdAt"},
+                            "month": {"$month": "$createdAt"}
+                        },
+                        "totalRevenue": {"$sum": "$total"}
+                    }
+                },
+                {
+                    "$sort": {
+                        "_id.year": 1,
+                        "_id.month": 1
+                    }
+                }
+            ]
 
-        if date_from or date_to:
-            date_filter = {}
-            if date_from:
-                date_filter["$gte"] = datetime.fromisoformat(date_from)
-            if date_to:
-                date_filter["$lte"] = datetime.fromisoformat(date_to)
-            match_stage["createdAt"] = date_filter
-        if category_id:
-            product_ids = db.products.find(
-                {"category": ObjectId(category_id)},
-                {"_id": 1}
-            )
-            product_id_list = [product["_id"] for product in product_ids]
-            match_stage["items._id"] = {"$in": product_id_list}
+            result = await db.orders.aggregate(pipeline).to_list(None)
 
-        pipeline = [
-            {"$match": match_stage},
-            {
-                "$group": {
-                    "_id": {
-                        "year": {"$year": "$createdAt"},
-                        "month": {"$month": "$createdAt"}
-                    },
-                    "totalRevenue": {"$sum": "$total"}
-                }
-            },
-            {
-                "$sort": {
-                    "_id.year": 1,
-                    "_id.month": 1
+            formatted = [
+                {
+                    "year": item["_id"]["year"],
+                    "month": item["_id"]["month"],
+                    "total_revenue": item["totalRevenue"]
                 }
+                for item in result
+            ]
+
+        return {
+            "store_id": store_id,
+            "monthly_revenue": formatted,
+            "filters_applied": {
+                "date_from": date_from,
+                "date_to": date_to,
+                "status": status,
+                "category_id": category_id
             }
-        ]
+        }
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to fetch monthly revenue: {str(e)}")
 
-        result = list(db.orders.aggregate(pipeline))
 
-        formatted = [
-            {
-                "year": item["_id"]["year"],
-                "month": item["_id"]["month"],
-                "total_revenue": item["totalRevenue"]
+#-------------------------------------------------- REVENUE TIME SERIES --------------------------------------------------------------------
+
+from datetime import date, datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from rollups import STORE_TIMEZONE, hour_of_week_pipeline, rollup_daily, rollup_hour_of_week
+
+TIMESERIES_GRANULARITIES = ("day", "week", "month")
+WEEK_STARTS = {"monday": 0, "sunday": 6}
+
+
+def get_store_zone(tz: Optional[str]) -> ZoneInfo:
+    try:
+        return ZoneInfo(tz or STORE_TIMEZONE)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise HTTPException(status_code=400, detail=f"Unknown timezone: {tz or STORE_TIMEZONE}")
+
+
+def to_store_time(value: str, zone: ZoneInfo) -> datetime:
+    """ISO date/datetime from the query string; naive values are wall time in the store's zone"""
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=zone)
+
+
+# IANA names that are UTC for their whole history; sampling offsets can't prove that
+UTC_ZONE_KEYS = {
+    "UTC", "Etc/UTC", "UCT", "Etc/UCT", "Universal", "Etc/Universal", "Zulu", "Etc/Zulu",
+    "GMT", "Etc/GMT", "GMT0", "Etc/GMT0", "GMT+0", "Etc/GMT+0", "GMT-0", "Etc/GMT-0",
+    "Greenwich", "Etc/Greenwich"
+}
+
+
+def _is_utc(zone: ZoneInfo) -> bool:
+    # Daily rollups are cut at UTC midnight, so they only line up with zones that never leave +00:00
+    return zone.key in UTC_ZONE_KEYS
+
+
+def _week_start(day: date, week_start: int) -> date:
+    return day - timedelta(days=(day.weekday() - week_start) % 7)
+
+
+def _next_month(day: date) -> date:
+    return date(day.year + day.month // 12, day.month % 12 + 1, 1)
+
+
+def fill_revenue_series(
+    days: Dict[date, List[float]],
+    first: Optional[date],
+    last: Optional[date],
+    week_start: int,
+    granularities: List[str]
+) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Fold local-day buckets into the requested granularities and fill every
+    empty bucket between first and last (defaults: first/last day with orders).
+    """
+    if first is None:
+        first = min(days) if days else None
+    if last is None:
+        last = max(days) if days else None
+    if first is None or last is None or first > last:
+        return {g: [] for g in granularities}
+
+    bucket_of = {
+        "day": lambda d: d,
+        "week": lambda d: _week_start(d, week_start),
+        "month": lambda d: d.replace(day=1)
+    }
+    step = {
+        "day": lambda d: d + timedelta(days=1),
+        "week": lambda d: d + timedelta(days=7),
+        "month": _next_month
+    }
+
+    series = {}
+    for granularity in granularities:
+        totals: Dict[date, List[float]] = {}
+        for day, (orders, revenue) in days.items():
+            if first <= day <= last:
+                bucket = totals.setdefault(bucket_of[granularity](day), [0, 0])
+                bucket[0] += orders
+                bucket[1] += revenue
+
+        points = []
+        period, end = bucket_of[granularity](first), bucket_of[granularity](last)
+        while period <= end:
+            orders, revenue = totals.get(period, (0, 0))
+            points.append({
+                "period": period.isoformat(),
+                "orders": orders,
+                "revenue": round(revenue, 2),
+                "avg_order_value": round(revenue / orders, 2) if orders else 0
+            })
+            period = step[granularity](period)
+        series[granularity] = points
+    return series
+
+
+@router.get("/api/analytics/revenue-timeseries/{store_id}", tags=["Analytics"])
+@cached_response("revenue-timeseries", local_dates=True)
+async def get_revenue_timeseries(
+    store_id: str,
+    granularity: str = Query("day,week,month", description="Comma-separated: day, week, month"),
+    tz: str = Query(None, description="IANA timezone for bucket boundaries (default STORE_TIMEZONE)"),
+    week_start: str = Query("monday", pattern="^(monday|sunday)$"),
+    date_from: str = Query(None, description="Naive values are store-local"),
+    date_to: str = Query(None, description="Naive values are store-local"),
+    status: str = Query(None),
+    category_id: str = Query(None)
+):
+    """
+    Revenue and order counts per store-local day, week and month from one
+    aggregation: orders are grouped by local day once and folded into weeks
+    and months here, so every granularity (gaps filled with zeros) comes
+    back in a single response and switching charts needs no new scan.
+    """
+    granularities = [g.strip() for g in granularity.split(",") if g.strip()]
+    unknown = [g for g in granularities if g not in TIMESERIES_GRANULARITIES]
+    if unknown or not granularities:
+        raise HTTPException(status_code=400, detail=f"Unknown granularity: {', '.join(unknown) or '(none)'}")
+    zone = get_store_zone(tz)
+    try:
+        start = to_store_time(date_from, zone) if date_from else None
+        end = to_store_time(date_to, zone) if date_to else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid date: {str(e)}")
+
+    try:
+        iso_from = start.isoformat() if start else None
+        iso_to = end.isoformat() if end else None
+        match_stage = await build_orders_match_stage(store_id, iso_from, iso_to, status, category_id)
+
+        plan = None
+        if _is_utc(zone):
+            plan = await get_rollup_plan(match_stage, store_id, iso_from, iso_to, status, category_id)
+
+        if plan:
+            rows = [(d["day"], d["orders"], d["revenue"]) for d in await rollup_daily(db, plan) if d["orders"]]
+        else:
+            pipeline = [
+                {"$match": match_stage},
+                {
+                    "$group": {
+                        "_id": {"$dateTrunc": {"date": "$createdAt", "unit": "day", "timezone": zone.key}},
+                        "orders": {"$sum": 1},
+                        "revenue": {"$sum": "$total"}
+                    }
+                }
+            ]
+            rows = [(item["_id"], item["orders"], item["revenue"]) async for item in db.orders.aggregate(pipeline)]
+
+        days: Dict[date, List[float]] = {}
+        for bucket, orders, revenue in rows:
+            # Buckets come back as the UTC instant of local midnight
+            day = bucket.replace(tzinfo=timezone.utc).astimezone(zone).date()
+            totals = days.setdefault(day, [0, 0])
+            totals[0] += orders
+            totals[1] += revenue or 0
+
+        series = fill_revenue_series(
+            days,
+            start.astimezone(zone).date() if start else None,
+            end.astimezone(zone).date() if end else None,
+            WEEK_STARTS[week_start],
+            granularities
+        )
+
+        return {
+            "store_id": store_id,
+            "timezone": zone.key,
+            "week_start": week_start,
+            "series": series,
+            "source": "rollups" if plan else "orders",
+            "filters_applied": {
+                "date_from": date_from,
+                "date_to": date_to,
+                "status": status,
+                "category_id": category_id
             }
-            for item in result
-        ]
+        }
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to fetch revenue time series: {str(e)}")
+
+
+#-------------------------------------------------- HOUR-OF-WEEK HEATMAP --------------------------------------------------------------------
+
+WEEKDAY_NAMES = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+# Local-hour bands of sales-by-time-period; every other hour is Night
+TIME_PERIOD_BANDS = (("Morning", 6, 12), ("Afternoon", 12, 18), ("Evening", 18, 21))
+
+
+def time_period_band(hour: int) -> str:
+    for name, start, end in TIME_PERIOD_BANDS:
+        if start <= hour < end:
+            return name
+    return "Night"
+
+
+async def hour_of_week_totals(
+    match_stage: Dict[str, Any],
+    store_id: str,
+    date_from: Optional[str],
+    date_to: Optional[str],
+    status: Optional[str],
+    category_id: Optional[str],
+    tz: str
+) -> Tuple[Dict[int, List[float]], str]:
+    """({slot: [orders, revenue, amount received]}, source); slot = local weekday * 24 + local hour"""
+    plan = await get_rollup_plan(match_stage, store_id, date_from, date_to, status, category_id)
+    if plan:
+        slots = await rollup_hour_of_week(db, plan, tz)
+        if slots is not None:
+            return slots, "rollups"
+
+    slots = {}
+    async for row in db.orders.aggregate(hour_of_week_pipeline(match_stage, tz)):
+        slots[row["_id"]] = [row["orders"], row["revenue"], row["received"] or 0]
+    return slots, "orders"
+
+
+@router.get("/api/analytics/sales-heatmap/{store_id}", tags=["Analytics"])
+@cached_response("sales-heatmap", local_dates=True)
+async def get_sales_heatmap(
+    store_id: str,
+    tz: str = Query(None, description="IANA timezone (default STORE_TIMEZONE)"),
+    date_from: str = Query(None, description="Naive values are store-local"),
+    date_to: str = Query(None, description="Naive values are store-local"),
+    status: str = Query(None),
+    category_id: str = Query(None)
+):
+    """7x24 order count and revenue by store-local weekday (Monday first) and hour"""
+    zone = get_store_zone(tz)
+    try:
+        start = to_store_time(date_from, zone) if date_from else None
+        end = to_store_time(date_to, zone) if date_to else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid date: {str(e)}")
+
+    try:
+        iso_from = start.isoformat() if start else None
+        iso_to = end.isoformat() if end else None
+        match_stage = await build_orders_match_stage(store_id, iso_from, iso_to, status, category_id)
+        slots, source = await hour_of_week_totals(match_stage, store_id, iso_from, iso_to, status, category_id, zone.key)
+
+        orders = [[0] * 24 for _ in WEEKDAY_NAMES]
+        revenue = [[0] * 24 for _ in WEEKDAY_NAMES]
+        for slot, (slot_orders, slot_revenue, _) in slots.items():
+            orders[slot // 24][slot % 24] = slot_orders
+            revenue[slot // 24][slot % 24] = round(slot_revenue, 2)
 
         return {
             "store_id": store_id,
-            "monthly_revenue": formatted,
+            "timezone": zone.key,
+            "days": WEEKDAY_NAMES,
+            "orders": orders,
+            "revenue": revenue,
+            "source": source,
             "filters_applied": {
                 "date_from": date_from,
                 "date_to": date_to,
@@ -645,7 +1000,8 @@ def get_monthly_revenue(
         }
 
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to fetch monthly revenue: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to fetch sales heatmap: {str(e)}")
+
 
 
 
@@ -654,75 +1010,31 @@ def get_monthly_revenue(
 
 
 @router.get("/api/analytics/sales-by-time-period/{store_id}", tags=["Analytics"])
-def get_sales_by_time_period(
+@cached_response("sales-by-time-period")
+async def get_sales_by_time_period(
     store_id: str,
     date_from: str = Query(None),
     date_to: str = Query(None),
     status: str = Query(None),
-    category_id: str = Query(None)
+    category_id: str = Query(None),
+    tz: str = Query(None, description="IANA timezone of the hour bands (default UTC; pass STORE_TIMEZONE for store-local bands)")
 ):
+    """Orders and amount received per Morning / Afternoon / Evening / Night band of the day"""
+    # UTC unless asked: STORE_TIMEZONE (set for the heatmap) must not reshuffle the existing bands
+    zone = get_store_zone(tz or "UTC")
     try:
-        store_obj_id = ObjectId(store_id)
-
-        match_stage = {
-            "seller": store_obj_id
-        }
-        if status:
-            match_stage["status"] = status
-        else:
-            match_stage["status"] = "COMPLETED"
-        if date_from or date_to:
-            date_filter = {}
-            if date_from:
-                date_filter["$gte"] = datetime.fromisoformat(date_from)
-            if date_to:
-                date_filter["$lte"] = datetime.fromisoformat(date_to)
-            match_stage["createdAt"] = date_filter
-        if category_id:
-            product_ids = db.products.find(
-                {"category": ObjectId(category_id)},
-                {"_id": 1}
-            )
-            product_id_list = [product["_id"] for product in product_ids]
-            match_stage["items._id"] = {"$in": product_id_list}
+        status = status or "COMPLETED"
+        match_stage = await build_orders_match_stage(store_id, date_from, date_to, status, category_id)
 
-        pipeline = [
-            {"$match": match_stage},
-            {
-                "$project": {
-                    "hour": {"$hour": "$createdAt"},
-                    "amount": "$amountReceived"
-                }
-            },
-            {
-                "$group": {
-                    "_id": {
-                        "$switch": {
-                            "branches": [
-                                {
-                                    "case": {"$and": [{"$gte": ["$hour", 6]}, {"$lt": ["$hour", 12]}]},
-                                    "then": "Morning"
-                                },
-                                {
-                                    "case": {"$and": [{"$gte": ["$hour", 12]}, {"$lt": ["$hour", 18]}]},
-                                    "then": "Afternoon"
-                                },
-                                {
-                                    "case": {"$and": [{"$gte": ["$hour", 18]}, {"$lt": ["$hour", 21]}]},
-                                    "then": "Evening"
-                                }
-                            ],
-                            "default": "Night"
-                        }
-                    },
-                    "orders_count": {"$sum": 1},
-                    "total_revenue": {"$sum": "$amount"}
-                }
-            },
-            {"$sort": {"_id": 1}}
-        ]
+        # Folded from the hour-of-week slots instead of a $switch over raw orders
+        slots, _ = await hour_of_week_totals(match_stage, store_id, date_from, date_to, status, category_id, zone.key)
+        bands: Dict[str, Dict[str, Any]] = {}
+        for slot, (orders, _, received) in slots.items():
+            band = bands.setdefault(time_period_band(slot % 24), {"orders_count": 0, "total_revenue": 0})
+            band["orders_count"] += orders
+            band["total_revenue"] += received
 
-        data = list(db.orders.aggregate(pipeline))
+        data = [{"_id": name, **bands[name]} for name in sorted(bands)]
 
         return {
             "store_id": store_id,
@@ -730,8 +1042,9 @@ def get_sales_by_time_period(
             "filters_applied": {
                 "date_from": date_from,
                 "date_to": date_to,
-                "status": status if status else "COMPLETED",
-                "category_id": category_id
+                "status": status,
+                "category_id": category_id,
+                "tz": zone.key
             }
         }
 
@@ -740,7 +1053,8 @@ def get_sales_by_time_period(
     
 
 @router.get("/api/analytics/products-by-category/{store_id}", tags=["Analytics"])
-def get_products_by_category(
+@cached_response("products-by-category")
+async def get_products_by_category(
     store_id: str,
     date_from: str = Query(None),
     date_to: str = Query(None),
@@ -748,79 +1062,9 @@ def get_products_by_category(
     category_id: str = Query(None, description="Filter by specific category")
 ):
     try:
-        store_obj_id = ObjectId(store_id)
-        
-        match_stage = {
-            "seller": store_obj_id
-        }
-        
-        if status:
-            match_stage["status"] = status
-        
-        if date_from or date_to:
-            date_filter = {}
-            if date_from:
-                date_filter["$gte"] = datetime.fromisoformat(date_from)
-            if date_to:
-                date_filter["$lte"] = datetime.fromisoformat(date_to)
-            match_stage["createdAt"] = date_filter
-        
-        # Add category filter if provided
-        if category_id:
-            product_ids = db.products.find(
-                {"category": ObjectId(category_id)},
-                {"_id": 1}
-            )
-            product_id_list = [product["_id"] for product in product_ids]
-            match_stage["items._id"] = {"$in": product_id_list}
-
-        pipeline = [
-            {"$match": match_stage},
-            {"$unwind": "$items"},
-            {
-                "$lookup": {
-                    "from": "products",
-                    "localField": "items._id",
-                    "foreignField": "_id",
-                    "as": "product_info"
-                }
-            },
-            {"$unwind": "$product_info"},
-            {
-                "$lookup": {
-                    "from": "categories",
-                    "localField": "product_info.category",
-                    "foreignField": "_id",
-                    "as": "category_info"
-                }
-            },
-            {"$unwind": "$category_info"},
-            {
-                "$group": {
-                    "_id": "$product_info.category",
-                    "category_name": {"$first": "$category_info.name"},
-                    "product_count": {"$addToSet": "$items._id"},
-                    "order_count": {"$sum": 1},
-                    "total_revenue": {"$sum": "$items.subTotal"},
-                    "total_quantity": {"$sum": "$items.quantity"}
-                }
-            },
-            {
-                "$project": {
-                    "_id": 0,
-                    "category_id": {"$toString": "$_id"},
-                    "category_name": 1,
-                    "product_count": {"$size": "$product_count"},
-                    "order_count": 1,
-                    "total_revenue": {"$round": ["$total_revenue", 2]},
-                    "total_stock_value": {"$round": ["$total_revenue", 2]},
-                    "total_quantity": 1
-                }
-            },
-            {"$sort": {"order_count": -1}}
-        ]
+        match_stage = await build_orders_match_stage(store_id, date_from, date_to, status, category_id)
 
-        result = list(db.orders.aggregate(pipeline))
+        result = await category_distribution(db, store_id, match_stage)
 
         return {
             "store_id": store_id,
@@ -840,7 +1084,8 @@ def get_products_by_category(
         
 
 @router.get("/api/analytics/top-selling-products/{store_id}", tags=["Analytics"])
-def get_top_selling_products(
+@cached_response("top-selling-products")
+async def get_top_selling_products(
     store_id: str,
     date_from: str = Query(None),
     date_to: str = Query(None),
@@ -849,27 +1094,7 @@ def get_top_selling_products(
     limit: int = Query(5, description="Number of top products to return")
 ):
     try:
-        store_obj_id = ObjectId(store_id)
-        match_conditions = {"seller": store_obj_id}
-        if status:
-            match_conditions["status"] = status
-        # else:
-        #     match_conditions["status"] = "COMPLETED"
-        if date_from or date_to:
-            date_filter = {}
-            if date_from:
-                date_filter["$gte"] = datetime.fromisoformat(date_from)
-            if date_to:
-                date_filter["$lte"] = datetime.fromisoformat(date_to)
-            match_conditions["createdAt"] = date_filter
-
-        if category_id:
-            product_ids = db.products.find(
-                {"category": ObjectId(category_id)},
-                {"_id": 1}
-            )
-            product_id_list = [product["_id"] for product in product_ids]
-            match_conditions["items._id"] = {"$in": product_id_list}
+        match_conditions = await build_orders_match_stage(store_id, date_from, date_to, status, category_id)
 
         pipeline = [
             {"$match": match_conditions},
@@ -896,177 +1121,533 @@ def get_top_selling_products(
                     "total_revenue": {"$round": ["$total_revenue", 2]},
                     "product_image": 1
                 }
-            }
-        ]
+            }
+        ]
+
+        result = await db.orders.aggregate(pipeline).to_list(None)
+
+        return {
+            "store_id": store_id,
+            "top_products_count": len(result),
+            "filters_applied": {
+                "date_from": date_from,
+                "date_to": date_to,
+                "status": status if status else "COMPLETED",
+                "category_id": category_id,
+                "limit": limit
+            },
+            "top_selling_products": result
+        }
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to fetch top selling products: {str(e)}")
+
+
+from datetime import datetime, timedelta
+from bson import ObjectId
+from fastapi import HTTPException
+
+#-------------------------------------------------- MULTI-STORE (CHAIN) ENDPOINTS --------------------------------------------------------------------
+
+MULTI_STORE_MAX_STORES = int(os.getenv("MULTI_STORE_MAX_STORES", "100"))
+
+
+def parse_store_ids(store_ids: str) -> List[str]:
+    """Comma-separated seller ids -> unique, validated list (400 on a bad id or too many)"""
+    ids = list(dict.fromkeys(s.strip() for s in store_ids.split(",") if s.strip()))
+    if not ids:
+        raise HTTPException(status_code=400, detail="store_ids is empty")
+    if len(ids) > MULTI_STORE_MAX_STORES:
+        raise HTTPException(status_code=400, detail=f"At most {MULTI_STORE_MAX_STORES} stores per request")
+    for store_id in ids:
+        try:
+            validate_store_id(store_id)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    return ids
+
+
+async def build_multi_store_match_stage(
+    store_ids: List[str],
+    date_from: str = None,
+    date_to: str = None,
+    status: str = None,
+    category_id: str = None
+) -> Dict[str, Any]:
+    """The single-store orders $match with the seller widened to the whole list"""
+    match_stage = await build_orders_match_stage(store_ids[0], date_from, date_to, status, category_id)
+    match_stage["seller"] = {"$in": [ObjectId(s) for s in store_ids]}
+    return match_stage
+
+
+async def get_store_names(store_ids: List[str]) -> Dict[str, str]:
+    cursor = db.sellers.find({"_id": {"$in": [ObjectId(s) for s in store_ids]}}, {"storeName": 1})
+    return {str(seller["_id"]): seller.get("storeName", "Unknown") async for seller in cursor}
+
+
+def _kpi_figures(products_count: int, total_orders: int, total_revenue: float, unique_customers: int, top_customer) -> Dict[str, Any]:
+    """Same fields as /api/analytics/kpis"""
+    return {
+        "products_count": products_count,
+        "sales_count": total_orders,
+        "total_revenue": total_revenue,
+        "avg_order_value": (total_revenue / total_orders) if total_orders else 0,
+        "total_orders": total_orders,
+        "total_customers": total_orders,
+        "unique_customers": unique_customers,
+        "top_customer": top_customer
+    }
+
+
+@router.get("/api/analytics/multi-store/kpis", tags=["Multi-store"])
+@cached_response("multi-store-kpis")
+async def get_multi_store_kpis(
+    store_ids: str = Query(..., description="Comma-separated seller ids"),
+    date_from: str = Query(None),
+    date_to: str = Query(None),
+    status: str = Query(None),
+    category_id: str = Query(None)
+):
+    """KPI cards for many stores from one orders aggregation grouped by seller, plus the chain totals"""
+    ids = parse_store_ids(store_ids)
+    try:
+        sellers = [ObjectId(s) for s in ids]
+
+        product_match: Dict[str, Any] = {"seller": {"$in": sellers}}
+        if date_from or date_to:
+            date_filter = {}
+            if date_from:
+                date_filter["$gte"] = datetime.fromisoformat(date_from)
+            if date_to:
+                date_filter["$lte"] = datetime.fromisoformat(date_to)
+            product_match["createdAt"] = date_filter
+        if category_id:
+            product_match["$or"] = [
+                {"category": ObjectId(category_id)},
+                {"subCategory": ObjectId(category_id)}
+            ]
+        products = {
+            row["_id"]: row["count"]
+            async for row in db.products.aggregate([
+                {"$match": product_match},
+                {"$group": {"_id": "$seller", "count": {"$sum": 1}}}
+            ])
+        }
+
+        match_stage = await build_multi_store_match_stage(ids, date_from, date_to, status, category_id)
+
+        top_customer_fields = {
+            "customerName": {"$first": "$customer.customerName"},
+            "phoneNumber": {"$first": "$customer.phoneNumber"},
+            "total_spent": {"$sum": "$total"},
+            "orders_count": {"$sum": 1}
+        }
+        top_customer_projection = {
+            "customer_id": {"$toString": "$customer_id"},
+            "customerName": 1,
+            "phoneNumber": 1,
+            "total_spent": 1,
+            "orders_count": 1
+        }
+
+        pipeline = [
+            {"$match": match_stage},
+            {
+                "$facet": {
+                    "per_store": [
+                        {
+                            "$group": {
+                                "_id": "$seller",
+                                "totalOrders": {"$sum": 1},
+                                "totalRevenue": {"$sum": "$total"}
+                            }
+                        }
+                    ],
+                    # (seller, customer) pairs serve both the per-store uniques and the top customer per store
+                    "store_customers": [
+                        {"$match": {"customer.id": {"$ne": None}}},
+                        {"$group": {"_id": {"seller": "$seller", "customer": "$customer.id"}, **top_customer_fields}},
+                        {"$sort": {"total_spent": -1}},
+                        {
+                            "$group": {
+                                "_id": "$_id.seller",
+                                "unique_customers": {"$sum": 1},
+                                "customer_id": {"$first": "$_id.customer"},
+                                "customerName": {"$first": "$customerName"},
+                                "phoneNumber": {"$first": "$phoneNumber"},
+                                "total_spent": {"$first": "$total_spent"},
+                                "orders_count": {"$first": "$orders_count"}
+                            }
+                        }
+                    ],
+                    # A customer who shops at several outlets counts once for the chain
+                    "chain_customers": [
+                        {"$match": {"customer.id": {"$ne": None}}},
+                        {"$group": {"_id": "$customer.id", **top_customer_fields}},
+                        {"$sort": {"total_spent": -1}},
+                        {
+                            "$group": {
+                                "_id": None,
+                                "unique_customers": {"$sum": 1},
+                                "customer_id": {"$first": "$_id"},
+                                "customerName": {"$first": "$customerName"},
+                                "phoneNumber": {"$first": "$phoneNumber"},
+                                "total_spent": {"$first": "$total_spent"},
+                                "orders_count": {"$first": "$orders_count"}
+                            }
+                        }
+                    ]
+                }
+            }
+        ]
+
+        result = await db.orders.aggregate(pipeline).to_list(None)
+        row = result[0] if result else {}
+        per_store = {r["_id"]: r for r in row.get("per_store", [])}
+        store_customers = {r["_id"]: r for r in row.get("store_customers", [])}
+        chain = (row.get("chain_customers") or [None])[0]
+
+        def top_customer(r):
+            if not r:
+                return None
+            return {
+                "customer_id": str(r["customer_id"]),
+                "customerName": r.get("customerName"),
+                "phoneNumber": r.get("phoneNumber"),
+                "total_spent": r.get("total_spent"),
+                "orders_count": r.get("orders_count")
+            }
+
+        names = await get_store_names(ids)
+        stores = []
+        for seller in sellers:
+            totals = per_store.get(seller, {})
+            customers = store_customers.get(seller)
+            stores.append({
+                "store_id": str(seller),
+                "store_name": names.get(str(seller)),
+                **_kpi_figures(
+                    products.get(seller, 0),
+                    totals.get("totalOrders", 0),
+                    totals.get("totalRevenue", 0),
+                    customers["unique_customers"] if customers else 0,
+                    top_customer(customers)
+                )
+            })
+
+        combined_orders = sum(s["total_orders"] for s in stores)
+        combined_revenue = sum(s["total_revenue"] for s in stores)
+        return {
+            "store_ids": ids,
+            "stores": stores,
+            "combined": _kpi_figures(
+                sum(s["products_count"] for s in stores),
+                combined_orders,
+                combined_revenue,
+                chain["unique_customers"] if chain else 0,
+                top_customer(chain)
+            ),
+            "filters_applied": {
+                "date_from": date_from,
+                "date_to": date_to,
+                "status": status,
+                "category_id": category_id
+            }
+        }
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to fetch multi-store KPIs: {str(e)}")
+
+
+@router.get("/api/analytics/multi-store/monthly-revenue", tags=["Multi-store"])
+@cached_response("multi-store-monthly-revenue")
+async def get_multi_store_monthly_revenue(
+    store_ids: str = Query(..., description="Comma-separated seller ids"),
+    date_from: str = Query(None),
+    date_to: str = Query(None),
+    status: str = Query(None),
+    category_id: str = Query(None)
+):
+    """Monthly revenue per store and for the chain, from one aggregation grouped by seller and month"""
+    ids = parse_store_ids(store_ids)
+    try:
+        match_stage = await build_multi_store_match_stage(ids, date_from, date_to, status, category_id)
+
+        plan = await get_rollup_plan(match_stage, ids, date_from, date_to, status, category_id)
+        if plan:
+            rows = [
+                {"seller": m["seller"], "year": m["year"], "month": m["month"], "orders": m["orders"], "revenue": m["revenue"]}
+                for m in await rollup_monthly(db, plan, by_seller=True)
+                if m["orders"]
+            ]
+        else:
+            pipeline = [
+                {"$match": match_stage},
+                {
+                    "$group": {
+                        "_id": {
+                            "seller": "$seller",
+                            "year": {"$year": "$createdAt"},
+                            "month": {"$month": "$createdAt"}
+                        },
+                        "orders": {"$sum": 1},
+                        "totalRevenue": {"$sum": "$total"}
+                    }
+                },
+                {"$sort": {"_id.year": 1, "_id.month": 1}}
+            ]
+            rows = [
+                {
+                    "seller": item["_id"]["seller"],
+                    "year": item["_id"]["year"],
+                    "month": item["_id"]["month"],
+                    "orders": item["orders"],
+                    "revenue": item["totalRevenue"]
+                }
+                async for item in db.orders.aggregate(pipeline)
+            ]
 
-        result = list(db.orders.aggregate(pipeline))
+        by_store: Dict[str, List[Dict[str, Any]]] = {s: [] for s in ids}
+        combined: Dict[tuple, Dict[str, Any]] = {}
+        for r in rows:
+            by_store[str(r["seller"])].append({"year": r["year"], "month": r["month"], "total_revenue": r["revenue"]})
+            month = combined.setdefault((r["year"], r["month"]), {"year": r["year"], "month": r["month"], "total_revenue": 0})
+            month["total_revenue"] += r["revenue"]
+        for months in by_store.values():
+            months.sort(key=lambda m: (m["year"], m["month"]))
 
+        names = await get_store_names(ids)
         return {
-            "store_id": store_id,
-            "top_products_count": len(result),
+            "store_ids": ids,
+            "stores": [
+                {"store_id": s, "store_name": names.get(s), "monthly_revenue": by_store[s]}
+                for s in ids
+            ],
+            "combined": {"monthly_revenue": [combined[key] for key in sorted(combined)]},
             "filters_applied": {
                 "date_from": date_from,
                 "date_to": date_to,
-                "status": status if status else "COMPLETED",
-                "category_id": category_id,
-                "limit": limit
-            },
-            "top_selling_products": result
+                "status": status,
+                "category_id": category_id
+            }
         }
 
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to fetch top selling products: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to fetch multi-store monthly revenue: {str(e)}")
 
 
-from datetime import datetime
-from bson import ObjectId
-from fastapi import HTTPException
-
 #-------------------------------------------------- ADDED RECENT ORDERS --------------------------------------------------------------------
 
+# Shape of one order row in the orders table (recent-orders, export)
+RECENT_ORDER_PROJECTION = {
+    "order_id": "$orderNo",
+    "invoice_no": "$invoiceNo",
+    "customer": {
+        "name": "$customer.customerName",
+        "phone": "$customer.phoneNumber"
+    },
+    "date_time": {
+        "created": {"$dateToString": {"format": "%Y-%m-%d %H:%M:%S", "date": "$createdAt"}},
+        "delivered": {
+            "$cond": [
+                {"$ifNull": ["$deliveredAt", False]},
+                {"$dateToString": {"format": "%Y-%m-%d %H:%M:%S", "date": "$deliveredAt"}},
+                None
+            ]
+        }
+    },
+    "items": {
+        "$map": {
+            "input": "$items",
+            "as": "item",
+            "in": {
+                "name": "$$item.productName",
+                "quantity_info": "$$item.Quantity",
+                "quantity": "$$item.quantity",
+                "price": "$$item.offerPrice",
+                "subtotal": "$$item.subTotal"
+            }
+        }
+    },
+    "items_count": {"$size": "$items"},
+    "amount": {
+        "subtotal": "$subTotal",
+        "total": "$total",
+        "amount_received": "$amountReceived",
+        "charges": "$charges"
+    },
+    "delivery_info": {
+        "type": "$deliveryType",
+        "pickup_address": "$shippingInfo.pickup.formatted_address",
+        "delivery_address": "$shippingInfo.delivery.address.formatted_address",
+        "delivery_name": "$shippingInfo.delivery.name",
+        "delivery_phone": "$shippingInfo.delivery.alternativePhoneNumber",
+        "distance": "$shippingInfo.distanceBetweenStoreAndCustomer",
+        "driver": {
+            "name": "$shippingInfo.driver.details.driver_name",
+            "mobile": "$shippingInfo.driver.details.mobile"
+        }
+    },
+    "status": "$status",
+    "category": "$orderType",
+    "payment_method": "$paymentMethod",
+    "time_duration": "$timeDuration"
+}
+
+RECENT_ORDERS_COUNT_TTL_SECONDS = float(os.getenv("RECENT_ORDERS_COUNT_TTL_SECONDS", "60"))
+recent_orders_count_cache = LRUTTLCache(max_entries=1024, ttl_seconds=RECENT_ORDERS_COUNT_TTL_SECONDS)
 
-@router.get("/api/analytics/recent-orders/{store_id}", tags=["Analytics"])
-def get_recent_orders(
-    store_id: str,
-    page: int = 1,
-    limit: int = None,
-    status: str = None,
-    order_type: str = None,
-    date_from: str = None,
-    date_to: str = None,
-    search: str = None,
-    category_id: str = None
-):
+
+def encode_orders_cursor(created_at: datetime, order_id: ObjectId) -> str:
+    """Opaque keyset cursor for (createdAt, _id)"""
+    payload = json.dumps({"c": created_at.isoformat(timespec="milliseconds"), "i": str(order_id)})
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_orders_cursor(cursor: str) -> Dict[str, Any]:
     try:
-        store_obj_id = ObjectId(store_id)
-        match_conditions = {"seller": store_obj_id}
-        
-        if status:
-            match_conditions["status"] = status
-        if order_type:
-            match_conditions["orderType"] = order_type
-        if date_from or date_to:
-            date_filter = {}
-            if date_from:
-                date_filter["$gte"] = datetime.fromisoformat(date_from)
-            if date_to:
-                date_filter["$lte"] = datetime.fromisoformat(date_to)
-            match_conditions["createdAt"] = date_filter
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return {"createdAt": datetime.fromisoformat(payload["c"]), "_id": ObjectId(payload["i"])}
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 
-        # Text search filter
-        if search:
+async def count_recent_orders(match_conditions: Dict[str, Any], store_id: str, cache_key: str, mode: str) -> Optional[int]:
+    """Total for the orders table: exact, cached for a short TTL, or skipped"""
+    if mode == "none":
+        return None
+    # Keyed by the response cache generation, so invalidating it (POST /api/cache/responses/invalidate) drops cached totals too
+    cache_key = json.dumps([response_cache.generation(store_id), cache_key])
+    if mode == "cached":
+        cached = recent_orders_count_cache.get(cache_key)
+        if cached is not None:
+            return cached
+    total = await db.orders.count_documents(match_conditions)
+    recent_orders_count_cache.put(cache_key, total)
+    return total
+
+
+async def build_recent_orders_match(
+    store_id: str,
+    status: Optional[str],
+    order_type: Optional[str],
+    date_from: Optional[str],
+    date_to: Optional[str],
+    search: Optional[str],
+    category_id: Optional[str],
+    search_mode: str
+) -> Dict[str, Any]:
+    """$match for the orders table filters (recent-orders, export)"""
+    match_conditions = await build_orders_match_stage(store_id, date_from, date_to, status, category_id)
+
+    if order_type:
+        match_conditions["orderType"] = order_type
+
+    # Text search filter
+    if search:
+        search_filter = None
+        if search_mode == "indexed":
+            watermark = await get_search_watermark(db)
+            if watermark is not None:
+                search_filter = build_search_filter(ObjectId(store_id), search, unindexed_since=watermark)
+        if search_filter:
+            match_conditions.update(search_filter)
+        else:
+            # Legacy path: unanchored case-insensitive regex (scans every order of the store)
             search_pattern = {"$regex": search, "$options": "i"}  # case-insensitive
             match_conditions["$or"] = [
                 {"orderNo": search_pattern},
                 {"customer.customerName": search_pattern},
                 {"customer.phoneNumber": search_pattern}
             ]
+    return match_conditions
 
-        # Category filter
-        if category_id:
-            # Get all product IDs for this category
-            product_ids = db.products.find(
-                {"category": ObjectId(category_id)},
-                {"_id": 1}
-            )
-            product_id_list = [product["_id"] for product in product_ids]
-            
-            # Add items array filter to match conditions
-            match_conditions["items._id"] = {"$in": product_id_list}
 
-        # Calculate skip for pagination
-        skip = (page - 1) * limit
+@router.get("/api/analytics/recent-orders/{store_id}", tags=["Analytics"])
+@cached_response("recent-orders")
+async def get_recent_orders(
+    store_id: str,
+    page: int = Query(1, ge=1),
+    limit: int = Query(10, ge=1, le=1000),
+    status: str = None,
+    order_type: str = None,
+    date_from: str = None,
+    date_to: str = None,
+    search: str = None,
+    category_id: str = None,
+    cursor: str = Query(None, description="next_cursor from the previous response (keyset pagination, ignores page)"),
+    total: str = Query("cached", pattern="^(exact|cached|none)$", description="How to compute total_items"),
+    search_mode: str = Query("indexed", pattern="^(indexed|regex)$", description="indexed: order no. prefix / phone suffix / name tokens"),
+    fresh: bool = Query(False, description="Bypass the response cache and count total_items exactly (live resync)")
+):
+    try:
+        match_conditions = await build_recent_orders_match(store_id, status, order_type, date_from, date_to, search, category_id, search_mode)
+
+        count_key = json.dumps([store_id, status, order_type, date_from, date_to, search, search_mode, category_id])
+        total_count = await count_recent_orders(match_conditions, store_id, count_key, "exact" if fresh is True else total)
+
+        # Keyset page: strictly after the last (createdAt, _id) seen, newest first
+        page_match = match_conditions
+        skip = 0
+        if cursor:
+            after = decode_orders_cursor(cursor)
+            page_match = {
+                "$and": [
+                    match_conditions,
+                    {
+                        "$or": [
+                            {"createdAt": {"$lt": after["createdAt"]}},
+                            {"createdAt": after["createdAt"], "_id": {"$lt": after["_id"]}}
+                        ]
+                    }
+                ]
+            }
+        else:
+            skip = (page - 1) * limit
 
         pipeline = [
-            {"$match": match_conditions},
-            {"$sort": {"createdAt": -1}},
+            {"$match": page_match},
+            {"$sort": {"createdAt": -1, "_id": -1}},
+        ]
+        if skip:
+            pipeline.append({"$skip": skip})
+        pipeline += [
+            # One extra row tells us whether there is a next page without counting
+            {"$limit": limit + 1},
             {
-                "$facet": {
-                    "orders": [
-                        {"$skip": skip},
-                        {"$limit": limit},
-                        {
-                            "$project": {
-                                "_id": 0,
-                                "order_id": "$orderNo",
-                                "invoice_no": "$invoiceNo",
-                                "customer": {
-                                    "name": "$customer.customerName",
-                                    "phone": "$customer.phoneNumber"
-                                },
-                                "date_time": {
-                                    "created": {"$dateToString": {"format": "%Y-%m-%d %H:%M:%S", "date": "$createdAt"}},
-                                    "delivered": {
-                                        "$cond": [
-                                            {"$ifNull": ["$deliveredAt", False]},
-                                            {"$dateToString": {"format": "%Y-%m-%d %H:%M:%S", "date": "$deliveredAt"}},
-                                            None
-                                        ]
-                                    }
-                                },
-                                "items": {
-                                    "$map": {
-                                        "input": "$items",
-                                        "as": "item",
-                                        "in": {
-                                            "name": "$$item.productName",
-                                            "quantity_info": "$$item.Quantity",
-                                            "quantity": "$$item.quantity",
-                                            "price": "$$item.offerPrice",
-                                            "subtotal": "$$item.subTotal"
-                                        }
-                                    }
-                                },
-                                "items_count": {"$size": "$items"},
-                                "amount": {
-                                    "subtotal": "$subTotal",
-                                    "total": "$total",
-                                    "amount_received": "$amountReceived",
-                                    "charges": "$charges"
-                                },
-                                "delivery_info": {
-                                    "type": "$deliveryType",
-                                    "pickup_address": "$shippingInfo.pickup.formatted_address",
-                                    "delivery_address": "$shippingInfo.delivery.address.formatted_address",
-                                    "delivery_name": "$shippingInfo.delivery.name",
-                                    "delivery_phone": "$shippingInfo.delivery.alternativePhoneNumber",
-                                    "distance": "$shippingInfo.distanceBetweenStoreAndCustomer",
-                                    "driver": {
-                                        "name": "$shippingInfo.driver.details.driver_name",
-                                        "mobile": "$shippingInfo.driver.details.mobile"
-                                    }
-                                },
-                                "status": "$status",
-                                "category": "$orderType",
-                                "payment_method": "$paymentMethod",
-                                "time_duration": "$timeDuration"
-                            }
-                        }
-                    ],
-                    "total_count": [
-                        {"$count": "count"}
-                    ]
+                "$project": {
+                    **RECENT_ORDER_PROJECTION,
+                    "_id": 0,
+                    "_cursor": {"createdAt": "$createdAt", "id": "$_id"}
                 }
             }
         ]
-        
-        result = list(db.orders.aggregate(pipeline))
-        
-        orders = result[0]["orders"] if result else []
-        total_count = result[0]["total_count"][0]["count"] if result and result[0]["total_count"] else 0
-        
+
+        orders = await db.orders.aggregate(pipeline).to_list(None)
+
+        has_next = len(orders) > limit
+        orders = orders[:limit]
+        next_cursor = None
+        if has_next and orders:
+            last = orders[-1]["_cursor"]
+            next_cursor = encode_orders_cursor(last["createdAt"], last["id"])
+        for order in orders:
+            order.pop("_cursor", None)
+
         # Calculate pagination info
-        total_pages = (total_count + limit - 1) // limit
-        
+        total_pages = (total_count + limit - 1) // limit if total_count is not None else None
+
         return {
             "store_id": store_id,
             "pagination": {
-                "current_page": page,
+                "current_page": None if cursor else page,
                 "per_page": limit,
                 "total_items": total_count,
                 "total_pages": total_pages,
-                "has_next": page < total_pages,
-                "has_previous": page > 1
+                "has_next": has_next,
+                "has_previous": bool(cursor) or page > 1,
+                "next_cursor": next_cursor
             },
             "filters_applied": {
                 "status": status,
@@ -1074,65 +1655,343 @@ def get_recent_orders(
                 "date_from": date_from,
                 "date_to": date_to,
                 "search": search,
+                "search_mode": search_mode,
                 "category_id": category_id
             },
             "orders": orders
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(500, f"Failed to fetch recent orders: {str(e)}")
     
 
 
 
-#-------------------------------------------------- Supabase DATA FETCHING --------------------------------------------------------------------
+#-------------------------------------------------- ORDER EXPORT --------------------------------------------------------------------
+
+ORDER_EXPORT_BATCH_SIZE = int(os.getenv("ORDER_EXPORT_BATCH_SIZE", "500"))
+
+ORDER_EXPORT_CSV_COLUMNS = [
+    ("order_id", lambda o: o.get("order_id")),
+    ("invoice_no", lambda o: o.get("invoice_no")),
+    ("created", lambda o: (o.get("date_time") or {}).get("created")),
+    ("delivered", lambda o: (o.get("date_time") or {}).get("delivered")),
+    ("status", lambda o: o.get("status")),
+    ("category", lambda o: o.get("category")),
+    ("payment_method", lambda o: o.get("payment_method")),
+    ("customer_name", lambda o: (o.get("customer") or {}).get("name")),
+    ("customer_phone", lambda o: (o.get("customer") or {}).get("phone")),
+    ("items_count", lambda o: o.get("items_count")),
+    ("items", lambda o: "; ".join(f"{i.get('name')} x {i.get('quantity')}" for i in o.get("items") or [])),
+    ("subtotal", lambda o: (o.get("amount") or {}).get("subtotal")),
+    ("total", lambda o: (o.get("amount") or {}).get("total")),
+    ("amount_received", lambda o: (o.get("amount") or {}).get("amount_received")),
+    ("delivery_type", lambda o: (o.get("delivery_info") or {}).get("type")),
+    ("delivery_address", lambda o: (o.get("delivery_info") or {}).get("delivery_address")),
+    ("time_duration", lambda o: o.get("time_duration"))
+]
+
+
+def _csv_chunk(rows: List[List[Any]]) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+
+async def stream_orders_export(match_conditions: Dict[str, Any], export_format: str, max_rows: Optional[int]):
+    """Yield the export one cursor batch at a time; nothing beyond a batch is held in memory"""
+    pipeline = [
+        {"$match": match_conditions},
+        {"$sort": {"createdAt": -1, "_id": -1}}
+    ]
+    if max_rows:
+        pipeline.append({"$limit": max_rows})
+    pipeline.append({"$project": {**RECENT_ORDER_PROJECTION, "_id": 0}})
+
+    cursor = db.orders.aggregate(pipeline, batchSize=ORDER_EXPORT_BATCH_SIZE)
+    pending: List[Any] = []
+    if export_format == "csv":
+        pending.append([name for name, _ in ORDER_EXPORT_CSV_COLUMNS])
+
+    def flush() -> str:
+        if export_format == "csv":
+            chunk = _csv_chunk(pending)
+        else:
+            chunk = "".join(json.dumps(order, default=str) + "\n" for order in pending)
+        pending.clear()
+        return chunk
 
-@router.get("/api/analytics/top-dish-searches/{store_id}", tags=["Analytics"])
-def get_top_dish_searches(store_id: str):
     try:
-        raw_resp = (
-            supabase_client
-            .from_("raw_data")
-            .select("query, dishbased, cuisinebased, dietarybased, timebased, timestamp, product_id")
-            .eq("store_id", store_id)
-            .execute()
-        )
+        async for order in cursor:
+            if export_format == "csv":
+                pending.append([value(order) for _, value in ORDER_EXPORT_CSV_COLUMNS])
+            else:
+                pending.append(order)
+            if len(pending) >= ORDER_EXPORT_BATCH_SIZE:
+                yield flush()
+        if pending:
+            yield flush()
+    except Exception as e:
+        # Headers are already sent; end the body with a marker instead of a silent truncation
+        logger.exception("Order export failed mid-stream")
+        if export_format == "ndjson":
+            yield json.dumps({"error": f"Export failed: {str(e)}"}) + "\n"
+        else:
+            yield f"# export failed: {str(e)}\n"
+    finally:
+        await cursor.close()
+
+
+@router.get("/api/analytics/orders/export/{store_id}", tags=["Analytics"])
+async def export_orders(
+    store_id: str,
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    status: str = None,
+    order_type: str = None,
+    date_from: str = None,
+    date_to: str = None,
+    search: str = None,
+    category_id: str = None,
+    search_mode: str = Query("indexed", pattern="^(indexed|regex)$"),
+    max_rows: int = Query(None, ge=1, description="Stop after this many orders (default: all matching)")
+):
+    """Stream every matching order (recent-orders filters and row shape), newest first"""
+    # Fail before any bytes are sent: once streaming starts the status code is fixed
+    try:
+        validate_store_id(store_id)
+        match_conditions = await build_recent_orders_match(store_id, status, order_type, date_from, date_to, search, category_id, search_mode)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid export filters: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to export orders: {str(e)}")
+
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    filename = f"orders-{store_id}-{datetime.utcnow():%Y%m%d%H%M%S}.{format}"
+    return StreamingResponse(
+        stream_orders_export(match_conditions, format, max_rows),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
+#-------------------------------------------------- LIVE UPDATES (SSE) --------------------------------------------------------------------
 
+from live_updates import LiveUpdates, ConnectionLimitReached, SSE_HEARTBEAT_SECONDS, sse_event
 
-        raw_data = raw_resp.data
+live_updates = LiveUpdates(RECENT_ORDER_PROJECTION)
 
-        if not raw_data:
-            return {"store_id": store_id, "data": [], "message": "No search data found"}
-        product_ids = list({row["product_id"] for row in raw_data if row.get("product_id")})
 
-        if not product_ids:
-            return {"store_id": store_id, "data": raw_data, "message": "No product_id found in searches"}
-        product_resp = (
+@router.get("/api/analytics/live/{store_id}", tags=["Live"])
+async def stream_live_updates(store_id: str):
+    """
+    Server-sent events for one store's dashboard: `hello`, then a `kpis`
+    snapshot when live counters are available, then `order` / `kpis` (changed
+    fields only) / `resync` as they happen, with keep-alive comments between.
+    """
+    try:
+        validate_store_id(store_id)
+        live_updates.check_capacity(store_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ConnectionLimitReached as e:
+        return JSONResponse(status_code=503, content={"detail": str(e)}, headers={"Retry-After": "30"})
+
+    async def events():
+        try:
+            subscriber = live_updates.subscribe(db, store_id)
+        except ConnectionLimitReached as e:
+            yield sse_event("error", {"error": str(e)})
+            return
+        try:
+            # EventSource reconnect delay, then the current state
+            yield "retry: 5000\n\n"
+            snapshot = await read_live_kpis(db, store_id) if LIVE_KPIS_ENABLED else None
+            yield sse_event("hello", {"store_id": store_id, "kpis": "live" if snapshot else "unavailable"})
+            if snapshot:
+                yield sse_event("kpis", snapshot)
+            subscriber.start_kpis({k: v for k, v in (snapshot or {}).items() if k != "as_of"}, (snapshot or {}).get("as_of"))
+            while True:
+                yield await subscriber.next_frames(SSE_HEARTBEAT_SECONDS)
+        finally:
+            live_updates.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # X-Accel-Buffering: nginx would otherwise hold events back
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.get("/api/live/stats", tags=["Live"])
+async def get_live_update_stats():
+    return live_updates.stats()
+
+
+#-------------------------------------------------- Supabase DATA FETCHING --------------------------------------------------------------------
+
+DISH_SEARCH_FACETS = {
+    "query": None,
+    "dish": "dishbased",
+    "cuisine": "cuisinebased",
+    "dietary": "dietarybased",
+    "time": "timebased",
+    "product": None
+}
+SUPABASE_PAGE_SIZE = 1000
+SUPABASE_IN_CHUNK = 200
+# Unique column of raw_data, the keyset tiebreak for rows sharing a timestamp
+RAW_DATA_ID_COLUMN = os.getenv("RAW_DATA_ID_COLUMN", "id")
+
+
+def _dish_search_window(days: Optional[int], date_from: Optional[str], date_to: Optional[str]) -> Dict[str, Optional[str]]:
+    since = date_from
+    if since is None and days:
+        since = (datetime.utcnow() - timedelta(days=days)).isoformat()
+    return {"since": since, "until": date_to}
+
+
+def _rank_dish_facet_rpc(supabase_client, store_id: str, facet: str, window: Dict[str, Optional[str]], limit: int, offset: int) -> Dict[str, Any]:
+    """Top terms from the top_dish_searches SQL function (sql/top_dish_searches.sql)"""
+    with track_supabase("rpc:top_dish_searches"):
+        rows = supabase_client.rpc("top_dish_searches", {
+            "p_store_id": store_id,
+            "p_facet": facet,
+            "p_since": window["since"],
+            "p_until": window["until"],
+            "p_limit": limit,
+            "p_offset": offset
+        }).execute().data or []
+    return {
+        "total": rows[0]["total_terms"] if rows else 0,
+        "data": [{"term": r["term"], "searches": r["searches"], "last_searched": r["last_searched"]} for r in rows]
+    }
+
+
+def _rank_dish_facets_fallback(supabase_client, store_id: str, facets: List[str], window: Dict[str, Optional[str]], limit: int, offset: int) -> Dict[str, Dict[str, Any]]:
+    """Same ranking computed here, for databases without the SQL function: paged reads, chunked in_() lookups"""
+    counts = {facet: {} for facet in facets}
+    product_rows: Dict[str, List[Any]] = {}
+
+    def bump(facet, term, ts):
+        entry = counts[facet].setdefault(term, [0, None])
+        entry[0] += 1
+        if ts and (entry[1] is None or ts > entry[1]):
+            entry[1] = ts
+
+    # Frozen upper bound: searches logged during the scan can't shift rows between pages
+    until = window["until"] or datetime.now(timezone.utc).isoformat()
+    last = None
+    while True:
+        query = (
             supabase_client
-            .from_("product_details")
-            .select("product_id, product_name")
-            .in_("product_id", product_ids)
-            .execute()
+            .from_("raw_data")
+            .select(f"{RAW_DATA_ID_COLUMN}, query, dishbased, cuisinebased, dietarybased, timebased, timestamp, product_id")
+            .eq("store_id", store_id)
+            .lte("timestamp", until)
         )
+        if window["since"]:
+            query = query.gte("timestamp", window["since"])
+        if last is not None:
+            # Keyset: strictly after the last (timestamp, id) seen, newest first
+            ts, row_id = last
+            query = query.or_(f'timestamp.lt."{ts}",and(timestamp.eq."{ts}",{RAW_DATA_ID_COLUMN}.lt."{row_id}")')
+        with track_supabase("select:raw_data"):
+            page = (
+                query
+                .order("timestamp", desc=True)
+                .order(RAW_DATA_ID_COLUMN, desc=True)
+                .limit(SUPABASE_PAGE_SIZE)
+                .execute().data or []
+            )
+
+        for row in page:
+            ts = row.get("timestamp")
+            if "query" in counts and (row.get("query") or "").strip():
+                bump("query", row["query"].strip().lower(), ts)
+            for facet, column in DISH_SEARCH_FACETS.items():
+                if column and facet in counts and isinstance(row.get(column), list):
+                    for term in row[column]:
+                        if term:
+                            bump(facet, term, ts)
+            if "product" in counts and row.get("product_id"):
+                product_rows.setdefault(row["product_id"], []).append(ts)
+
+        if len(page) < SUPABASE_PAGE_SIZE:
+            break
+        last = (page[-1]["timestamp"], page[-1][RAW_DATA_ID_COLUMN])
+
+    if product_rows:
+        product_ids = list(product_rows)
+        # Keep each in_() filter (and so the request URL) bounded
+        for i in range(0, len(product_ids), SUPABASE_IN_CHUNK):
+            chunk = product_ids[i:i + SUPABASE_IN_CHUNK]
+            with track_supabase("select:product_details"):
+                resp = supabase_client.from_("product_details").select("product_id, product_name").in_("product_id", chunk).execute()
+            for product in resp.data or []:
+                if product.get("product_name"):
+                    for ts in product_rows[product["product_id"]]:
+                        bump("product", product["product_name"], ts)
+
+    ranked = {}
+    for facet, terms in counts.items():
+        # Same order as the SQL function: searches desc, last_searched desc (nulls last), term
+        rows = sorted(terms.items(), key=lambda kv: kv[0])
+        rows.sort(key=lambda kv: kv[1][1] or "", reverse=True)
+        rows.sort(key=lambda kv: kv[1][0], reverse=True)
+        ranked[facet] = {
+            "total": len(rows),
+            "data": [
+                {"term": term, "searches": n, "last_searched": ts}
+                for term, (n, ts) in rows[offset:offset + limit]
+            ]
+        }
+    return ranked
 
 
-        from collections import defaultdict
+@router.get("/api/analytics/top-dish-searches/{store_id}", tags=["Analytics"])
+@cached_response("top-dish-searches")
+async def get_top_dish_searches(
+    store_id: str,
+    facets: str = Query("dish,product", description="Comma-separated: query, dish, cuisine, dietary, time, product"),
+    days: int = Query(0, ge=0, description="Look-back window in days (0 = all time, the default); ignored when date_from is set"),
+    date_from: str = Query(None),
+    date_to: str = Query(None),
+    limit: int = Query(10, ge=1, le=100),
+    offset: int = Query(0, ge=0)
+):
+    requested = [f.strip() for f in facets.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in DISH_SEARCH_FACETS]
+    if unknown or not requested:
+        raise HTTPException(status_code=400, detail=f"Unknown facets: {', '.join(unknown) or '(none)'}")
+    supabase_client = await run_in_threadpool(get_supabase_client)
+    if supabase_client is None:
+        raise HTTPException(status_code=503, detail="Supabase not configured")
 
-        product_map = defaultdict(list)
+    window = _dish_search_window(days, date_from, date_to)
 
-        for p in product_resp.data:
-            product_map[p["product_id"]].append(p["product_name"])
-        final_data = []
-        for row in raw_data:
-            final_data.append({
-                **row,
-                "product_name": product_map.get(row["product_id"], None)
-            })
+    def rank():
+        try:
+            return {facet: _rank_dish_facet_rpc(supabase_client, store_id, facet, window, limit, offset) for facet in requested}, "rpc"
+        except Exception as e:
+            logger.warning(f"top_dish_searches RPC unavailable, ranking in the API: {str(e)}")
+            return _rank_dish_facets_fallback(supabase_client, store_id, requested, window, limit, offset), "fallback"
 
+    try:
+        ranked, source = await run_in_threadpool(rank)
         return {
             "store_id": store_id,
-            "count": len(final_data),
-            "data": final_data
+            "facets": ranked,
+            "source": source,
+            "pagination": {"limit": limit, "offset": offset},
+            "filters_applied": {
+                "facets": requested,
+                "days": days,
+                "date_from": window["since"],
+                "date_to": window["until"]
+            }
         }
 
     except Exception as e:
@@ -1147,9 +2006,10 @@ def get_top_dish_searches(store_id: str):
 
 
 import json
-from openai import OpenAI
+import asyncio
+from functools import lru_cache
 from dotenv import load_dotenv
-from openai import AzureOpenAI
+from llm_cache import llm_cache, cache_key as llm_cache_key
 load_dotenv(".env")
 
 AZURE_KEY = os.getenv("AZURE_KEY")
@@ -1157,12 +2017,37 @@ AZURE_ENDPOINT = os.getenv("AZURE_ENDPOINT")
 AZURE_DEPLOYMENT_NAME = "gpt-4o-mini"  # Add this to your .env
 AZURE_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION", "2024-08-01-preview")
 
-client = AzureOpenAI(
-    api_key=AZURE_KEY,
-    azure_endpoint=AZURE_ENDPOINT,
-    api_version=AZURE_API_VERSION
-)
-def recommend_for_product(item: dict):
+# Fan-out limits for per-product recommendations (shared by all requests of a worker)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "5"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "20"))
+llm_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+
+
+# Built on first use, and the openai package (~0.5 s to import) loaded with it: a missing key
+# fails the AI call (handled per request), not the worker boot
+@lru_cache(maxsize=None)
+def get_azure_client():
+    from openai import AzureOpenAI
+    return AzureOpenAI(
+        api_key=AZURE_KEY,
+        azure_endpoint=AZURE_ENDPOINT,
+        api_version=AZURE_API_VERSION
+    )
+
+
+@lru_cache(maxsize=None)
+def get_async_azure_client():
+    from openai import AsyncAzureOpenAI
+    return AsyncAzureOpenAI(
+        api_key=AZURE_KEY,
+        azure_endpoint=AZURE_ENDPOINT,
+        api_version=AZURE_API_VERSION,
+        timeout=LLM_TIMEOUT_SECONDS,
+        max_retries=0  # the per-call deadline below already bounds the request
+    )
+
+
+async def recommend_for_product(item: dict):
     prompt = f"""
 You are a retail analytics strategist.
 
@@ -1181,28 +2066,54 @@ TASK:
 Output strictly in JSON with keys: recommendation, reasoning.
 """
 
+    messages = [{"role": "user", "content": prompt}]
+    # Same product data -> same prompt -> same key, so repeat dashboard loads skip the LLM
+    key = llm_cache_key("gpt-4o-mini", messages, temperature=0.2, response_format="json_object")
+    cached = await run_in_threadpool(llm_cache.get, key)
+    if cached is not None:
+        return {**cached, "ok": True}
+
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            temperature=0.2,
-            response_format={"type": "json_object"},  # ENFORCE VALID JSON
-            messages=[{"role": "user", "content": prompt}]
-        )
+        async with llm_semaphore:
+            with track_llm("top-stock-alerts"):
+                response = await asyncio.wait_for(
+                    get_async_azure_client().chat.completions.create(
+                        model="gpt-4o-mini",
+                        temperature=0.2,
+                        response_format={"type": "json_object"},  # ENFORCE VALID JSON
+                        messages=messages
+                    ),
+                    timeout=LLM_TIMEOUT_SECONDS
+                )
 
         raw = response.choices[0].message.content
-        return json.loads(raw) # type: ignore
-
-    except Exception as e:
-        print("LLM ERROR RAW:", response)
-        print("Exception:", e)
-        return {
-            "recommendation": "Unable to generate recommendation.",
-            "reasoning": "LLM JSON parsing failed."
+        reco = json.loads(raw) # type: ignore
+        result = {
+            "recommendation": reco.get("recommendation"),
+            "reasoning": reco.get("reasoning")
         }
+        await run_in_threadpool(llm_cache.put, key, result, "stock_alert")
+        return {**result, "ok": True}
+
+    except asyncio.TimeoutError:
+        logger.warning(f"LLM recommendation timed out after {LLM_TIMEOUT_SECONDS}s for {item.get('ProductName')}")
+        reason = "LLM call timed out."
+    except json.JSONDecodeError as e:
+        logger.warning(f"LLM returned invalid JSON for {item.get('ProductName')}: {str(e)}")
+        reason = "LLM JSON parsing failed."
+    except Exception as e:
+        logger.warning(f"LLM recommendation failed for {item.get('ProductName')}: {str(e)}")
+        reason = "LLM call failed."
+
+    return {
+        "recommendation": "Unable to generate recommendation.",
+        "reasoning": reason,
+        "ok": False
+    }
 
 
 @router.get("/api/analytics/top-stock-alerts/{store_id}", tags=["AI Analytics"])
-def get_top_stock_alerts(store_id: str):
+async def get_top_stock_alerts(store_id: str):
     try:
         store_obj_id = ObjectId(store_id)
 
@@ -1232,22 +2143,28 @@ def get_top_stock_alerts(store_id: str):
             { "$limit": 5 }
         ]
 
-        data = list(db.products.aggregate(pipeline))
+        data = await db.products.aggregate(pipeline).to_list(None)
         
         
-        enriched = []
-        for item in data:
-            reco = recommend_for_product(item)
-            enriched.append({
+        # All products at once, bounded by llm_semaphore; failures come back as placeholders
+        recos = await asyncio.gather(*(recommend_for_product(item) for item in data))
+
+        enriched = [
+            {
                 **item,
                 "recommendation": reco["recommendation"],
                 "reasoning": reco["reasoning"]
-            })
+            }
+            for item, reco in zip(data, recos)
+        ]
+        failed = sum(1 for reco in recos if not reco["ok"])
 
         return {
             "store_id": store_id,
             "Ai_recommendations": enriched,
-            "data": data
+            "data": data,
+            "recommendations_failed": failed,
+            "partial": 0 < failed < len(recos)
         }
 
 
@@ -1274,7 +2191,6 @@ import json
 from typing import Dict, Any, List
 from datetime import datetime
 from bson import ObjectId
-from openai import OpenAI
 
 # ============================================================================
 # AI PROMPTS FOR SUBSTITUTIONS
@@ -1333,6 +2249,7 @@ def initialize_openai_client():
     openai_key = os.getenv("OPENAI_API_KEY")
     if openai_key:
         try:
+            from openai import OpenAI
             client = OpenAI(api_key=openai_key)
             logger.info("AI assistant ready with GPT-4o mini")
             return client
@@ -1357,9 +2274,10 @@ def simple_substitutes(product_data: Dict, similar_products: List[Dict], top_n:
         substitutes.append({
             "product_id": str(product.get("_id", "")),
             "product_name": product.get("ProductName", "Unknown Product"),
-            "similarity_score": round(0.8 - (i * 0.1), 2),
-            "price_difference": round(price - original_price, 2),
-            "reason": "Similar product in same category"
+            # Candidates from the substitute graph carry their real score
+            "similarity_score": product.get("similarity_score", round(0.8 - (i * 0.1), 2)),
+            "price_difference": round((price or 0) - (original_price or 0), 2),
+            "reason": product.get("reason", "Similar product in same category")
         })
     
     return substitutes
@@ -1392,21 +2310,31 @@ def suggest_substitutes(
             alternatives=json.dumps(alternatives, indent=2)
         )
         
-        response = openai_client.chat.completions.create(
-            model=MINI_MODEL_NAME,
-            messages=[
-                {"role": "system", "content": SUBSTITUTION_SYSTEM_PROMPT},
-                {"role": "user", "content": user_prompt}
-            ],
-            max_tokens=600,
-            temperature=0.3
-        )
+        messages = [
+            {"role": "system", "content": SUBSTITUTION_SYSTEM_PROMPT},
+            {"role": "user", "content": user_prompt}
+        ]
+        key = llm_cache_key(MINI_MODEL_NAME, messages, max_tokens=600, temperature=0.3)
+        cached = llm_cache.get(key)
+        if cached is not None:
+            return cached
+
+        # Runs in a threadpool worker under the caller's llm_semaphore; the per-call deadline
+        # (no retries) keeps a hung upstream from holding that worker past LLM_TIMEOUT_SECONDS
+        with track_llm("quick-analysis"):
+            response = openai_client.with_options(timeout=LLM_TIMEOUT_SECONDS, max_retries=0).chat.completions.create(
+                model=MINI_MODEL_NAME,
+                messages=messages,
+                max_tokens=600,
+                temperature=0.3
+            )
         
         ai_response = response.choices[0].message.content
         
         try:
             substitutes = json.loads(ai_response)
             if isinstance(substitutes, list):
+                llm_cache.put(key, substitutes[:top_n], "substitutes")
                 return substitutes[:top_n]
         except:
             pass
@@ -1418,76 +2346,44 @@ def suggest_substitutes(
         return simple_substitutes(product_data, similar_products, top_n)
 
 
-def get_product_substitutes(
-    store_id: str,
-    product_id: str,
-    top_n: int = 5,
-    products_collection = None,
-    categories_collection = None,
-    openai_client = None
-) -> Dict[str, Any]:
-    """Get product substitutes using GPT-4o mini"""
-    try:
-        store_obj_id = validate_store_id(store_id)
-        product_obj_id = ObjectId(product_id)
-        
-        original = products_collection.find_one({
-            "_id": product_obj_id,
-            "seller": store_obj_id
+SIMILAR_PRODUCTS_LIMIT = 15
+SUBSTITUTE_GRAPH_ENABLED = os.getenv("SUBSTITUTE_GRAPH_ENABLED", "true").lower() in ("1", "true", "yes")
+SUBSTITUTE_PRODUCT_FIELDS = {"ProductName": 1, "offerPrice": 1, "category": 1}
+
+
+def graph_candidates(ranked: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Substitute graph entries in the shape suggest_substitutes expects, best first"""
+    candidates = []
+    for entry in ranked:
+        reasons = []
+        if entry.get("name_similarity", 0) >= 0.3:
+            reasons.append("similar name")
+        if entry.get("same_category"):
+            reasons.append("same category")
+        if entry.get("price_proximity", 0) >= 0.8:
+            reasons.append("close price")
+        candidates.append({
+            "_id": str(entry["product_id"]),
+            "ProductName": entry.get("product_name"),
+            "offerPrice": entry.get("offer_price") or 0,
+            "category": entry.get("category_name") or "Unknown",
+            "similarity_score": entry.get("score"),
+            "reason": (", ".join(reasons) or "closest match in store").capitalize()
         })
-        logger.info(f"Original product: {original}")
-        
-        if not original:
-            raise Exception("Product not found")
-        
-        similar_query = {
-            "seller": store_obj_id,
-            "status": "APPROVED",
-            "_id": {"$ne": product_obj_id}
-        }
-        
-        if original.get("category"):
-            similar_query["category"] = original["category"]
-        
-        logger.info(f"Similar products query: {similar_query}")
-        
-        similar_products = list(products_collection.find(similar_query).limit(15))
-        logger.info(f"Found {len(similar_products)} similar products")
-        
-        for product in similar_products:
-            logger.info(f"Processing similar product: {product.get('ProductName')}, Category: {product.get('category')}")
-            convert_objectids_to_strings(product)
-            if product.get("category"):
-                try:
-                    cat_info = categories_collection.find_one({"_id": ObjectId(product["category"])})
-                    product["category"] = cat_info.get("name", "Unknown") if cat_info else "Unknown"
-                except:
-                    product["category"] = "Unknown"
-        
-        substitutes = suggest_substitutes(original, similar_products, top_n, openai_client)
-        
-        return {
-            "store_id": store_id,
-            "original_product": {
-                "name": original.get("ProductName", "Unknown"),
-                "price": original.get("offerPrice", 0)
-            },
-            "substitutes": substitutes,
-            "ai_model": "gpt-4o-mini"
-        }
-        
-    except Exception as e:
-        logger.exception("Failed to get substitutes")
-        raise
+    return candidates
+
+
+def _as_object_id(value: Any) -> Optional[ObjectId]:
+    if isinstance(value, ObjectId):
+        return value
+    return ObjectId(value) if value and ObjectId.is_valid(value) else None
 
 
-def get_low_stock_products(
+async def get_low_stock_products(
     products_collection,
-    categories_collection,
-    units_collection,
     store_id: str,
     limit: int = 5
-) -> Dict[str, Any]:
+) -> List[Dict[str, Any]]:
     """Return top N products that are unavailable (availabilityStatus=False), sorted by stock quantity (lowest first)"""
     try:
         store_obj_id = validate_store_id(store_id)
@@ -1497,81 +2393,275 @@ def get_low_stock_products(
         }
 
         # Sort by stock quantity ascending (lowest stock first) and limit to top N
-        cursor = products_collection.find(query).sort("stockQuantity", 1).limit(limit)
+        cursor = products_collection.find(query, SUBSTITUTE_PRODUCT_FIELDS).sort("stockQuantity", 1).limit(limit)
+        return await cursor.to_list(None)
+
+    except Exception as e:
+        logger.exception(f"Failed to get low-stock products for store {store_id}")
+        raise Exception(f"Failed to fetch low-stock products: {str(e)}")
 
-        low_stock_products = []
 
-        for prod in cursor:
-            logger.info(f"Low stock product: {prod}")
-            convert_objectids_to_strings(prod)
+async def get_similar_products_by_category(
+    products_collection,
+    categories_collection,
+    store_id: str,
+    originals: List[Dict[str, Any]]
+) -> Dict[Any, List[Dict[str, Any]]]:
+    """Substitute candidates for a batch of products: one query per distinct category plus one category-name lookup"""
+    store_obj_id = validate_store_id(store_id)
+    originals_per_category: Dict[Any, int] = {}
+    for original in originals:
+        category = original.get("category") or None
+        originals_per_category[category] = originals_per_category.get(category, 0) + 1
+
+    async def fetch(category, originals_in_category):
+        query = {"seller": store_obj_id, "status": "APPROVED"}
+        if category:
+            query["category"] = category
+        # Over-fetch by the originals in this category so each still has a full list after excluding itself
+        cursor = products_collection.find(query, SUBSTITUTE_PRODUCT_FIELDS).limit(SIMILAR_PRODUCTS_LIMIT + originals_in_category)
+        return category, await cursor.to_list(None)
+
+    candidates = dict(await asyncio.gather(*(fetch(c, n) for c, n in originals_per_category.items())))
+
+    category_ids = {
+        _as_object_id(product.get("category"))
+        for products in candidates.values()
+        for product in products
+    }
+    category_ids.discard(None)
+    names = {
+        category["_id"]: category.get("name", "Unknown")
+        async for category in categories_collection.find({"_id": {"$in": list(category_ids)}}, {"name": 1})
+    }
+
+    for products in candidates.values():
+        for product in products:
+            category = product.get("category")
+            convert_objectids_to_strings(product)
+            if category:
+                product["category"] = names.get(_as_object_id(category), "Unknown")
 
-            category = categories_collection.find_one(
-                {"_id": prod.get("category")}
-            ) or {}
+    return candidates
 
-            unit = units_collection.find_one(
-                {"_id": prod.get("unit")}
-            ) or {}
 
-            low_stock_products.append({
-                "product_id": prod.get("_id", "")
-            })
+@router.get("/", tags=["Health"])
+async def health():
+    return {"status": "ok"}
+
 
-        return {"low_stock_products": low_stock_products}
+READY_TIMEOUT_SECONDS = float(os.getenv("READY_TIMEOUT_SECONDS", "2"))
 
+
+@router.get("/ready", tags=["Health"])
+async def ready():
+    """Readiness: MongoDB answers a ping within READY_TIMEOUT_SECONDS (Supabase / AI are optional)"""
+    checks = {}
+    try:
+        started = asyncio.get_running_loop().time()
+        await asyncio.wait_for(db.command("ping"), timeout=READY_TIMEOUT_SECONDS)
+        checks["mongodb"] = {"ok": True, "ms": round((asyncio.get_running_loop().time() - started) * 1000, 1)}
     except Exception as e:
-        logger.exception(f"Failed to get low-stock products for store {store_id}")
-        raise Exception(f"Failed to fetch low-stock products: {str(e)}")
+        checks["mongodb"] = {"ok": False, "error": str(e) or type(e).__name__}
+    checks["supabase"] = {"configured": bool(os.getenv("SUPABASE_URL") and os.getenv("SUPABASE_KEY"))}
+    checks["ai"] = {"configured": bool(AZURE_KEY and AZURE_ENDPOINT)}
 
-@router.get("/", tags=["Health"])
-def health():
-    return {"status": "ok"}
+    is_ready = checks["mongodb"]["ok"]
+    return JSONResponse(
+        status_code=200 if is_ready else 503,
+        content={"status": "ready" if is_ready else "not_ready", "checks": checks}
+    )
+
+
+@router.get("/api/cache/category-products/stats", tags=["Cache"])
+async def get_category_cache_stats():
+    return category_product_cache.stats()
+
+
+@router.post("/api/cache/category-products/invalidate", tags=["Cache"])
+async def invalidate_category_cache(category_id: str = Query(None, description="Omit to flush every category")):
+    """Hook for product writers: drop cached product ids after products change"""
+    removed = invalidate_category_products(category_id)
+    return {"category_id": category_id, "invalidated": removed}
+
+
+@router.get("/api/cache/llm/stats", tags=["Cache"])
+async def get_llm_cache_stats():
+    return await run_in_threadpool(llm_cache.stats)
+
+
+@router.post("/api/cache/llm/clear", tags=["Cache"])
+async def clear_llm_cache(kind: str = Query(None, description="stock_alert or substitutes; omit to clear everything")):
+    removed = await run_in_threadpool(llm_cache.clear, kind)
+    return {"kind": kind, "cleared": removed}
+
+
+@router.get("/api/cache/responses/stats", tags=["Cache"])
+async def get_response_cache_stats():
+    return response_cache.stats()
+
+
+@router.post("/api/cache/responses/invalidate", tags=["Cache"])
+async def invalidate_response_cache(store_id: str = Query(None, description="Omit to flush every store")):
+    """
+    Drop cached analytics responses of a store in the worker that answers this
+    request only; other workers keep theirs until RESPONSE_CACHE_WATCH_ORDERS
+    or the TTLs catch up. For debugging, not for order writers.
+    """
+    removed = response_cache.invalidate_store(store_id)
+    return {"store_id": store_id, "invalidated": removed, "scope": "worker", "pid": os.getpid()}
+
+
+@router.get("/api/live-kpis/stats", tags=["Cache"])
+async def get_live_kpi_stats():
+    return await live_kpi_status(db)
+
+
+@router.get("/metrics", tags=["Monitoring"], include_in_schema=False)
+def get_metrics():
+    """Prometheus scrape endpoint (see metrics.py)"""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
 
 @router.get("/api/analytics/quick-analysis/{store_id}", tags=["AI Analytics"])
-def get_product_substitutes_for_low_stock(
+async def get_product_substitutes_for_low_stock(
     store_id: str,
-    top_n: int = Query(4, ge=1, le=10, description="Number of substitute products to suggest per low stock product")
+    top_n: int = Query(4, ge=1, le=10, description="Number of substitute products to suggest per low stock product"),
+    rerank: bool = Query(True, description="Let the LLM rerank the candidates when it is configured")
 ) -> Dict[str, Any]:
     """Get AI-powered alternative products for top 5 low stock items using GPT"""
     try:
         # Use database collections directly
         products_collection = db.products
         categories_collection = db.categories
-        units_collection = db.units
-        # Use the AzureOpenAI client that's already initialized
-        openai_client = client if AZURE_KEY and AZURE_ENDPOINT else None
-        
-        # Get top 5 low stock products
-        product_data = get_low_stock_products(
-            products_collection,
-            categories_collection,
-            units_collection,
-            store_id,
-            limit=5
-        )
-        product_ids = [item["product_id"] for item in product_data.get("low_stock_products", [])]
-
-        results = []
-        for pid in product_ids:
-            # Get top_n (default 4) substitutes for each low stock product
-            substitutes = get_product_substitutes(
-                store_id,
-                pid,
-                top_n,
+        openai_client = get_azure_client() if AZURE_KEY and AZURE_ENDPOINT and rerank else None
+
+        # Batched plan: low-stock products (the originals), their substitute graph rows, and for
+        # products without one (graph not built yet) candidates per distinct category
+        originals = await get_low_stock_products(products_collection, store_id, limit=5)
+        graph = {}
+        if SUBSTITUTE_GRAPH_ENABLED and originals:
+            graph = await get_substitute_rows(db, [original["_id"] for original in originals])
+        ungraphed = [original for original in originals if original["_id"] not in graph]
+        candidates = {}
+        if ungraphed:
+            candidates = await get_similar_products_by_category(
                 products_collection,
                 categories_collection,
-                openai_client
+                store_id,
+                ungraphed
             )
-            results.append({
+
+        async def substitutes_for(original):
+            pid = str(original["_id"])
+            if original["_id"] in graph:
+                similar_products = graph_candidates(graph[original["_id"]])
+            else:
+                similar_products = [
+                    product for product in candidates[original.get("category") or None]
+                    if product["_id"] != pid
+                ][:SIMILAR_PRODUCTS_LIMIT]
+            # Get top_n (default 4) substitutes for each low stock product
+            async with llm_semaphore:
+                substitutes = await run_in_threadpool(suggest_substitutes, original, similar_products, top_n, openai_client)
+            return {
                 "product_id": pid,
-                "substitutes": substitutes
-            })
+                "substitutes": {
+                    "store_id": store_id,
+                    "original_product": {
+                        "name": original.get("ProductName", "Unknown"),
+                        "price": original.get("offerPrice", 0)
+                    },
+                    "substitutes": substitutes,
+                    "ai_model": "gpt-4o-mini",
+                    "ranking": "substitute_graph" if original["_id"] in graph else "category"
+                }
+            }
+
+        results = await asyncio.gather(*(substitutes_for(original) for original in originals))
 
         return {"results": results}
     except Exception as e:
         logger.exception("Failed to get product substitutes")
         raise HTTPException(status_code=500, detail=f"Cannot get alternatives: {str(e)}")
 
+# ============================================================================
+# AI JOBS (POST returns a job id; poll /api/jobs/{id} or stream /api/jobs/{id}/events)
+# ============================================================================
+
+from ai_jobs import job_runner, public_job, FINISHED, AI_JOB_TIMEOUT_SECONDS
+
+JOB_POLL_SECONDS = 1.0
+
+job_runner.register("top-stock-alerts", get_top_stock_alerts)
+job_runner.register("quick-analysis", get_product_substitutes_for_low_stock)
+
+
+async def submit_ai_job(kind: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    try:
+        validate_store_id(params["store_id"])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        job, deduplicated = await job_runner.submit(db, kind, params)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to create job: {str(e)}")
+    return {
+        **public_job(job),
+        "deduplicated": deduplicated,
+        "status_url": f"/api/jobs/{job['_id']}",
+        "events_url": f"/api/jobs/{job['_id']}/events"
+    }
+
+
+@router.post("/api/analytics/top-stock-alerts/{store_id}/jobs", tags=["AI Jobs"], status_code=202)
+async def submit_top_stock_alerts_job(store_id: str):
+    return await submit_ai_job("top-stock-alerts", {"store_id": store_id})
+
+
+@router.post("/api/analytics/quick-analysis/{store_id}/jobs", tags=["AI Jobs"], status_code=202)
+async def submit_quick_analysis_job(
+    store_id: str,
+    top_n: int = Query(4, ge=1, le=10, description="Number of substitute products to suggest per low stock product"),
+    rerank: bool = Query(True, description="Let the LLM rerank the candidates when it is configured")
+):
+    return await submit_ai_job("quick-analysis", {"store_id": store_id, "top_n": top_n, "rerank": rerank})
+
+
+@router.get("/api/jobs/{job_id}", tags=["AI Jobs"])
+async def get_ai_job(job_id: str):
+    job = await job_runner.get(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return public_job(job)
+
+
+@router.get("/api/jobs/{job_id}/events", tags=["AI Jobs"])
+async def stream_ai_job(job_id: str):
+    """Server-sent events: one `status` event per status change, the last one carries the result"""
+    async def events():
+        last_status = None
+        deadline = asyncio.get_running_loop().time() + AI_JOB_TIMEOUT_SECONDS + 30
+        while True:
+            job = await job_runner.get(db, job_id)
+            if job is None:
+                yield f"event: error\ndata: {json.dumps({'error': 'Job not found or expired'})}\n\n"
+                return
+            if job["status"] != last_status:
+                last_status = job["status"]
+                yield f"event: status\ndata: {json.dumps(public_job(job), default=str)}\n\n"
+            if job["status"] in FINISHED or asyncio.get_running_loop().time() > deadline:
+                return
+            await asyncio.sleep(JOB_POLL_SECONDS)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@router.get("/api/jobs", tags=["AI Jobs"])
+async def get_ai_job_stats():
+    return job_runner.stats()
+
+
 # ============================================================================
 # USAGE EXAMPLE
 # ============================================================================
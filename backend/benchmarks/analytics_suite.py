@@ -0,0 +1,290 @@
+"""
+Latency / docs-examined suite for every /api/analytics/* handler.
+
+For each dataset scale it seeds BENCH_MONGODB_DB with synthetic_data.py
+(plus rollups, search keys and substitute graph), then calls every analytics
+route of api.router in-process (ASGI, no network, response cache off)
+against the busiest store and records:
+
+    p50 / p95 / mean latency over --repeat calls (after one warm-up call)
+    docs and keys examined by one extra call, from the database profiler
+
+Each scale is measured in a fresh interpreter so no module-level cache
+survives a reseed. Results are compared with a stored baseline; the run
+exits 1 when any case got slower than the tolerance or examines more
+documents than before, and 2 (before seeding) when there is no baseline
+to compare with and --record wasn't given.
+
+    python benchmarks/analytics_suite.py                                 # compare with benchmarks/baseline.json
+    python benchmarks/analytics_suite.py --scales 10000,100000,1000000
+    python benchmarks/analytics_suite.py --record                        # record a new baseline (same machine!)
+    python benchmarks/analytics_suite.py --only kpis,recent-orders --reuse
+
+Latencies only compare on the same machine; docs examined compare anywhere.
+The AI routes (LLM), top-dish-searches (Supabase) and the live SSE stream are not covered.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import MongoClient
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from synthetic_data import BENCH_MONGODB_DB, BENCH_MONGODB_URI, DATASET_COLLECTION, build_derived, generate  # noqa: E402
+
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+SKIP_TAGS = {"AI Analytics"}
+SKIP_PATHS = {"/api/analytics/top-dish-searches/{store_id}", "/api/analytics/live/{store_id}"}
+
+
+# Extra query strings per route on top of the bare call; dates are relative to the dataset end
+def _variants(now: datetime) -> Dict[str, List[Tuple[str, Dict[str, Any]]]]:
+    last_30 = (now - timedelta(days=30)).strftime("%Y-%m-%d")
+    last_90 = (now - timedelta(days=90)).strftime("%Y-%m-%d")
+    return {
+        "kpis": [("last-30d", {"date_from": last_30}), ("completed", {"status": "COMPLETED"})],
+        "monthly-revenue": [("last-90d", {"date_from": last_90})],
+        "sales-by-time-period": [("last-30d", {"date_from": last_30})],
+        "sales-heatmap": [("ist-last-90d", {"tz": "Asia/Kolkata", "date_from": last_90})],
+        "revenue-timeseries": [
+            ("ist-last-90d", {"tz": "Asia/Kolkata", "date_from": last_90}),
+            ("utc-day", {"tz": "UTC", "granularity": "day"})
+        ],
+        "unique-customers": [("approx", {"mode": "approx"}), ("exact", {"mode": "exact"})],
+        "top-selling-products": [("last-30d", {"date_from": last_30})],
+        "recent-orders": [
+            ("page-50", {"page": 50}),
+            ("search-name", {"search": "sharma"}),
+            ("search-order-no", {"search": "ORD0000"}),
+            ("completed-exact-total", {"status": "COMPLETED", "total": "exact"})
+        ],
+        "orders/export": [("csv-last-30d", {"format": "csv", "date_from": last_30})]
+    }
+
+
+def route_cases(router, now: datetime, only: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """One case per analytics GET route, plus the variants above"""
+    variants = _variants(now)
+    cases = []
+    for route in router.routes:
+        path = getattr(route, "path", "")
+        if not path.startswith("/api/analytics/") or "GET" not in getattr(route, "methods", set()):
+            continue
+        if path in SKIP_PATHS or SKIP_TAGS & set(route.tags or []):
+            continue
+        name = path[len("/api/analytics/"):].replace("/{store_id}", "")
+        if only and name not in only:
+            continue
+        if name == "orders/export":
+            # A bare export streams the whole store; only the bounded variant is timed
+            base = []
+        else:
+            base = [(name, {})]
+        for label, params in base + [(f"{name}:{label}", params) for label, params in variants.get(name, [])]:
+            cases.append({"name": label, "path": path, "params": params})
+    return cases
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def profile_call(sync_db, call) -> Optional[Dict[str, int]]:
+    """Docs / keys examined by every command `call` issues (profiler level 2, standalone or replica set primary)"""
+    try:
+        sync_db.command("profile", 0)
+        sync_db.system.profile.drop()
+        sync_db.command("profile", 2)
+    except Exception:
+        return None
+    try:
+        call()
+    finally:
+        sync_db.command("profile", 0)
+    totals = {"docs_examined": 0, "keys_examined": 0, "commands": 0}
+    for entry in sync_db.system.profile.find({}, {"docsExamined": 1, "keysExamined": 1}):
+        totals["docs_examined"] += entry.get("docsExamined", 0)
+        totals["keys_examined"] += entry.get("keysExamined", 0)
+        totals["commands"] += 1
+    return totals
+
+
+# ============================================================================
+# MEASURE (runs in a child interpreter per scale)
+# ============================================================================
+
+def measure(repeat: int, only: Optional[List[str]]) -> Dict[str, Any]:
+    # Point the app at the benchmark database and take the cache out of the picture before importing it
+    os.environ["MONGODB_URI"] = BENCH_MONGODB_URI
+    os.environ["MONGODB_DB"] = BENCH_MONGODB_DB
+    os.environ["RESPONSE_CACHE_ENABLED"] = "false"
+    os.environ.setdefault("AZURE_KEY", "bench")
+    os.environ.setdefault("AZURE_ENDPOINT", "http://127.0.0.1:9")
+
+    import httpx
+    from fastapi import FastAPI
+
+    import api
+
+    sync_db = MongoClient(BENCH_MONGODB_URI)[BENCH_MONGODB_DB]
+    dataset = sync_db[DATASET_COLLECTION].find_one({"_id": "current"})
+    store_id = dataset["stores"][0]
+    cases = route_cases(api.router, dataset["generated_at"], only)
+
+    app = FastAPI()
+    app.include_router(api.router)
+    results: Dict[str, Any] = {}
+
+    async def run_cases():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            async def call(case):
+                params = case["params"]
+                if "{store_id}" not in case["path"]:
+                    # Chain routes (multi-store/*) cover every seeded store
+                    params = {"store_ids": ",".join(dataset["stores"]), **params}
+                response = await client.get(case["path"].replace("{store_id}", store_id), params=params)
+                return response.status_code, len(response.content)
+
+            for case in cases:
+                status, size = await call(case)  # warm-up (connection pool, category/plan caches)
+                samples = []
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    status, size = await call(case)
+                    samples.append((time.perf_counter() - started) * 1000)
+
+                loop = asyncio.get_running_loop()
+                # The profiler is read with the blocking client; run the call on this loop from a worker thread
+                examined = await loop.run_in_executor(
+                    None, profile_call, sync_db, lambda: asyncio.run_coroutine_threadsafe(call(case), loop).result()
+                )
+                result = results[case["name"]] = {
+                    "path": case["path"],
+                    "params": case["params"],
+                    "status": status,
+                    "bytes": size,
+                    "p50_ms": round(percentile(samples, 50), 2),
+                    "p95_ms": round(percentile(samples, 95), 2),
+                    "mean_ms": round(statistics.fmean(samples), 2),
+                    **(examined or {"docs_examined": None, "keys_examined": None, "commands": None})
+                }
+                print(f"  {case['name']:<45} p50={result['p50_ms']:9.1f} ms  p95={result['p95_ms']:9.1f} ms  docs={result['docs_examined']}", file=sys.stderr)
+
+    asyncio.run(run_cases())
+    return {"dataset": {k: v for k, v in dataset.items() if k not in ("_id", "generated_at")}, "cases": results}
+
+
+# ============================================================================
+# BASELINE
+# ============================================================================
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], latency_tolerance: float, min_delta_ms: float, docs_tolerance: float) -> List[str]:
+    """Human-readable regressions of current vs baseline (both {scale: {"cases": {...}}})"""
+    regressions = []
+    for scale, run in current.items():
+        base_cases = (baseline.get(scale) or {}).get("cases", {})
+        for name, case in run["cases"].items():
+            base = base_cases.get(name)
+            if case["status"] != 200:
+                regressions.append(f"[{scale}] {name}: HTTP {case['status']}")
+                continue
+            if not base:
+                continue
+            if case["p95_ms"] > base["p95_ms"] * (1 + latency_tolerance) and case["p95_ms"] - base["p95_ms"] > min_delta_ms:
+                regressions.append(f"[{scale}] {name}: p95 {base['p95_ms']} -> {case['p95_ms']} ms")
+            if case.get("docs_examined") is not None and base.get("docs_examined") is not None:
+                if case["docs_examined"] > base["docs_examined"] * (1 + docs_tolerance):
+                    regressions.append(f"[{scale}] {name}: docs examined {base['docs_examined']} -> {case['docs_examined']}")
+    return regressions
+
+
+# ============================================================================
+# CLI
+# ============================================================================
+
+def seed_scale(orders: int, stores: int, reuse: bool) -> None:
+    sync_db = MongoClient(BENCH_MONGODB_URI)[BENCH_MONGODB_DB]
+    current = sync_db[DATASET_COLLECTION].find_one({"_id": "current"})
+    if reuse and current and current.get("orders") == orders and len(current.get("stores", [])) == stores:
+        return
+    products = max(500, orders // 100)
+    print(f"Seeding {orders} orders / {products} products / {stores} stores into {BENCH_MONGODB_DB}...", file=sys.stderr)
+    generate(sync_db, stores, products, orders)
+    build_derived(sync_db)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every /api/analytics/* handler at several dataset scales")
+    parser.add_argument("--scales", default="20000,200000", help="Comma-separated total order counts")
+    parser.add_argument("--stores", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--only", help="Comma-separated route names, e.g. kpis,recent-orders")
+    parser.add_argument("--reuse", action="store_true", help="Skip seeding when the database already holds this scale")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--record", "--update-baseline", dest="record", action="store_true", help="Record a new baseline instead of comparing")
+    parser.add_argument("--out", help="Also write this run's results here")
+    parser.add_argument("--latency-tolerance", type=float, default=0.25, help="Allowed p95 growth (0.25 = +25%%)")
+    parser.add_argument("--min-delta-ms", type=float, default=5.0, help="Ignore p95 changes smaller than this")
+    parser.add_argument("--docs-tolerance", type=float, default=0.10, help="Allowed growth of docs examined")
+    parser.add_argument("--measure", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    only = [name.strip() for name in args.only.split(",")] if args.only else None
+
+    if args.measure:
+        json.dump(measure(args.repeat, only), sys.stdout, default=str)
+        return
+
+    # Checked before seeding: without a baseline there is nothing to gate on
+    if not args.record and not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; record one with --record on the reference machine", file=sys.stderr)
+        sys.exit(2)
+
+    current = {}
+    for scale in (int(s) for s in args.scales.split(",")):
+        seed_scale(scale, args.stores, args.reuse)
+        print(f"Measuring scale {scale}...", file=sys.stderr)
+        command = [sys.executable, os.path.abspath(__file__), "--measure", "--repeat", str(args.repeat)]
+        if args.only:
+            command += ["--only", args.only]
+        output = subprocess.run(command, check=True, stdout=subprocess.PIPE, text=True, cwd=BACKEND_DIR).stdout
+        current[str(scale)] = json.loads(output)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(current, f, indent=2)
+
+    if args.record:
+        with open(args.baseline, "w") as f:
+            json.dump(current, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(current, baseline, args.latency_tolerance, args.min_delta_ms, args.docs_tolerance)
+    if regressions:
+        print("Regressions against baseline:")
+        for line in regressions:
+            print(f"  {line}")
+        sys.exit(1)
+    print("No regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+products-by-category: legacy double-$lookup pipeline vs group-by-product + in-memory fold.
+
+Seeds a throwaway database on a local mongod (dropped and recreated on every run),
+checks both versions return the same distribution and prints timings.
+
+    python benchmarks/products_by_category.py
+    python benchmarks/products_by_category.py --orders 200000 --products 2000 --repeat 5
+    BENCH_MONGODB_URI=mongodb://localhost:27017 BENCH_MONGODB_DB=analytics_bench python benchmarks/products_by_category.py
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import MongoClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from category_cache import category_distribution, store_product_categories_cache  # noqa: E402
+from indexes import ensure_indexes  # noqa: E402
+
+
+BENCH_MONGODB_URI = os.getenv("BENCH_MONGODB_URI", "mongodb://localhost:27017")
+BENCH_MONGODB_DB = os.getenv("BENCH_MONGODB_DB", "analytics_bench")
+
+
+def legacy_pipeline(match_stage):
+    return [
+        {"$match": match_stage},
+        {"$unwind": "$items"},
+        {"$lookup": {"from": "products", "localField": "items._id", "foreignField": "_id", "as": "product_info"}},
+        {"$unwind": "$product_info"},
+        {"$lookup": {"from": "categories", "localField": "product_info.category", "foreignField": "_id", "as": "category_info"}},
+        {"$unwind": "$category_info"},
+        {
+            "$group": {
+                "_id": "$product_info.category",
+                "category_name": {"$first": "$category_info.name"},
+                "product_count": {"$addToSet": "$items._id"},
+                "order_count": {"$sum": 1},
+                "total_revenue": {"$sum": "$items.subTotal"},
+                "total_quantity": {"$sum": "$items.quantity"}
+            }
+        },
+        {
+            "$project": {
+                "_id": 0,
+                "category_id": {"$toString": "$_id"},
+                "category_name": 1,
+                "product_count": {"$size": "$product_count"},
+                "order_count": 1,
+                "total_revenue": {"$round": ["$total_revenue", 2]},
+                "total_stock_value": {"$round": ["$total_revenue", 2]},
+                "total_quantity": 1
+            }
+        },
+        {"$sort": {"order_count": -1}}
+    ]
+
+
+def seed(db, orders: int, products: int, categories: int, seed_value: int = 7) -> ObjectId:
+    rnd = random.Random(seed_value)
+    for name in ("orders", "products", "categories"):
+        db[name].drop()
+
+    seller = ObjectId()
+    category_docs = [{"_id": ObjectId(), "name": f"Category {i}"} for i in range(categories)]
+    db.categories.insert_many(category_docs)
+    product_docs = [
+        {
+            "_id": ObjectId(),
+            "seller": seller,
+            "category": rnd.choice(category_docs)["_id"],
+            "ProductName": f"Product {i}",
+            "offerPrice": rnd.randint(10, 500)
+        }
+        for i in range(products)
+    ]
+    db.products.insert_many(product_docs)
+
+    start = datetime(2024, 1, 1)
+    batch = []
+    for i in range(orders):
+        items = []
+        for product in rnd.sample(product_docs, rnd.randint(1, 5)):
+            quantity = rnd.randint(1, 4)
+            items.append({"_id": product["_id"], "quantity": quantity, "subTotal": round(quantity * product["offerPrice"] * 1.0, 2)})
+        created = start + timedelta(minutes=rnd.randint(0, 365 * 24 * 60))
+        batch.append({
+            "seller": seller,
+            "status": rnd.choice(["COMPLETED", "COMPLETED", "PENDING", "CANCELLED"]),
+            "createdAt": created,
+            "updatedAt": created,
+            "total": sum(item["subTotal"] for item in items),
+            "items": items
+        })
+        if len(batch) == 5000:
+            db.orders.insert_many(batch)
+            batch = []
+    if batch:
+        db.orders.insert_many(batch)
+    ensure_indexes(db)
+    return seller
+
+
+def normalise(rows):
+    return sorted(
+        (r["category_id"], r["category_name"], r["product_count"], r["order_count"], r["total_quantity"], round(r["total_revenue"], 2))
+        for r in rows
+    )
+
+
+async def timed(fn, repeat: int):
+    samples, result = [], None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = await fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return result, samples
+
+
+async def run(args):
+    sync_db = MongoClient(BENCH_MONGODB_URI)[BENCH_MONGODB_DB]
+    print(f"Seeding {args.orders} orders / {args.products} products / {args.categories} categories into {BENCH_MONGODB_DB}...")
+    seller = seed(sync_db, args.orders, args.products, args.categories)
+    db = AsyncIOMotorClient(BENCH_MONGODB_URI)[BENCH_MONGODB_DB]
+    match_stage = {"seller": seller}
+
+    async def legacy():
+        return await db.orders.aggregate(legacy_pipeline(match_stage)).to_list(None)
+
+    async def folded_cold():
+        store_product_categories_cache.invalidate()
+        return await category_distribution(db, str(seller), match_stage)
+
+    async def folded_warm():
+        return await category_distribution(db, str(seller), match_stage)
+
+    legacy_rows, legacy_ms = await timed(legacy, args.repeat)
+    cold_rows, cold_ms = await timed(folded_cold, args.repeat)
+    warm_rows, warm_ms = await timed(folded_warm, args.repeat)
+
+    if not (normalise(legacy_rows) == normalise(cold_rows) == normalise(warm_rows)):
+        raise SystemExit("Results differ between the legacy and folded versions")
+
+    legacy_median = statistics.median(legacy_ms)
+    for label, samples in (("legacy $lookup x2", legacy_ms), ("fold (cold map)", cold_ms), ("fold (cached map)", warm_ms)):
+        median = statistics.median(samples)
+        print(f"{label:<20} median={median:9.1f} ms  min={min(samples):9.1f} ms  speedup={legacy_median / median:5.1f}x")
+
+    if not args.keep:
+        sync_db.client.drop_database(BENCH_MONGODB_DB)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark products-by-category")
+    parser.add_argument("--orders", type=int, default=50000)
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--categories", type=int, default=25)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--keep", action="store_true", help="Keep the seeded database")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""
+Synthetic stores, products and orders for benchmarking the analytics endpoints.
+
+Documents have the shapes api.py reads (items, customer, status, orderType,
+shippingInfo, ...). Order volume is skewed across stores (store i gets a share
+proportional to 1 / (i + 1)), customers repeat, and createdAt follows
+lunch/dinner peaks in store-local time (UTC+05:30), so the time-period,
+top-customer and unique-customer pipelines see realistic cardinalities.
+
+    python benchmarks/synthetic_data.py --stores 5 --products 2000 --orders 200000
+    python benchmarks/synthetic_data.py --orders 1000000 --derived   # also build rollups, search keys, substitute graph
+
+Targets BENCH_MONGODB_URI / BENCH_MONGODB_DB and drops the benchmark
+collections first.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+
+from bson import ObjectId
+from pymongo import MongoClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from indexes import ensure_indexes  # noqa: E402
+
+
+BENCH_MONGODB_URI = os.getenv("BENCH_MONGODB_URI", "mongodb://localhost:27017")
+BENCH_MONGODB_DB = os.getenv("BENCH_MONGODB_DB", "analytics_bench")
+
+INSERT_BATCH_SIZE = 5000
+DATASET_COLLECTION = "bench_dataset"
+COLLECTIONS = (
+    "sellers", "categories", "products", "orders", DATASET_COLLECTION,
+    "order_daily_rollups", "rollup_state", "order_search_state", "product_substitutes", "substitute_graph_state"
+)
+
+STATUSES = [("COMPLETED", 70), ("CANCELLED", 8), ("PENDING", 5), ("ACCEPTED", 4), ("IN_DELIVERY", 4), ("PICKED_UP", 4), ("EXPIRED", 5)]
+ORDER_TYPES = [("CUSTOMER_APP", 65), ("POS", 35)]
+PAYMENT_METHODS = [("UPI", 55), ("CASH", 30), ("CARD", 15)]
+# Store-local hour weights: breakfast bump, lunch and dinner peaks, quiet nights
+HOUR_WEIGHTS = [1, 1, 1, 1, 1, 2, 4, 8, 10, 8, 6, 9, 14, 15, 10, 6, 5, 7, 12, 16, 15, 10, 5, 2]
+STORE_UTC_OFFSET = timedelta(hours=5, minutes=30)
+
+CATEGORY_NAMES = [
+    "Fruits", "Vegetables", "Dairy", "Bakery", "Snacks", "Beverages", "Staples", "Spices", "Frozen", "Meat",
+    "Seafood", "Personal Care", "Household", "Baby Care", "Pet Care", "Sweets", "Ready to Eat", "Breakfast",
+    "Oils", "Pulses", "Rice", "Flour", "Dry Fruits", "Sauces", "Pickles"
+]
+PRODUCT_WORDS = [
+    "Organic", "Fresh", "Premium", "Classic", "Masala", "Paneer", "Basmati", "Toor", "Atta", "Ghee", "Curd", "Milk",
+    "Tomato", "Onion", "Potato", "Mango", "Banana", "Tea", "Coffee", "Biscuit", "Chips", "Namkeen", "Soap", "Shampoo",
+    "Detergent", "Juice", "Honey", "Jaggery", "Cashew", "Almond", "Chilli", "Turmeric", "Cumin", "Bread", "Butter"
+]
+PACK_SIZES = ["100 g", "200 g", "250 g", "500 g", "1 kg", "2 kg", "5 kg", "200 ml", "500 ml", "1 L"]
+FIRST_NAMES = ["Aarav", "Vivaan", "Aditya", "Diya", "Ananya", "Ishaan", "Kavya", "Rohan", "Priya", "Arjun", "Meera", "Sai", "Neha", "Rahul", "Pooja"]
+LAST_NAMES = ["Sharma", "Patel", "Reddy", "Iyer", "Khan", "Singh", "Das", "Nair", "Gupta", "Mehta", "Rao", "Joshi"]
+
+
+def _weighted(rnd: random.Random, pairs):
+    return rnd.choices([value for value, _ in pairs], weights=[weight for _, weight in pairs])[0]
+
+
+def _created_at(rnd: random.Random, start: datetime, days: int) -> datetime:
+    local_day = start + timedelta(days=rnd.randrange(days))
+    local = local_day + timedelta(hours=rnd.choices(range(24), weights=HOUR_WEIGHTS)[0], minutes=rnd.randrange(60), seconds=rnd.randrange(60))
+    return local - STORE_UTC_OFFSET
+
+
+def _products(rnd: random.Random, seller: ObjectId, categories: List[Dict[str, Any]], count: int, created: datetime) -> List[Dict[str, Any]]:
+    products = []
+    for i in range(count):
+        mrp = rnd.randint(20, 1500)
+        offer = round(mrp * rnd.uniform(0.7, 1.0), 2)
+        products.append({
+            "_id": ObjectId(),
+            "seller": seller,
+            "category": rnd.choice(categories)["_id"],
+            "ProductName": f"{rnd.choice(PRODUCT_WORDS)} {rnd.choice(PRODUCT_WORDS)} {rnd.choice(PACK_SIZES)} #{i}",
+            "mrpPrice": mrp,
+            "offerPrice": offer,
+            "posPrice": offer,
+            "stockQuantity": rnd.choice([0, 0, 1, 2, 3, 5, 8, 12, 20, 40, 75, 150, 400]),
+            "status": "APPROVED" if rnd.random() < 0.9 else "PENDING",
+            "availabilityStatus": rnd.random() < 0.85,
+            "createdAt": created,
+            "updatedAt": created
+        })
+    return products
+
+
+def _customers(rnd: random.Random, count: int) -> List[Dict[str, Any]]:
+    return [
+        {
+            "id": ObjectId(),
+            "customerName": f"{rnd.choice(FIRST_NAMES)} {rnd.choice(LAST_NAMES)}",
+            "phoneNumber": f"9{rnd.randrange(10 ** 9):09d}"
+        }
+        for _ in range(count)
+    ]
+
+
+def _order(rnd: random.Random, seller: ObjectId, number: int, products: List[Dict[str, Any]], customers: List[Dict[str, Any]], created: datetime) -> Dict[str, Any]:
+    items = []
+    for product in rnd.sample(products, min(len(products), rnd.choices([1, 2, 3, 4, 5, 6, 8], weights=[25, 25, 18, 12, 8, 7, 5])[0])):
+        quantity = rnd.choices([1, 2, 3, 4, 6], weights=[60, 22, 9, 6, 3])[0]
+        items.append({
+            "_id": product["_id"],
+            "productName": product["ProductName"],
+            "Quantity": product["ProductName"].rsplit(" #", 1)[0].split(" ", 2)[-1],
+            "quantity": quantity,
+            "offerPrice": product["offerPrice"],
+            "subTotal": round(quantity * product["offerPrice"], 2)
+        })
+    subtotal = round(sum(item["subTotal"] for item in items), 2)
+    charges = {"delivery": rnd.choice([0, 0, 20, 30, 40]), "packaging": rnd.choice([0, 5, 10])}
+    total = round(subtotal + charges["delivery"] + charges["packaging"], 2)
+    status = _weighted(rnd, STATUSES)
+    order_type = _weighted(rnd, ORDER_TYPES)
+    # Repeat customers: a small core places most of the orders
+    customer = customers[min(int(rnd.paretovariate(1.2)) - 1, len(customers) - 1)] if rnd.random() < 0.6 else rnd.choice(customers)
+    delivery = order_type == "CUSTOMER_APP" and rnd.random() < 0.8
+
+    order = {
+        "seller": seller,
+        "orderNo": f"ORD{number:08d}",
+        "invoiceNo": f"INV{number:08d}",
+        "customer": dict(customer),
+        "items": items,
+        "subTotal": subtotal,
+        "charges": charges,
+        "total": total,
+        "amountReceived": total if status == "COMPLETED" else 0,
+        "status": status,
+        "orderType": order_type,
+        "paymentMethod": _weighted(rnd, PAYMENT_METHODS),
+        "deliveryType": "DELIVERY" if delivery else "PICKUP",
+        "timeDuration": rnd.randint(10, 90),
+        "createdAt": created,
+        "updatedAt": created
+    }
+    if delivery:
+        order["shippingInfo"] = {
+            "pickup": {"formatted_address": "Store address"},
+            "delivery": {
+                "name": customer["customerName"],
+                "alternativePhoneNumber": customer["phoneNumber"],
+                "address": {"formatted_address": f"{rnd.randint(1, 999)}, Sector {rnd.randint(1, 60)}"}
+            },
+            "distanceBetweenStoreAndCustomer": round(rnd.uniform(0.3, 9.0), 1),
+            "driver": {"details": {"driver_name": f"Driver {rnd.randint(1, 40)}", "mobile": f"8{rnd.randrange(10 ** 9):09d}"}}
+        }
+    if status == "COMPLETED":
+        order["deliveredAt"] = created + timedelta(minutes=order["timeDuration"])
+        order["updatedAt"] = order["deliveredAt"]
+    return order
+
+
+def generate(db, stores: int, products: int, orders: int, categories: int = 25, days: int = 365, seed_value: int = 7) -> Dict[str, Any]:
+    """Drop and reseed; returns a summary with the store ids, busiest first"""
+    rnd = random.Random(seed_value)
+    for name in COLLECTIONS:
+        db[name].drop()
+
+    started = time.perf_counter()
+    start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days)
+    category_docs = [{"_id": ObjectId(), "name": CATEGORY_NAMES[i % len(CATEGORY_NAMES)] + (f" {i // len(CATEGORY_NAMES)}" if i >= len(CATEGORY_NAMES) else "")} for i in range(categories)]
+    db.categories.insert_many(category_docs)
+
+    weights = [1 / (i + 1) for i in range(stores)]
+    order_counts = [int(orders * w / sum(weights)) for w in weights]
+    order_counts[0] += orders - sum(order_counts)
+    product_counts = [max(1, int(products * w / sum(weights))) for w in weights]
+
+    store_ids = []
+    number = 0
+    for index in range(stores):
+        seller = ObjectId()
+        store_ids.append(seller)
+        db.sellers.insert_one({"_id": seller, "storeName": f"Bench Store {index + 1}", "createdAt": start})
+        store_products = _products(rnd, seller, category_docs, product_counts[index], start)
+        db.products.insert_many(store_products)
+        customers = _customers(rnd, max(10, order_counts[index] // 6))
+
+        batch = []
+        for _ in range(order_counts[index]):
+            number += 1
+            batch.append(_order(rnd, seller, number, store_products, customers, _created_at(rnd, start, days)))
+            if len(batch) >= INSERT_BATCH_SIZE:
+                db.orders.insert_many(batch, ordered=False)
+                batch = []
+        if batch:
+            db.orders.insert_many(batch, ordered=False)
+
+    ensure_indexes(db)
+    summary = {
+        "_id": "current",
+        "stores": [str(s) for s in store_ids],
+        "orders": orders,
+        "products": sum(product_counts),
+        "categories": categories,
+        "days": days,
+        "seed": seed_value,
+        "generated_at": datetime.utcnow(),
+        "seconds": round(time.perf_counter() - started, 1)
+    }
+    db[DATASET_COLLECTION].replace_one({"_id": "current"}, summary, upsert=True)
+    return summary
+
+
+def build_derived(db) -> None:
+    """Rollups, search keys and substitute graph, so the endpoints take their production paths"""
+    from order_search import refresh_search_keys
+    from rollups import backfill_rollups
+    from substitute_graph import refresh_substitute_graph
+
+    backfill_rollups(db)
+    refresh_search_keys(db, full=True)
+    refresh_substitute_graph(db, full=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed a local mongod with synthetic analytics data")
+    parser.add_argument("--stores", type=int, default=5)
+    parser.add_argument("--products", type=int, default=2000, help="Total across stores")
+    parser.add_argument("--orders", type=int, default=100000, help="Total across stores")
+    parser.add_argument("--categories", type=int, default=25)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--derived", action="store_true", help="Also build rollups, search keys and the substitute graph")
+    args = parser.parse_args()
+
+    db = MongoClient(BENCH_MONGODB_URI)[BENCH_MONGODB_DB]
+    summary = generate(db, args.stores, args.products, args.orders, args.categories, args.days, args.seed)
+    print(f"Seeded {summary['orders']} orders / {summary['products']} products / {args.stores} stores in {summary['seconds']}s")
+    if args.derived:
+        build_derived(db)
+        print("Built rollups, search keys and substitute graph")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from bson import ObjectId
+
+
+logger = logging.getLogger(__name__)
+
+CATEGORY_CACHE_MAX_ENTRIES = int(os.getenv("CATEGORY_CACHE_MAX_ENTRIES", "256"))
+CATEGORY_CACHE_TTL_SECONDS = float(os.getenv("CATEGORY_CACHE_TTL_SECONDS", "300"))
+
+
+class LRUTTLCache:
+    """Bounded LRU + TTL map with hit/miss counters (thread-safe)"""
+
+    def __init__(self, max_entries: int = CATEGORY_CACHE_MAX_ENTRIES, ttl_seconds: float = CATEGORY_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Optional[str] = None) -> int:
+        """Drop one key (or everything when key is None); returns entries removed"""
+        with self._lock:
+            if key is None:
+                removed = len(self._entries)
+                self._entries.clear()
+            else:
+                removed = 1 if self._entries.pop(str(key), None) is not None else 0
+            self.invalidations += removed
+            return removed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations
+            }
+
+
+# category id -> product ids, shared by all handlers
+category_product_cache = LRUTTLCache()
+
+
+async def resolve_category_product_ids(db, category_id: str) -> List[ObjectId]:
+    """Product ids in a category, served from the shared cache when fresh"""
+    key = str(category_id)
+    product_ids = category_product_cache.get(key)
+    if product_ids is not None:
+        return product_ids
+
+    cursor = db.products.find(
+        {"category": ObjectId(category_id)},
+        {"_id": 1}
+    )
+    product_ids = [p["_id"] async for p in cursor]
+    category_product_cache.put(key, product_ids)
+    return product_ids
+
+
+def invalidate_category_products(category_id: Optional[str] = None) -> int:
+    if category_id is None:
+        store_product_categories_cache.invalidate()
+    return category_product_cache.invalidate(category_id)
+
+
+# store id -> {product id: (category id, category name)}, used to fold per-product
+# order stats into categories without a $lookup per order line
+store_product_categories_cache = LRUTTLCache()
+
+
+async def _load_product_categories(db, products: Iterable[Dict[str, Any]]) -> Dict[ObjectId, Tuple[ObjectId, Optional[str]]]:
+    products = [p for p in products if p.get("category")]
+    category_ids = list({p["category"] for p in products})
+    names = {
+        c["_id"]: c.get("name")
+        async for c in db.categories.find({"_id": {"$in": category_ids}}, {"name": 1})
+    }
+    # Products whose category no longer exists are left out, as the old inner $lookup did
+    return {p["_id"]: (p["category"], names[p["category"]]) for p in products if p["category"] in names}
+
+
+async def resolve_product_categories(db, store_id: str, product_ids: Iterable[ObjectId]) -> Dict[ObjectId, Tuple[ObjectId, Optional[str]]]:
+    """(category id, category name) for each product id that has a category"""
+    key = str(store_id)
+    mapping = store_product_categories_cache.get(key)
+    if mapping is None:
+        cursor = db.products.find({"seller": ObjectId(store_id)}, {"category": 1})
+        mapping = await _load_product_categories(db, [p async for p in cursor])
+        store_product_categories_cache.put(key, mapping)
+
+    product_ids = list(product_ids)
+    resolved = {pid: mapping[pid] for pid in product_ids if pid in mapping}
+    missing = [pid for pid in product_ids if pid not in mapping]
+    if missing:
+        # Deleted products or lines pointing at another store's products
+        cursor = db.products.find({"_id": {"$in": missing}}, {"category": 1})
+        resolved.update(await _load_product_categories(db, [p async for p in cursor]))
+    return resolved
+
+
+async def category_distribution(db, store_id: str, match_stage: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Per-category line count, revenue and quantity: Mongo groups by product, categories are folded here"""
+    pipeline = [
+        {"$match": match_stage},
+        {"$project": {"items._id": 1, "items.subTotal": 1, "items.quantity": 1}},
+        {"$unwind": "$items"},
+        {
+            "$group": {
+                "_id": "$items._id",
+                "lines": {"$sum": 1},
+                "revenue": {"$sum": "$items.subTotal"},
+                "quantity": {"$sum": "$items.quantity"}
+            }
+        }
+    ]
+    per_product = await db.orders.aggregate(pipeline).to_list(None)
+    categories = await resolve_product_categories(db, store_id, [row["_id"] for row in per_product])
+
+    folded: Dict[ObjectId, Dict[str, Any]] = {}
+    for row in per_product:
+        if row["_id"] not in categories:
+            continue
+        category, name = categories[row["_id"]]
+        bucket = folded.setdefault(category, {"name": name, "products": 0, "lines": 0, "revenue": 0, "quantity": 0})
+        bucket["products"] += 1
+        bucket["lines"] += row["lines"]
+        bucket["revenue"] += row["revenue"]
+        bucket["quantity"] += row["quantity"]
+
+    result = [
+        {
+            "category_name": bucket["name"],
+            "product_count": bucket["products"],
+            "order_count": bucket["lines"],
+            "total_quantity": bucket["quantity"],
+            "category_id": str(category),
+            "total_revenue": round(bucket["revenue"], 2),
+            "total_stock_value": round(bucket["revenue"], 2)
+        }
+        for category, bucket in folded.items()
+    ]
+    result.sort(key=lambda row: row["order_count"], reverse=True)
+    return result
+
+
+def _apply_product_change(change: Dict[str, Any]) -> None:
+    operation = change["operationType"]
+    if operation == "update":
+        updated = (change.get("updateDescription") or {}).get("updatedFields", {})
+        removed = (change.get("updateDescription") or {}).get("removedFields", [])
+        # Stock / price updates don't move a product between categories
+        if "category" not in updated and "category" not in removed:
+            return
+
+    after = change.get("fullDocument") or {}
+    before = change.get("fullDocumentBeforeChange")
+    seller = after.get("seller") or (before or {}).get("seller")
+    if seller:
+        store_product_categories_cache.invalidate(str(seller))
+    else:
+        store_product_categories_cache.invalidate()
+    if after.get("category"):
+        invalidate_category_products(str(after["category"]))
+
+    if operation == "insert":
+        return
+    if before is None:
+        # Without a pre-image we can't tell which category the product left
+        invalidate_category_products()
+    elif before.get("category"):
+        invalidate_category_products(str(before["category"]))
+
+
+def watch_product_changes(db, stop_event: threading.Event) -> None:
+    """Invalidate cached categories from a products change stream (needs a replica set)"""
+    pipeline = [{"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete"]}}}]
+    while not stop_event.is_set():
+        try:
+            with db.products.watch(
+                pipeline,
+                full_document="updateLookup",
+                full_document_before_change="whenAvailable",
+                max_await_time_ms=1000
+            ) as stream:
+                logger.info("Watching products for category cache invalidation")
+                while not stop_event.is_set():
+                    change = stream.try_next()
+                    if change is not None:
+                        _apply_product_change(change)
+        except Exception as e:
+            logger.warning(f"Products change stream unavailable, relying on TTL: {str(e)}")
+            invalidate_category_products()
+            stop_event.wait(30)
@@ -1,7 +1,12 @@
 import os
 import logging
+import threading
+from typing import Any, Dict
 from dotenv import load_dotenv
 from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from metrics import mongo_event_listeners
 
 
 logger = logging.getLogger(__name__)
@@ -12,33 +17,156 @@ load_dotenv(".env")
 MONGODB_URI = os.getenv("MONGODB_URI")
 MONGODB_DB = os.getenv("MONGODB_DB")
 
-client = MongoClient(MONGODB_URI, serverSelectionTimeoutMS=5000)
-db = client[MONGODB_DB]
-
-products_collection = db["products"]
-
-orders_collection = db["orders"]
-logger.info(f"Orders count: {orders_collection.count_documents({})}")
-categories_collection = db["categories"]
-subcategories_collection = db["subCategories"]
-sellers_collection = db["sellers"]
-units_collection = db["units"]
-taxes_collection = db["taxes"]
-sellerpayouttransactions_collection = db["sellerpayouttransactions"]
-
-
-supabase_client = None
-try:
-    from supabase import create_client
-    
-    SUPABASE_URL = os.getenv("SUPABASE_URL")
-    SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-    
-    if SUPABASE_URL and SUPABASE_KEY:
-        supabase_client = create_client(SUPABASE_URL, SUPABASE_KEY)
-        logger.info("Supabase connected")
-    else:
+
+def _optional_int(name: str):
+    value = os.getenv(name)
+    return int(value) if value else None
+
+
+# Connection pool / timeout settings shared by the sync and async clients.
+# Unset values fall back to the driver defaults.
+MONGO_CLIENT_OPTIONS = {
+    key: value
+    for key, value in {
+        "maxPoolSize": int(os.getenv("MONGODB_MAX_POOL_SIZE", "100")),
+        "minPoolSize": int(os.getenv("MONGODB_MIN_POOL_SIZE", "0")),
+        "maxIdleTimeMS": _optional_int("MONGODB_MAX_IDLE_TIME_MS"),
+        "waitQueueTimeoutMS": _optional_int("MONGODB_WAIT_QUEUE_TIMEOUT_MS"),
+        "serverSelectionTimeoutMS": int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+        "connectTimeoutMS": int(os.getenv("MONGODB_CONNECT_TIMEOUT_MS", "10000")),
+        "socketTimeoutMS": _optional_int("MONGODB_SOCKET_TIMEOUT_MS"),
+    }.items()
+    if value is not None
+}
+
+
+class LazyDatabase:
+    """
+    Stands in for a pymongo / Motor Database and builds the client on first
+    use, so importing this module never opens a connection or blocks boot.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._db = None
+        self._lock = threading.Lock()
+
+    def _resolve(self):
+        if self._db is None:
+            with self._lock:
+                if self._db is None:
+                    self._db = self._factory()
+        return self._db
+
+    @property
+    def initialized(self) -> bool:
+        return self._db is not None
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+    def __getitem__(self, name):
+        return self._resolve()[name]
+
+    def __repr__(self):
+        return f"LazyDatabase({self._db!r})" if self._db is not None else "LazyDatabase(<not connected>)"
+
+
+_clients: Dict[str, Any] = {}
+_clients_lock = threading.Lock()
+
+
+def _client(kind: str):
+    with _clients_lock:
+        if kind not in _clients:
+            # Client construction doesn't wait for the server; the first operation does
+            factory = MongoClient if kind == "sync" else AsyncIOMotorClient
+            _clients[kind] = factory(MONGODB_URI, event_listeners=mongo_event_listeners(), **MONGO_CLIENT_OPTIONS)
+        return _clients[kind]
+
+
+def get_client() -> MongoClient:
+    """Blocking client: CLI jobs (rollups, index manager) and background threads"""
+    return _client("sync")
+
+
+def get_async_client() -> AsyncIOMotorClient:
+    """Non-blocking client for the FastAPI routes"""
+    return _client("async")
+
+
+db = LazyDatabase(lambda: get_client()[MONGODB_DB])
+async_db = LazyDatabase(lambda: get_async_client()[MONGODB_DB])
+
+
+_supabase = {"checked": False, "client": None}
+_supabase_lock = threading.Lock()
+
+
+def get_supabase_client():
+    """Supabase client, or None when not configured / unavailable (created on first call)"""
+    if not _supabase["checked"]:
+        with _supabase_lock:
+            if not _supabase["checked"]:
+                _supabase["client"] = _create_supabase_client()
+                _supabase["checked"] = True
+    return _supabase["client"]
+
+
+def _create_supabase_client():
+    try:
+        from supabase import create_client
+
+        SUPABASE_URL = os.getenv("SUPABASE_URL")
+        SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+
+        if SUPABASE_URL and SUPABASE_KEY:
+            supabase_client = create_client(SUPABASE_URL, SUPABASE_KEY)
+            logger.info("Supabase connected")
+            return supabase_client
         logger.warning("Supabase not configured")
-        
-except Exception as e:
-    logger.warning(f"Supabase connection failed: {str(e)}")
+
+    except Exception as e:
+        logger.warning(f"Supabase connection failed: {str(e)}")
+    return None
+
+
+async def log_startup_diagnostics() -> None:
+    """Connectivity check for the logs; collection metadata only, never a scan"""
+    try:
+        orders = await async_db.orders.estimated_document_count()
+        logger.info(f"Orders count (estimated): {orders}")
+    except Exception as e:
+        logger.warning(f"MongoDB not reachable yet: {str(e)}")
+
+
+def close_clients() -> None:
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+
+
+# Legacy module attributes, resolved on access
+_COLLECTION_ALIASES = {
+    "products_collection": "products",
+    "orders_collection": "orders",
+    "categories_collection": "categories",
+    "subcategories_collection": "subCategories",
+    "sellers_collection": "sellers",
+    "units_collection": "units",
+    "taxes_collection": "taxes",
+    "sellerpayouttransactions_collection": "sellerpayouttransactions",
+}
+
+
+def __getattr__(name):
+    if name in _COLLECTION_ALIASES:
+        return db[_COLLECTION_ALIASES[name]]
+    if name == "client":
+        return get_client()
+    if name == "async_client":
+        return get_async_client()
+    if name == "supabase_client":
+        return get_supabase_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -49,6 +49,10 @@ python3 -c "from database import db; print('✅ Database connection successful')
     exit 1
 }
 
+# Make sure the indexes the analytics queries rely on exist
+echo "🗂️  Ensuring MongoDB indexes..."
+python3 indexes.py --ensure || echo "⚠️  Index bootstrap failed, continuing"
+
 # Stop existing process if running
 echo "🛑 Stopping existing processes..."
 pkill -f "uvicorn main:app" || true
@@ -0,0 +1,72 @@
+"""
+Minimal HyperLogLog distinct counter.
+
+Sketches are fixed-size register arrays (2**PRECISION bytes), so they can be
+stored on rollup rows and merged register-wise (max) across any set of days:
+the merged sketch estimates the distinct count of the union. With
+PRECISION=12 the standard error is about 1.6%. Sketches with few set
+registers serialise sparsely (3 bytes per register) so a quiet day's row
+stays small.
+"""
+import math
+from hashlib import blake2b
+from typing import Any, Iterable
+
+PRECISION = 12
+REGISTERS = 1 << PRECISION
+_HASH_BITS = 64
+_MAX_RANK = _HASH_BITS - PRECISION + 1
+_MASK = (1 << _HASH_BITS) - 1
+
+
+def _hash(value: Any) -> int:
+    # Stable across processes (unlike hash()), so builder and readers agree
+    return int.from_bytes(blake2b(str(value).encode(), digest_size=8).digest(), "big")
+
+
+class HyperLogLog:
+    def __init__(self):
+        self.registers = bytearray(REGISTERS)
+
+    def add(self, value: Any) -> None:
+        h = _hash(value)
+        index = h >> (_HASH_BITS - PRECISION)
+        rest = (h << PRECISION) & _MASK
+        rank = min(_HASH_BITS - rest.bit_length() + 1, _MAX_RANK)
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, values: Iterable[Any]) -> "HyperLogLog":
+        for value in values:
+            self.add(value)
+        return self
+
+    def merge(self, data: bytes) -> "HyperLogLog":
+        """Fold in a sketch serialised with to_bytes()"""
+        if len(data) == REGISTERS:
+            self.registers = bytearray(map(max, self.registers, data))
+            return self
+        for offset in range(0, len(data), 3):
+            index = int.from_bytes(data[offset:offset + 2], "big")
+            if data[offset + 2] > self.registers[index]:
+                self.registers[index] = data[offset + 2]
+        return self
+
+    def count(self) -> int:
+        alpha = 0.7213 / (1 + 1.079 / REGISTERS)
+        estimate = alpha * REGISTERS * REGISTERS / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * REGISTERS and zeros:
+            # Small-range correction (linear counting)
+            estimate = REGISTERS * math.log(REGISTERS / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self) -> bytes:
+        """Dense registers, or (index, rank) triples when that is shorter"""
+        used = REGISTERS - self.registers.count(0)
+        if used * 3 >= REGISTERS:
+            return bytes(self.registers)
+        return b"".join(
+            index.to_bytes(2, "big") + bytes((rank,))
+            for index, rank in enumerate(self.registers) if rank
+        )
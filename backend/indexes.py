@@ -0,0 +1,255 @@
+"""
+Index bootstrap and index-coverage audit for the analytics query shapes.
+
+    python indexes.py --ensure             # create any missing declared index
+    python indexes.py --ensure --dry-run   # only list what would be created
+    python indexes.py --audit [--store-id <seller id>]
+
+--audit runs explain (executionStats) on the query shape behind each endpoint
+and reports collection scans and the docs-examined / returned ratio.
+"""
+import argparse
+import json
+import logging
+from datetime import timedelta
+from typing import Any, Dict, List, Optional
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+
+logger = logging.getLogger(__name__)
+
+
+# ============================================================================
+# DECLARED INDEXES
+# ============================================================================
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "orders": [
+        # Date-range KPIs / charts and the recent-orders keyset sort (createdAt, _id)
+        IndexModel([("seller", ASCENDING), ("createdAt", DESCENDING), ("_id", DESCENDING)], name="seller_createdAt_id"),
+        # Same with a status filter (equality before range)
+        IndexModel(
+            [("seller", ASCENDING), ("status", ASCENDING), ("createdAt", DESCENDING), ("_id", DESCENDING)],
+            name="seller_status_createdAt_id"
+        ),
+        # Category filter: items._id $in <category products>
+        IndexModel([("seller", ASCENDING), ("items._id", ASCENDING)], name="seller_items_id"),
+        # recent-orders search (order_search.py keys)
+        IndexModel([("seller", ASCENDING), ("searchKeys.orderNo", ASCENDING)], name="seller_search_orderNo"),
+        IndexModel([("seller", ASCENDING), ("searchKeys.phoneRev", ASCENDING)], name="seller_search_phoneRev"),
+        IndexModel([("seller", ASCENDING), ("searchKeys.nameTokens", ASCENDING)], name="seller_search_nameTokens"),
+        # Rollup builder watermark scan
+        IndexModel([("updatedAt", ASCENDING)], name="updatedAt"),
+    ],
+    "products": [
+        # quick-analysis low-stock lookup
+        IndexModel(
+            [("seller", ASCENDING), ("availabilityStatus", ASCENDING), ("stockQuantity", ASCENDING)],
+            name="seller_availabilityStatus_stockQuantity"
+        ),
+        # top-stock-alerts sort
+        IndexModel([("seller", ASCENDING), ("stockQuantity", DESCENDING), ("updatedAt", ASCENDING)], name="seller_stockQuantity_updatedAt"),
+        # Substitute candidates
+        IndexModel([("seller", ASCENDING), ("status", ASCENDING), ("category", ASCENDING)], name="seller_status_category"),
+        # Category -> product ids resolver
+        IndexModel([("category", ASCENDING)], name="category"),
+        # Substitute graph watermark scan
+        IndexModel([("updatedAt", ASCENDING)], name="updatedAt"),
+    ],
+    "ai_jobs": [
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+        IndexModel([("active_key", ASCENDING)], name="active_key", unique=True, sparse=True),
+    ],
+    "product_substitutes": [
+        IndexModel([("seller", ASCENDING)], name="seller"),
+    ],
+    "live_kpi_customers": [
+        # Top customer of a store, and the rebuild sweep
+        IndexModel([("seller", ASCENDING), ("spent", DESCENDING)], name="seller_spent"),
+    ],
+    "live_kpi_orders": [
+        IndexModel([("seller", ASCENDING)], name="seller"),
+    ],
+    "order_daily_rollups": [
+        IndexModel(
+            [("seller", ASCENDING), ("category", ASCENDING), ("day", ASCENDING), ("status", ASCENDING)],
+            name="seller_category_day_status",
+            unique=True
+        ),
+    ],
+}
+
+
+def _key_of(spec: Dict[str, Any]) -> tuple:
+    return tuple((field, int(direction) if isinstance(direction, (int, float)) else direction)
+                 for field, direction in spec.items())
+
+
+def ensure_indexes(db, dry_run: bool = False) -> Dict[str, List[str]]:
+    """Create declared indexes that don't exist yet (matched by key pattern, never dropped)"""
+    report = {"created": [], "present": [], "conflicts": []}
+    for collection, models in INDEXES.items():
+        existing = {
+            _key_of(index["key"]): index["name"]
+            for index in db[collection].list_indexes()
+        }
+        existing_names = set(existing.values())
+        missing = []
+        for model in models:
+            doc = model.document
+            label = f"{collection}.{doc['name']}"
+            if _key_of(doc["key"]) in existing:
+                report["present"].append(label)
+            elif doc["name"] in existing_names:
+                # Same name, different keys: leave it for a human to sort out
+                report["conflicts"].append(label)
+            else:
+                missing.append(model)
+                report["created"].append(label)
+        if missing and not dry_run:
+            db[collection].create_indexes(missing)
+    for label in report["created"]:
+        logger.info(f"{'Would create' if dry_run else 'Created'} index {label}")
+    for label in report["conflicts"]:
+        logger.warning(f"Index name clash, not created: {label}")
+    return report
+
+
+# ============================================================================
+# AUDIT
+# ============================================================================
+
+def _audit_shapes(db, store_id) -> List[Dict[str, Any]]:
+    """Representative filter/sort shape behind each endpoint, filled with real sample values"""
+    from order_search import build_search_filter
+
+    latest = db.orders.find_one({"seller": store_id}, {"createdAt": 1}, sort=[("createdAt", -1)])
+    date_to = latest["createdAt"] if latest else None
+    date_range = {"$gte": date_to - timedelta(days=30), "$lte": date_to} if date_to else {"$exists": True}
+    product = db.products.find_one({"seller": store_id, "category": {"$exists": True}}, {"category": 1})
+    category = product["category"] if product else None
+    category_ids = [p["_id"] for p in db.products.find({"category": category}, {"_id": 1}).limit(500)]
+
+    return [
+        {"endpoint": "kpis / total-sales / total-revenue (no filters)", "collection": "orders",
+         "pipeline": [{"$match": {"seller": store_id}}]},
+        {"endpoint": "kpis / charts (date range)", "collection": "orders",
+         "pipeline": [{"$match": {"seller": store_id, "createdAt": date_range}}]},
+        {"endpoint": "kpis / charts (status + date range)", "collection": "orders",
+         "pipeline": [{"$match": {"seller": store_id, "status": "COMPLETED", "createdAt": date_range}}]},
+        {"endpoint": "kpis / charts (category filter)", "collection": "orders",
+         "pipeline": [{"$match": {"seller": store_id, "items._id": {"$in": category_ids}}}]},
+        {"endpoint": "recent-orders (page 1)", "collection": "orders",
+         "pipeline": [{"$match": {"seller": store_id}}, {"$sort": {"createdAt": -1, "_id": -1}}, {"$limit": 11}]},
+        {"endpoint": "recent-orders (keyset page)", "collection": "orders",
+         "pipeline": [
+             {"$match": {"seller": store_id, "createdAt": {"$lt": date_to} if date_to else {"$exists": True}}},
+             {"$sort": {"createdAt": -1, "_id": -1}},
+             {"$limit": 11}
+         ]},
+        {"endpoint": "recent-orders (indexed search)", "collection": "orders",
+         "pipeline": [{"$match": build_search_filter(store_id, "9876")}, {"$limit": 11}]},
+        {"endpoint": "category resolver", "collection": "products",
+         "pipeline": [{"$match": {"category": category}}, {"$project": {"_id": 1}}]},
+        {"endpoint": "top-stock-alerts", "collection": "products",
+         "pipeline": [{"$match": {"seller": store_id}}, {"$sort": {"stockQuantity": -1, "updatedAt": 1}}, {"$limit": 5}]},
+        {"endpoint": "quick-analysis (low stock)", "collection": "products",
+         "pipeline": [{"$match": {"seller": store_id, "availabilityStatus": False}}, {"$sort": {"stockQuantity": 1}}, {"$limit": 5}]},
+        {"endpoint": "quick-analysis (substitute candidates)", "collection": "products",
+         "pipeline": [{"$match": {"seller": store_id, "status": "APPROVED", "category": category}}, {"$limit": 15}]},
+        {"endpoint": "rollup readers", "collection": "order_daily_rollups",
+         "pipeline": [{"$match": {"seller": store_id, "category": None, "day": {"$lte": date_to} if date_to else {"$exists": True}}}]},
+    ]
+
+
+def _walk(node: Any, key: str):
+    """Yield every value stored under `key` anywhere in an explain document"""
+    if isinstance(node, dict):
+        for k, v in node.items():
+            if k == key:
+                yield v
+            yield from _walk(v, key)
+    elif isinstance(node, list):
+        for item in node:
+            yield from _walk(item, key)
+
+
+def summarize_explain(explain: Dict[str, Any]) -> Dict[str, Any]:
+    stages = set(_walk(explain, "stage"))
+    index_names = sorted(set(_walk(explain, "indexName")))
+    stats = list(_walk(explain, "executionStats"))
+    docs_examined = sum(s.get("totalDocsExamined", 0) for s in stats)
+    keys_examined = sum(s.get("totalKeysExamined", 0) for s in stats)
+    returned = sum(s.get("nReturned", 0) for s in stats)
+    return {
+        "collscan": "COLLSCAN" in stages,
+        "indexes": index_names,
+        "docs_examined": docs_examined,
+        "keys_examined": keys_examined,
+        "returned": returned,
+        "examined_per_returned": round(docs_examined / returned, 2) if returned else None
+    }
+
+
+def audit_indexes(db, store_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    from bson import ObjectId
+
+    if store_id:
+        seller = ObjectId(store_id)
+    else:
+        busiest = list(db.orders.aggregate([
+            {"$group": {"_id": "$seller", "n": {"$sum": 1}}},
+            {"$sort": {"n": -1}},
+            {"$limit": 1}
+        ]))
+        if not busiest:
+            return []
+        seller = busiest[0]["_id"]
+
+    report = []
+    for shape in _audit_shapes(db, seller):
+        explain = db.command(
+            "explain",
+            {"aggregate": shape["collection"], "pipeline": shape["pipeline"], "cursor": {}},
+            verbosity="executionStats"
+        )
+        report.append({"endpoint": shape["endpoint"], "collection": shape["collection"], **summarize_explain(explain)})
+    return report
+
+
+def _print_audit(report: List[Dict[str, Any]]) -> None:
+    for row in report:
+        flag = "COLLSCAN" if row["collscan"] else "ok"
+        ratio = row["examined_per_returned"]
+        print(
+            f"[{flag:8}] {row['endpoint']:<48} {row['collection']:<20} "
+            f"indexes={','.join(row['indexes']) or '-'} docsExamined={row['docs_examined']} "
+            f"returned={row['returned']} ratio={ratio if ratio is not None else '-'}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ensure / audit MongoDB indexes for the analytics endpoints")
+    parser.add_argument("--ensure", action="store_true", help="Create missing declared indexes")
+    parser.add_argument("--dry-run", action="store_true", help="With --ensure, only report")
+    parser.add_argument("--audit", action="store_true", help="Explain every endpoint query shape")
+    parser.add_argument("--store-id", help="Seller to audit with (default: the one with most orders)")
+    parser.add_argument("--json", action="store_true", help="Print the audit as JSON")
+    args = parser.parse_args()
+
+    from database import db
+
+    if args.ensure or not args.audit:
+        print(json.dumps(ensure_indexes(db, dry_run=args.dry_run), indent=2))
+    if args.audit:
+        report = audit_indexes(db, args.store_id)
+        if args.json:
+            print(json.dumps(report, indent=2, default=str))
+        else:
+            _print_audit(report)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
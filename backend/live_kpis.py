@@ -0,0 +1,553 @@
+"""
+Live KPI counters per store, kept current from a change stream on orders.
+
+One consumer (whichever worker holds the lease in live_kpi_state) tails
+`orders` and maintains, per seller:
+
+    live_kpi_counters    orders, revenue, unique customers and the status mix
+    live_kpi_customers   orders / spent per (seller, customer id): unique customers and the top customer
+    live_kpi_orders      what each order was last counted as (seller, status, total, customer)
+
+A change is applied as the difference between the order's ledger entry and
+its current document, in one transaction with the resume token, so replaying
+an event after a restart changes nothing. Without a usable resume token the
+counters are rebuilt from orders. Every LIVE_KPIS_RECONCILE_SECONDS each
+store is compared with the full aggregation and rebuilt when it drifted.
+
+The unfiltered KPI cards then come from two point reads. Change streams and
+transactions need a replica set; a single node is enough
+(`mongod --replSet rs0`, then `rs.initiate()` once).
+
+    python live_kpis.py              # run the consumer in the foreground
+    python live_kpis.py --rebuild    # rebuild every store's counters
+    python live_kpis.py --reconcile  # compare with the full aggregation, repair drift
+"""
+import argparse
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import ReplaceOne, ReturnDocument
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+
+logger = logging.getLogger(__name__)
+
+COUNTERS_COLLECTION = "live_kpi_counters"
+CUSTOMERS_COLLECTION = "live_kpi_customers"
+LEDGER_COLLECTION = "live_kpi_orders"
+STATE_COLLECTION = "live_kpi_state"
+STATE_ID = "orders"
+
+LIVE_KPIS_ENABLED = os.getenv("LIVE_KPIS_ENABLED", "false").lower() in ("1", "true", "yes")
+LIVE_KPIS_LEASE_SECONDS = float(os.getenv("LIVE_KPIS_LEASE_SECONDS", "30"))
+LIVE_KPIS_RECONCILE_SECONDS = float(os.getenv("LIVE_KPIS_RECONCILE_SECONDS", "3600"))
+
+EVENT_BATCH_SIZE = 100
+WRITE_BATCH_SIZE = 1000
+STATE_CACHE_SECONDS = 5
+REVENUE_TOLERANCE = 0.01
+
+# Only these fields move a counter; name / phone changes are picked up on the next count
+COUNTED_FIELDS = ("seller", "status", "total", "customer")
+# InvalidResumeToken / ChangeStreamFatalError / ChangeStreamHistoryLost
+RESUME_FAILED_CODES = {260, 280, 286}
+WATCH_PIPELINE = [{"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete"]}}}]
+
+_state_cache: Dict[str, Any] = {"loaded_at": 0.0, "state": None}
+
+
+class LeaseLost(Exception):
+    pass
+
+
+def ensure_live_kpi_indexes(db) -> None:
+    from indexes import INDEXES
+    for collection in (CUSTOMERS_COLLECTION, LEDGER_COLLECTION):
+        db[collection].create_indexes(INDEXES[collection])
+
+
+def _status_key(status: Any) -> str:
+    # Used as a field name in the counters document
+    return str(status).replace(".", "_").lstrip("$") if status is not None else "UNKNOWN"
+
+
+def ledger_entry(order: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """What an order counts as; None when it belongs to no store"""
+    if order.get("seller") is None:
+        return None
+    customer = order.get("customer") or {}
+    return {
+        "seller": order["seller"],
+        "status": order.get("status"),
+        "total": order.get("total") or 0,
+        "customer": customer.get("id"),
+        "customer_name": customer.get("customerName"),
+        "phone": customer.get("phoneNumber")
+    }
+
+
+# ============================================================================
+# APPLYING CHANGES
+# ============================================================================
+
+def _count(db, entry: Dict[str, Any], sign: int, session, now: datetime) -> None:
+    total = entry["total"] * sign
+    status = _status_key(entry["status"])
+    inc = {"orders": sign, "revenue": total, f"status.{status}.orders": sign, f"status.{status}.revenue": total}
+
+    if entry["customer"] is not None:
+        key = {"seller": entry["seller"], "customer": entry["customer"]}
+        update: Dict[str, Any] = {
+            "$inc": {"orders": sign, "spent": total},
+            "$setOnInsert": {"seller": entry["seller"], "customer": entry["customer"]}
+        }
+        if sign > 0:
+            update["$set"] = {"customer_name": entry["customer_name"], "phone": entry["phone"]}
+        customer = db[CUSTOMERS_COLLECTION].find_one_and_update(
+            {"_id": key}, update, upsert=True, return_document=ReturnDocument.AFTER, session=session
+        )
+        if sign > 0 and customer["orders"] == 1:
+            inc["customers"] = 1
+        elif customer["orders"] <= 0:
+            db[CUSTOMERS_COLLECTION].delete_one({"_id": key}, session=session)
+            inc["customers"] = -1
+
+    db[COUNTERS_COLLECTION].update_one(
+        {"_id": entry["seller"]},
+        {"$inc": inc, "$set": {"updated_at": now}},
+        upsert=True,
+        session=session
+    )
+
+
+def apply_change(db, change: Dict[str, Any], session=None, now: Optional[datetime] = None) -> bool:
+    """Move the counters from the order's ledger entry to its current state; False when nothing changed"""
+    now = now or datetime.utcnow()
+    order_id = change["documentKey"]["_id"]
+    if change["operationType"] == "delete":
+        new = None
+    else:
+        document = change.get("fullDocument")
+        if document is None:
+            return False  # deleted before the lookup; its delete event follows
+        new = ledger_entry(document)
+
+    old = db[LEDGER_COLLECTION].find_one({"_id": order_id}, session=session)
+    if old is None and new is None:
+        return False
+    if old is not None and new is not None and all(old.get(f) == new[f] for f in COUNTED_FIELDS):
+        return False
+
+    if old is not None:
+        _count(db, old, -1, session, now)
+    if new is not None:
+        _count(db, new, 1, session, now)
+        db[LEDGER_COLLECTION].replace_one({"_id": order_id}, {"_id": order_id, **new}, upsert=True, session=session)
+    else:
+        db[LEDGER_COLLECTION].delete_one({"_id": order_id}, session=session)
+    return True
+
+
+def apply_batch(db, changes: List[Dict[str, Any]], resume_token: Any, owner: str) -> None:
+    """Apply changes and store the resume token atomically, as long as `owner` still holds the lease"""
+    now = datetime.utcnow()
+
+    def callback(session):
+        for change in changes:
+            apply_change(db, change, session, now)
+        saved = db[STATE_COLLECTION].update_one(
+            {"_id": STATE_ID, "owner": owner},
+            {"$set": {"resume_token": resume_token, "last_event_at": now}},
+            session=session
+        )
+        if saved.matched_count == 0:
+            raise LeaseLost(owner)
+
+    with db.client.start_session() as session:
+        session.with_transaction(callback)
+
+
+# ============================================================================
+# REBUILD / RECONCILE
+# ============================================================================
+
+def rebuild_store(db, seller: ObjectId) -> Dict[str, Any]:
+    """Recount one store from its orders (ledger, customers, counters)"""
+    build_id = uuid.uuid4().hex
+    now = datetime.utcnow()
+    counters: Dict[str, Any] = {"orders": 0, "revenue": 0, "status": {}}
+    customers: Dict[Any, Dict[str, Any]] = {}
+
+    ops = []
+    projection = {"seller": 1, "status": 1, "total": 1, "customer": 1}
+    for order in db.orders.find({"seller": seller}, projection):
+        entry = ledger_entry(order)
+        ops.append(ReplaceOne({"_id": order["_id"]}, {"_id": order["_id"], **entry, "build_id": build_id}, upsert=True))
+        if len(ops) >= WRITE_BATCH_SIZE:
+            db[LEDGER_COLLECTION].bulk_write(ops, ordered=False)
+            ops = []
+
+        counters["orders"] += 1
+        counters["revenue"] += entry["total"]
+        status = counters["status"].setdefault(_status_key(entry["status"]), {"orders": 0, "revenue": 0})
+        status["orders"] += 1
+        status["revenue"] += entry["total"]
+        if entry["customer"] is not None:
+            customer = customers.setdefault(entry["customer"], {"orders": 0, "spent": 0})
+            customer["orders"] += 1
+            customer["spent"] += entry["total"]
+            customer["customer_name"] = entry["customer_name"]
+            customer["phone"] = entry["phone"]
+    if ops:
+        db[LEDGER_COLLECTION].bulk_write(ops, ordered=False)
+
+    ops = []
+    for customer_id, customer in customers.items():
+        key = {"seller": seller, "customer": customer_id}
+        ops.append(ReplaceOne({"_id": key}, {"_id": key, **key, **customer, "build_id": build_id}, upsert=True))
+        if len(ops) >= WRITE_BATCH_SIZE:
+            db[CUSTOMERS_COLLECTION].bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        db[CUSTOMERS_COLLECTION].bulk_write(ops, ordered=False)
+
+    # Same upsert-then-sweep as the rollups: readers never see the store half empty
+    for collection in (LEDGER_COLLECTION, CUSTOMERS_COLLECTION):
+        db[collection].delete_many({"seller": seller, "build_id": {"$ne": build_id}})
+
+    counters["customers"] = len(customers)
+    db[COUNTERS_COLLECTION].replace_one(
+        {"_id": seller},
+        {"_id": seller, **counters, "updated_at": now, "rebuilt_at": now},
+        upsert=True
+    )
+    return counters
+
+
+def _known_sellers(db) -> List[ObjectId]:
+    sellers = set(db.orders.distinct("seller")) | set(db[COUNTERS_COLLECTION].distinct("_id"))
+    sellers.discard(None)
+    return sorted(sellers)
+
+
+def rebuild_all(db) -> Dict[str, Any]:
+    ensure_live_kpi_indexes(db)
+    sellers = _known_sellers(db)
+    for seller in sellers:
+        rebuild_store(db, seller)
+    return {"mode": "rebuild", "stores": len(sellers)}
+
+
+def aggregate_store(db, seller: ObjectId) -> Dict[str, Any]:
+    """The figures the counters should hold, from the full orders aggregation"""
+    pipeline = [
+        {"$match": {"seller": seller}},
+        {
+            "$facet": {
+                "status": [{"$group": {"_id": "$status", "orders": {"$sum": 1}, "revenue": {"$sum": "$total"}}}],
+                "customers": [
+                    {"$group": {"_id": "$customer.id"}},
+                    {"$match": {"_id": {"$ne": None}}},
+                    {"$count": "count"}
+                ]
+            }
+        }
+    ]
+    row = next(db.orders.aggregate(pipeline), {})
+    status = {
+        _status_key(s["_id"]): {"orders": s["orders"], "revenue": s["revenue"]}
+        for s in row.get("status") or []
+    }
+    customers = row.get("customers") or [{}]
+    return {
+        "orders": sum(s["orders"] for s in status.values()),
+        "revenue": sum(s["revenue"] for s in status.values()),
+        "customers": customers[0].get("count", 0),
+        "status": status
+    }
+
+
+def counter_drift(counters: Dict[str, Any], expected: Dict[str, Any]) -> List[str]:
+    """Human-readable differences between stored counters and the aggregation"""
+    drift = []
+    for field in ("orders", "customers"):
+        if counters.get(field, 0) != expected[field]:
+            drift.append(f"{field} {counters.get(field, 0)} != {expected[field]}")
+    if abs(counters.get("revenue", 0) - expected["revenue"]) > REVENUE_TOLERANCE:
+        drift.append(f"revenue {counters.get('revenue', 0)} != {expected['revenue']}")
+    stored = {k: v for k, v in (counters.get("status") or {}).items() if v.get("orders")}
+    if {k: v["orders"] for k, v in stored.items()} != {k: v["orders"] for k, v in expected["status"].items()}:
+        drift.append("status mix")
+    return drift
+
+
+def reconcile(db, drain: Optional[Callable[[], None]] = None) -> Dict[str, Any]:
+    """
+    Compare every store with the full aggregation and rebuild the ones that
+    drifted. `drain` applies pending events first, so orders written since the
+    last batch aren't mistaken for drift.
+    """
+    repaired = []
+    sellers = _known_sellers(db)
+    for seller in sellers:
+        expected = aggregate_store(db, seller)
+        drift = counter_drift(db[COUNTERS_COLLECTION].find_one({"_id": seller}) or {}, expected)
+        if drift and drain is not None:
+            drain()
+            expected = aggregate_store(db, seller)
+            drift = counter_drift(db[COUNTERS_COLLECTION].find_one({"_id": seller}) or {}, expected)
+        if drift:
+            logger.warning(f"Live KPI counters of {seller} drifted ({'; '.join(drift)}); rebuilding")
+            rebuild_store(db, seller)
+            repaired.append(str(seller))
+
+    db[STATE_COLLECTION].update_one(
+        {"_id": STATE_ID},
+        {"$set": {"last_reconciled_at": datetime.utcnow(), "last_repaired": repaired}},
+        upsert=True
+    )
+    return {"mode": "reconcile", "stores": len(sellers), "repaired": repaired}
+
+
+# ============================================================================
+# CONSUMER (sync, on a daemon thread of every worker; one holds the lease)
+# ============================================================================
+
+def acquire_lease(db, owner: str) -> Optional[Dict[str, Any]]:
+    """Take or renew the consumer lease; the state document, or None when another worker holds it"""
+    now = datetime.utcnow()
+    try:
+        return db[STATE_COLLECTION].find_one_and_update(
+            {"_id": STATE_ID, "$or": [{"owner": owner}, {"owner": None}, {"lease_until": {"$lt": now}}]},
+            {"$set": {"owner": owner, "lease_until": now + timedelta(seconds=LIVE_KPIS_LEASE_SECONDS)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        return None
+
+
+class LiveKpiConsumer:
+    def __init__(self, db, stop_event: threading.Event):
+        self.db = db
+        self.stop_event = stop_event
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    def run(self) -> None:
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    state = acquire_lease(self.db, self.owner)
+                    if state is None:
+                        self.stop_event.wait(LIVE_KPIS_LEASE_SECONDS / 2)
+                        continue
+                    self._consume(state)
+                except LeaseLost:
+                    logger.info("Live KPI lease lost; standing by")
+                except OperationFailure as e:
+                    if e.code in RESUME_FAILED_CODES:
+                        logger.warning(f"Live KPI resume token unusable, rebuilding: {str(e)}")
+                        self._reset_token()
+                        continue
+                    logger.warning(f"Live KPI consumer failed, retrying: {str(e)}")
+                    self.stop_event.wait(30)
+                except Exception as e:
+                    logger.warning(f"Live KPI consumer failed, retrying: {str(e)}")
+                    self.stop_event.wait(30)
+        finally:
+            self._release()
+
+    def _reset_token(self) -> None:
+        self.db[STATE_COLLECTION].update_one(
+            {"_id": STATE_ID, "owner": self.owner},
+            {"$set": {"ready": False}, "$unset": {"resume_token": ""}}
+        )
+
+    def _release(self) -> None:
+        # Let another worker take over at once instead of waiting out the lease
+        try:
+            self.db[STATE_COLLECTION].update_one(
+                {"_id": STATE_ID, "owner": self.owner},
+                {"$set": {"owner": None, "lease_until": datetime.utcnow()}}
+            )
+        except Exception:
+            pass
+
+    def _renew(self, resume_token: Any) -> None:
+        now = datetime.utcnow()
+        renewed = self.db[STATE_COLLECTION].update_one(
+            {"_id": STATE_ID, "owner": self.owner},
+            {"$set": {"lease_until": now + timedelta(seconds=LIVE_KPIS_LEASE_SECONDS), "resume_token": resume_token}}
+        )
+        if renewed.matched_count == 0:
+            raise LeaseLost(self.owner)
+
+    def _next_batch(self, stream) -> List[Dict[str, Any]]:
+        batch = []
+        while len(batch) < EVENT_BATCH_SIZE:
+            change = stream.try_next()
+            if change is None:
+                break
+            batch.append(change)
+        return batch
+
+    def _apply(self, batch: List[Dict[str, Any]]) -> None:
+        invalidated = any(c["operationType"] == "invalidate" for c in batch)
+        changes = [c for c in batch if c["operationType"] != "invalidate"]
+        if changes:
+            apply_batch(self.db, changes, changes[-1]["_id"], self.owner)
+        if invalidated:
+            # orders was dropped or renamed: nothing to resume from
+            raise OperationFailure("Change stream invalidated", code=260)
+
+    def _drain(self, stream) -> None:
+        while True:
+            batch = self._next_batch(stream)
+            if not batch:
+                return
+            self._apply(batch)
+
+    def _consume(self, state: Dict[str, Any]) -> None:
+        token = state.get("resume_token") if state.get("ready") else None
+        with self.db.orders.watch(
+            WATCH_PIPELINE,
+            full_document="updateLookup",
+            resume_after=token,
+            max_await_time_ms=1000
+        ) as stream:
+            if token is None:
+                # The stream is open before the rebuild starts, so writes made during it are replayed
+                # afterwards; replays are no-ops for orders the rebuild already counted
+                logger.info(f"Live KPI counters: {rebuild_all(self.db)}")
+                self.db[STATE_COLLECTION].update_one(
+                    {"_id": STATE_ID, "owner": self.owner},
+                    {"$set": {"ready": True, "last_reconciled_at": datetime.utcnow()}}
+                )
+                state["last_reconciled_at"] = datetime.utcnow()
+            logger.info("Consuming the orders change stream for live KPI counters")
+
+            renew_at = 0.0
+            last_reconciled = state.get("last_reconciled_at") or datetime.min
+            next_reconcile = time.monotonic() + max(
+                0.0, LIVE_KPIS_RECONCILE_SECONDS - (datetime.utcnow() - last_reconciled).total_seconds()
+            )
+            while not self.stop_event.is_set():
+                if time.monotonic() >= renew_at:
+                    self._renew(stream.resume_token)
+                    renew_at = time.monotonic() + LIVE_KPIS_LEASE_SECONDS / 3
+                batch = self._next_batch(stream)
+                if batch:
+                    self._apply(batch)
+                if time.monotonic() >= next_reconcile:
+                    logger.info(f"Live KPI reconciliation: {reconcile(self.db, lambda: self._drain(stream))}")
+                    next_reconcile = time.monotonic() + LIVE_KPIS_RECONCILE_SECONDS
+
+
+def run_live_kpis(db, stop_event: threading.Event) -> None:
+    LiveKpiConsumer(db, stop_event).run()
+
+
+# ============================================================================
+# READ SIDE (async, used by the API routes with the Motor database)
+# ============================================================================
+
+async def _cached_state(db) -> Optional[Dict[str, Any]]:
+    now = time.monotonic()
+    if now - _state_cache["loaded_at"] > STATE_CACHE_SECONDS:
+        _state_cache["state"] = await db[STATE_COLLECTION].find_one({"_id": STATE_ID}, {"resume_token": 0})
+        _state_cache["loaded_at"] = now
+    return _state_cache["state"]
+
+
+async def live_kpi_status(db) -> Dict[str, Any]:
+    state = await _cached_state(db) or {}
+    return {
+        "enabled": LIVE_KPIS_ENABLED,
+        "serving": _is_serving(state),
+        **{k: state.get(k) for k in ("owner", "lease_until", "ready", "last_event_at", "last_reconciled_at", "last_repaired")}
+    }
+
+
+def _is_serving(state: Optional[Dict[str, Any]]) -> bool:
+    # A consumer that stopped renewing its lease is gone; its counters are falling behind
+    return bool(
+        LIVE_KPIS_ENABLED and state and state.get("ready") and state.get("owner")
+        and state.get("lease_until") and state["lease_until"] > datetime.utcnow()
+    )
+
+
+def kpi_fields(counters: Dict[str, Any]) -> Dict[str, Any]:
+    """A live_kpi_counters document as the /kpis response fields it determines"""
+    orders = counters.get("orders", 0)
+    revenue = counters.get("revenue", 0)
+    return {
+        "sales_count": orders,
+        "total_orders": orders,
+        "total_customers": orders,
+        "total_revenue": revenue,
+        "avg_order_value": (revenue / orders) if orders else 0,
+        "unique_customers": counters.get("customers", 0),
+        "status_mix": {k: v["orders"] for k, v in (counters.get("status") or {}).items() if v.get("orders")}
+    }
+
+
+async def read_top_customer(db, seller: ObjectId) -> Optional[Dict[str, Any]]:
+    top = await db[CUSTOMERS_COLLECTION].find_one({"seller": seller}, sort=[("spent", -1)])
+    if top is None:
+        return None
+    return {
+        "customer_id": str(top["customer"]),
+        "customerName": top.get("customer_name"),
+        "phoneNumber": top.get("phone"),
+        "total_spent": top["spent"],
+        "orders_count": top["orders"]
+    }
+
+
+async def read_live_kpis(db, store_id: str) -> Optional[Dict[str, Any]]:
+    """KPI card fields of one store from its counters, or None when no consumer is keeping them current"""
+    if not _is_serving(await _cached_state(db)):
+        return None
+    seller = ObjectId(store_id)
+    counters = await db[COUNTERS_COLLECTION].find_one({"_id": seller}) or {}
+    return {
+        **kpi_fields(counters),
+        "top_customer": await read_top_customer(db, seller),
+        "as_of": counters.get("updated_at")
+    }
+
+
+# ============================================================================
+# CLI
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Live KPI counters from the orders change stream")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild every store's counters and exit (consumers stopped)")
+    parser.add_argument("--reconcile", action="store_true", help="Repair stores that drifted from the aggregation and exit")
+    args = parser.parse_args()
+
+    from database import db
+
+    if args.rebuild:
+        logger.info(f"Live KPI counters: {rebuild_all(db)}")
+    elif args.reconcile:
+        logger.info(f"Live KPI reconciliation: {reconcile(db)}")
+    else:
+        stop_event = threading.Event()
+        try:
+            run_live_kpis(db, stop_event)
+        except KeyboardInterrupt:
+            stop_event.set()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,223 @@
+"""
+Per-store push channel for open dashboards (server-sent events).
+
+A worker opens at most two change streams for all of its SSE clients, when
+the first one connects, and closes them after the last one leaves:
+
+    orders (insert)              -> `order` events, shaped like recent-orders rows
+    live_kpi_counters (updates)  -> `kpis` events with only the KPI fields that changed
+
+So N open dashboards cost N idle sockets, not N pollers. KPI pushes need the
+live counters (LIVE_KPIS_ENABLED, see live_kpis.py); without them only
+orders are pushed.
+
+KPI deltas are diffed per client, against the snapshot it was sent plus the
+deltas queued for it since, so a client that joined later never hides a
+change from one that was already connected.
+
+Backpressure: every client has a bounded outbox that fills up when the
+socket stops draining. KPI deltas merge into one pending delta, newest fields
+winning. At most SSE_MAX_PENDING_ORDERS orders wait per client. Past that the
+pending orders are dropped and the client gets a single `resync` event
+telling it to refetch. Connections are capped per worker
+(SSE_MAX_CONNECTIONS) and per store (SSE_MAX_CONNECTIONS_PER_STORE).
+"""
+import asyncio
+import json
+import logging
+import os
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+from live_kpis import COUNTERS_COLLECTION, kpi_fields, read_top_customer
+from response_cache import response_cache
+
+
+logger = logging.getLogger(__name__)
+
+SSE_MAX_CONNECTIONS = int(os.getenv("SSE_MAX_CONNECTIONS", "500"))
+SSE_MAX_CONNECTIONS_PER_STORE = int(os.getenv("SSE_MAX_CONNECTIONS_PER_STORE", "50"))
+SSE_MAX_PENDING_ORDERS = int(os.getenv("SSE_MAX_PENDING_ORDERS", "50"))
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+SSE_RETRY_SECONDS = 30
+
+
+_MISSING = object()
+
+
+class ConnectionLimitReached(Exception):
+    pass
+
+
+def sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+class Subscriber:
+    """One SSE client: a bounded outbox the connection drains at its own pace"""
+
+    def __init__(self, store_id: str):
+        self.store_id = store_id
+        self.kpis: Optional[Dict[str, Any]] = None
+        self.orders: Deque[Dict[str, Any]] = deque()
+        self.resync = False
+        self.dropped = 0
+        # KPI values this client has been sent or has queued; None until its snapshot
+        self._baseline: Optional[Dict[str, Any]] = None
+        self._early: Optional[Tuple[Dict[str, Any], Any]] = None
+        self._wakeup = asyncio.Event()
+
+    def start_kpis(self, snapshot: Dict[str, Any], as_of: Any) -> None:
+        """Baseline from the snapshot just sent; replays a newer update that arrived while it was read"""
+        self._baseline = dict(snapshot)
+        early, self._early = self._early, None
+        if early is not None and (as_of is None or (early[1] is not None and early[1] > as_of)):
+            self.push_kpis(*early)
+
+    def push_kpis(self, kpis: Dict[str, Any], as_of: Any = None) -> None:
+        """Queue the fields of `kpis` that differ from what this client already has"""
+        if self._baseline is None:
+            self._early = (kpis, as_of)
+            return
+        delta = {k: v for k, v in kpis.items() if self._baseline.get(k, _MISSING) != v}
+        if not delta:
+            return
+        self._baseline.update(delta)
+        if self.kpis is None:
+            self.kpis = delta
+        else:
+            self.kpis.update(delta)
+        self._wakeup.set()
+
+    def push_order(self, order: Dict[str, Any]) -> None:
+        if self.resync:
+            self.dropped += 1
+            return
+        if len(self.orders) >= SSE_MAX_PENDING_ORDERS:
+            # The client is too far behind to replay; it refetches instead
+            self.dropped += len(self.orders) + 1
+            self.orders.clear()
+            self.resync = True
+        else:
+            self.orders.append(order)
+        self._wakeup.set()
+
+    async def next_frames(self, timeout: float) -> str:
+        """Everything pending as SSE frames, or a keep-alive comment after `timeout`"""
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            return ": keep-alive\n\n"
+        self._wakeup.clear()
+
+        frames = []
+        if self.resync:
+            frames.append(sse_event("resync", {"reason": "too many pending orders"}))
+            self.resync = False
+        while self.orders:
+            frames.append(sse_event("order", self.orders.popleft()))
+        if self.kpis is not None:
+            frames.append(sse_event("kpis", self.kpis))
+            self.kpis = None
+        return "".join(frames)
+
+
+class LiveUpdates:
+    def __init__(self, order_projection: Dict[str, Any]):
+        self.order_projection = order_projection
+        self.subscribers: Dict[str, Set[Subscriber]] = defaultdict(set)
+        self._tasks: List[asyncio.Task] = []
+        self._db = None
+        self.dropped_orders = 0
+
+    @property
+    def connections(self) -> int:
+        return sum(len(s) for s in self.subscribers.values())
+
+    def check_capacity(self, store_id: str) -> None:
+        if self.connections >= SSE_MAX_CONNECTIONS:
+            raise ConnectionLimitReached(f"At most {SSE_MAX_CONNECTIONS} live connections per worker")
+        if len(self.subscribers.get(store_id, ())) >= SSE_MAX_CONNECTIONS_PER_STORE:
+            raise ConnectionLimitReached(f"At most {SSE_MAX_CONNECTIONS_PER_STORE} live connections per store")
+
+    def subscribe(self, db, store_id: str) -> Subscriber:
+        self.check_capacity(store_id)
+        subscriber = Subscriber(store_id)
+        self.subscribers[store_id].add(subscriber)
+        if not self._tasks:
+            self._db = db
+            self._tasks = [
+                asyncio.create_task(self._watch(self._watch_orders)),
+                asyncio.create_task(self._watch(self._watch_counters))
+            ]
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        self.dropped_orders += subscriber.dropped
+        store = self.subscribers.get(subscriber.store_id)
+        if store is not None:
+            store.discard(subscriber)
+            if not store:
+                del self.subscribers[subscriber.store_id]
+        if not self.subscribers:
+            self.close()
+
+    def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    async def _watch(self, consume) -> None:
+        while True:
+            try:
+                await consume()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Live updates change stream unavailable, retrying in {SSE_RETRY_SECONDS}s: {str(e)}")
+                await asyncio.sleep(SSE_RETRY_SECONDS)
+
+    async def _watch_orders(self) -> None:
+        pipeline = [{"$match": {"operationType": "insert"}}]
+        async with self._db.orders.watch(pipeline) as stream:
+            async for change in stream:
+                store_id = str(change["fullDocument"].get("seller"))
+                # This worker's cached pages predate the order; a client refetching here must see it
+                response_cache.invalidate_store(store_id)
+                if store_id not in self.subscribers:
+                    continue
+                # One read per new order per worker, however many dashboards show the store
+                rows = await self._db.orders.aggregate([
+                    {"$match": {"_id": change["documentKey"]["_id"]}},
+                    {"$project": {**self.order_projection, "_id": 0}}
+                ]).to_list(1)
+                for row in rows:
+                    for subscriber in list(self.subscribers.get(store_id, ())):
+                        subscriber.push_order(row)
+
+    async def _watch_counters(self) -> None:
+        pipeline = [{"$match": {"operationType": {"$in": ["insert", "update", "replace"]}}}]
+        async with self._db[COUNTERS_COLLECTION].watch(pipeline, full_document="updateLookup") as stream:
+            async for change in stream:
+                counters = change.get("fullDocument")
+                store_id = str(change["documentKey"]["_id"])
+                if counters is None or store_id not in self.subscribers:
+                    continue
+                kpis = kpi_fields(counters)
+                kpis["top_customer"] = await read_top_customer(self._db, change["documentKey"]["_id"])
+                # Each subscriber diffs against its own baseline
+                for subscriber in list(self.subscribers.get(store_id, ())):
+                    subscriber.push_kpis(kpis, counters.get("updated_at"))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "connections": self.connections,
+            "stores": {store_id: len(subs) for store_id, subs in self.subscribers.items()},
+            "watching": bool(self._tasks),
+            "dropped_orders": self.dropped_orders + sum(s.dropped for subs in self.subscribers.values() for s in subs),
+            "limits": {
+                "per_worker": SSE_MAX_CONNECTIONS,
+                "per_store": SSE_MAX_CONNECTIONS_PER_STORE,
+                "pending_orders": SSE_MAX_PENDING_ORDERS
+            }
+        }
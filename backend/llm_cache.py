@@ -0,0 +1,160 @@
+"""
+Persistent LLM response cache (SQLite on local disk).
+
+Keys are a SHA-256 of the model, the exact messages and the sampling
+parameters, so a product whose name/prices/stock didn't change maps to the
+same key, and editing a prompt template naturally misses. The database runs
+in WAL mode so every uvicorn worker on the host shares it. Entries expire
+after LLM_CACHE_TTL_SECONDS; past LLM_CACHE_MAX_ENTRIES the least recently
+used rows are evicted.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite3")
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", "86400"))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "20000"))
+
+# Touching last_access on every hit would turn reads into writes; once a minute is enough for LRU
+ACCESS_RESOLUTION_SECONDS = 60
+EVICT_EVERY_PUTS = 100
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_cache (
+    key TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    value TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS llm_cache_expires_at ON llm_cache (expires_at);
+CREATE INDEX IF NOT EXISTS llm_cache_last_access ON llm_cache (last_access);
+"""
+
+
+def cache_key(model: str, messages: Any, **params: Any) -> str:
+    payload = json.dumps({"model": model, "messages": messages, "params": params}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class LLMCache:
+    def __init__(self, path: str = LLM_CACHE_PATH, ttl_seconds: float = LLM_CACHE_TTL_SECONDS, max_entries: int = LLM_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._puts = 0
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections aren't shareable across threads; one per threadpool thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def _count(self, field: str) -> None:
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def get(self, key: str) -> Optional[Any]:
+        if not LLM_CACHE_ENABLED:
+            return None
+        now = time.time()
+        try:
+            conn = self._conn()
+            row = conn.execute(
+                "SELECT value, last_access FROM llm_cache WHERE key = ? AND expires_at > ?",
+                (key, now)
+            ).fetchone()
+            if row is None:
+                self._count("misses")
+                return None
+            if now - row[1] > ACCESS_RESOLUTION_SECONDS:
+                conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+            self._count("hits")
+            return json.loads(row[0])
+        except sqlite3.Error as e:
+            # A cache problem must never fail the request
+            logger.warning(f"LLM cache read failed: {str(e)}")
+            self._count("errors")
+            return None
+
+    def put(self, key: str, value: Any, kind: str = "") -> None:
+        if not LLM_CACHE_ENABLED:
+            return
+        now = time.time()
+        try:
+            conn = self._conn()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, kind, value, created_at, expires_at, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, kind, json.dumps(value, default=str), now, now + self.ttl_seconds, now)
+            )
+            with self._lock:
+                self._puts += 1
+                evict = self._puts % EVICT_EVERY_PUTS == 0
+            if evict:
+                self.evict()
+        except sqlite3.Error as e:
+            logger.warning(f"LLM cache write failed: {str(e)}")
+            self._count("errors")
+
+    def evict(self) -> int:
+        """Drop expired rows, then the least recently used ones beyond max_entries"""
+        conn = self._conn()
+        removed = conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (time.time(),)).rowcount
+        excess = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0] - self.max_entries
+        if excess > 0:
+            removed += conn.execute(
+                "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY last_access LIMIT ?)",
+                (excess,)
+            ).rowcount
+        return removed
+
+    def clear(self, kind: Optional[str] = None) -> int:
+        conn = self._conn()
+        if kind:
+            return conn.execute("DELETE FROM llm_cache WHERE kind = ?", (kind,)).rowcount
+        return conn.execute("DELETE FROM llm_cache").rowcount
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            rows = self._conn().execute("SELECT kind, COUNT(*) FROM llm_cache GROUP BY kind").fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"LLM cache stats failed: {str(e)}")
+            rows = []
+        lookups = self.hits + self.misses
+        return {
+            "enabled": LLM_CACHE_ENABLED,
+            "path": self.path,
+            "entries": sum(count for _, count in rows),
+            "entries_by_kind": dict(rows),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            # Counters are per worker; the entries are shared
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0
+        }
+
+
+llm_cache = LLMCache()
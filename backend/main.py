@@ -1,14 +1,88 @@
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
+import asyncio
 import uvicorn
 import os
+import threading
 from dotenv import load_dotenv
 
-from api import router
+from api import router, live_updates
+from database import db, close_clients, log_startup_diagnostics
+from category_cache import watch_product_changes
+from indexes import ensure_indexes
+from live_kpis import LIVE_KPIS_ENABLED, run_live_kpis
+from response_cache import RESPONSE_CACHE_ENABLED, RESPONSE_CACHE_WATCH_ORDERS, watch_order_changes
+from metrics import METRICS_ENABLED, MetricsMiddleware
 
 load_dotenv()
 
-app = FastAPI(title="Buy2Cash API")
+
+# Optional: invalidate the category -> product ids cache from a products change stream
+# (requires MongoDB running as a replica set; the cache TTL covers everything else)
+_product_watch_stop = threading.Event()
+# Per-worker response caches dropped on order writes from an orders change stream (replica set)
+_order_watch_stop = threading.Event()
+# Live KPI counters from the orders change stream (replica set); every worker stands by, one consumes
+_live_kpis_stop = threading.Event()
+
+
+def _flag(name: str) -> bool:
+    return os.getenv(name, "false").lower() in ("1", "true", "yes")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Nothing here may wait on MongoDB / Supabase / Azure: clients connect on first use and
+    # the startup work runs in the background, so a worker serves (and /ready reports) at once
+    background = [asyncio.create_task(log_startup_diagnostics())]
+
+    # Off by default: building a new index on a large collection is slow; prefer `python indexes.py --ensure`
+    if _flag("ENSURE_INDEXES_ON_STARTUP"):
+        background.append(asyncio.create_task(run_in_threadpool(ensure_indexes, db)))
+
+    if _flag("CATEGORY_CACHE_WATCH_PRODUCTS"):
+        threading.Thread(
+            target=watch_product_changes,
+            args=(db, _product_watch_stop),
+            name="category-cache-watch",
+            daemon=True
+        ).start()
+
+    if RESPONSE_CACHE_ENABLED and RESPONSE_CACHE_WATCH_ORDERS:
+        threading.Thread(
+            target=watch_order_changes,
+            args=(db, asyncio.get_running_loop(), _order_watch_stop),
+            name="response-cache-watch",
+            daemon=True
+        ).start()
+
+    live_kpis_thread = None
+    if LIVE_KPIS_ENABLED:
+        live_kpis_thread = threading.Thread(
+            target=run_live_kpis,
+            args=(db, _live_kpis_stop),
+            name="live-kpis",
+            daemon=True
+        )
+        live_kpis_thread.start()
+
+    yield
+
+    _product_watch_stop.set()
+    _order_watch_stop.set()
+    _live_kpis_stop.set()
+    live_updates.close()
+    if live_kpis_thread is not None:
+        # Gives the consumer time to hand its lease back before the clients close
+        await run_in_threadpool(live_kpis_thread.join, 5)
+    for task in background:
+        task.cancel()
+    close_clients()
+
+
+app = FastAPI(title="Buy2Cash API", lifespan=lifespan)
 
 # CORS configuration so the Next.js frontend can call this API from the browser
 
@@ -20,6 +94,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-route latency histograms for /metrics
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
 # Include all routes defined in api.py
 app.include_router(router)
 
@@ -0,0 +1,178 @@
+"""
+Prometheus metrics, scraped from GET /metrics.
+
+    http_request_duration_seconds{method, route, status}   per route template, body included (streams, SSE)
+    mongo_command_duration_seconds{collection, command, outcome}   from a pymongo CommandListener
+    llm_calls_total / llm_call_duration_seconds{endpoint, outcome}
+    supabase_call_duration_seconds{operation, outcome}
+
+Labels are bounded: routes are templates (/api/analytics/kpis/{store_id}),
+never raw paths. With several uvicorn/gunicorn workers set
+PROMETHEUS_MULTIPROC_DIR to an empty directory shared by them, so /metrics
+aggregates every worker instead of whichever one answers the scrape.
+"""
+import asyncio
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest
+from pymongo import monitoring
+
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route template",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS
+)
+MONGO_COMMAND_LATENCY = Histogram(
+    "mongo_command_duration_seconds",
+    "MongoDB command latency as reported by the driver",
+    ["collection", "command", "outcome"],
+    buckets=LATENCY_BUCKETS
+)
+LLM_CALLS = Counter(
+    "llm_calls_total",
+    "LLM calls (cache hits excluded)",
+    ["endpoint", "outcome"]
+)
+LLM_LATENCY = Histogram(
+    "llm_call_duration_seconds",
+    "LLM call latency",
+    ["endpoint", "outcome"],
+    buckets=LATENCY_BUCKETS
+)
+SUPABASE_LATENCY = Histogram(
+    "supabase_call_duration_seconds",
+    "Supabase (PostgREST) call latency",
+    ["operation", "outcome"],
+    buckets=LATENCY_BUCKETS
+)
+
+# Field holding the collection name of cursor commands
+_CURSOR_COMMANDS = {"getMore": "collection", "killCursors": "killCursors"}
+
+
+def _outcome(error: BaseException) -> str:
+    return "timeout" if isinstance(error, (asyncio.TimeoutError, TimeoutError)) else "error"
+
+
+@contextmanager
+def track_llm(endpoint: str):
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException as e:
+        outcome = _outcome(e)
+        raise
+    finally:
+        LLM_CALLS.labels(endpoint, outcome).inc()
+        LLM_LATENCY.labels(endpoint, outcome).observe(time.perf_counter() - started)
+
+
+@contextmanager
+def track_supabase(operation: str):
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException as e:
+        outcome = _outcome(e)
+        raise
+    finally:
+        SUPABASE_LATENCY.labels(operation, outcome).observe(time.perf_counter() - started)
+
+
+# ============================================================================
+# MONGO
+# ============================================================================
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Times every command the sync and Motor clients send (listeners run on the driver's threads)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started: Dict[Tuple[Any, int, int], str] = {}
+
+    def started(self, event):
+        command = event.command
+        if event.command_name in _CURSOR_COMMANDS:
+            collection = command.get(_CURSOR_COMMANDS[event.command_name], "")
+        else:
+            collection = command.get(event.command_name)
+        with self._lock:
+            self._started[(event.connection_id, event.request_id, event.operation_id)] = (
+                collection if isinstance(collection, str) else ""
+            )
+
+    def _finish(self, event, outcome: str):
+        with self._lock:
+            collection = self._started.pop((event.connection_id, event.request_id, event.operation_id), "")
+        MONGO_COMMAND_LATENCY.labels(collection, event.command_name, outcome).observe(event.duration_micros / 1e6)
+
+    def succeeded(self, event):
+        self._finish(event, "ok")
+
+    def failed(self, event):
+        self._finish(event, "error")
+
+
+mongo_command_listener = MongoCommandMetrics()
+
+
+def mongo_event_listeners():
+    """event_listeners option for MongoClient / AsyncIOMotorClient"""
+    return [mongo_command_listener] if METRICS_ENABLED else []
+
+
+# ============================================================================
+# HTTP
+# ============================================================================
+
+class MetricsMiddleware:
+    """ASGI middleware (not BaseHTTPMiddleware) so streamed bodies are timed to the last byte"""
+
+    def __init__(self, app, skip_paths=("/metrics",)):
+        self.app = app
+        self.skip_paths = set(skip_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # The router stores the matched route on the scope; unmatched paths share one label
+            route = scope.get("route")
+            REQUEST_LATENCY.labels(
+                scope["method"],
+                getattr(route, "path", "unmatched"),
+                str(status["code"])
+            ).observe(time.perf_counter() - started)
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
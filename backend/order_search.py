@@ -0,0 +1,197 @@
+"""
+Index-backed order search keys.
+
+Each order gets a `searchKeys` sub-document:
+    orderNo    - order number lower-cased with punctuation stripped (prefix search)
+    phoneRev   - phone digits reversed, so "ends with 4321" is an anchored prefix "^1234"
+    nameTokens - lower-cased customer name tokens (token / token-prefix search)
+
+All three are covered by {seller, searchKeys.*} indexes (see indexes.py), so a
+search is a handful of index range scans instead of an unanchored regex over
+every order of the store.
+
+    python order_search.py --backfill
+    python order_search.py               # orders updated since the watermark
+    python order_search.py --loop 60
+"""
+import argparse
+import logging
+import re
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+
+logger = logging.getLogger(__name__)
+
+STATE_COLLECTION = "order_search_state"
+STATE_ID = "searchKeys"
+BATCH_SIZE = 1000
+MIN_PHONE_DIGITS = 3
+STATE_CACHE_SECONDS = 30
+
+_NON_ALNUM = re.compile(r"[^0-9a-z]+")
+_NON_DIGIT = re.compile(r"\D+")
+
+_state_cache: Dict[str, Any] = {"loaded_at": 0.0, "state": None}
+
+
+# ============================================================================
+# NORMALISATION
+# ============================================================================
+
+def normalize_order_no(value: Any) -> str:
+    return _NON_ALNUM.sub("", str(value or "").casefold())
+
+
+def phone_suffix_key(value: Any) -> str:
+    return _NON_DIGIT.sub("", str(value or ""))[::-1]
+
+
+def name_tokens(value: Any) -> List[str]:
+    return [token for token in _NON_ALNUM.split(str(value or "").casefold()) if token]
+
+
+def search_keys(order: Dict[str, Any]) -> Dict[str, Any]:
+    customer = order.get("customer") or {}
+    return {
+        "orderNo": normalize_order_no(order.get("orderNo")),
+        "phoneRev": phone_suffix_key(customer.get("phoneNumber")),
+        "nameTokens": sorted(set(name_tokens(customer.get("customerName"))))
+    }
+
+
+# ============================================================================
+# QUERY
+# ============================================================================
+
+def build_search_filter(seller: ObjectId, search: str, unindexed_since: Optional[datetime] = None) -> Optional[Dict[str, Any]]:
+    """
+    $or of index-backed branches for a free-text search. Orders written at or
+    after `unindexed_since` (the key builder's updatedAt watermark) may have
+    missing or stale keys: new orders and edited names/phones alike. Those, and
+    orders without a date updatedAt, get a bounded regex branch instead, and the
+    key branches skip them.
+    """
+    branches = []
+
+    order_no = normalize_order_no(search)
+    if order_no:
+        branches.append({"seller": seller, "searchKeys.orderNo": {"$regex": f"^{re.escape(order_no)}"}})
+
+    digits = _NON_DIGIT.sub("", search)
+    if len(digits) >= MIN_PHONE_DIGITS:
+        branches.append({"seller": seller, "searchKeys.phoneRev": {"$regex": f"^{digits[::-1]}"}})
+
+    tokens = name_tokens(search)
+    if tokens:
+        # Whole words must match exactly; the last one may still be being typed
+        conditions = [{"searchKeys.nameTokens": token} for token in tokens[:-1]]
+        conditions.append({"searchKeys.nameTokens": {"$regex": f"^{re.escape(tokens[-1])}"}})
+        branches.append({"seller": seller, "$and": conditions})
+
+    if not branches:
+        return None
+
+    if unindexed_since is not None:
+        for branch in branches:
+            branch["updatedAt"] = {"$lt": unindexed_since}
+        pattern = {"$regex": re.escape(search.strip()), "$options": "i"}
+        branches.append({
+            "seller": seller,
+            "$and": [
+                # Orders without a date updatedAt are invisible to the key builder's watermark too
+                {"$or": [{"updatedAt": {"$gte": unindexed_since}}, {"updatedAt": {"$not": {"$type": "date"}}}]},
+                {"$or": [
+                    {"orderNo": pattern},
+                    {"customer.customerName": pattern},
+                    {"customer.phoneNumber": pattern}
+                ]}
+            ]
+        })
+
+    return {"$or": branches}
+
+
+async def get_search_watermark(db) -> Optional[datetime]:
+    """Watermark of the key builder (async, cached briefly); None when keys were never built"""
+    now = time.monotonic()
+    if now - _state_cache["loaded_at"] > STATE_CACHE_SECONDS:
+        _state_cache["state"] = await db[STATE_COLLECTION].find_one({"_id": STATE_ID})
+        _state_cache["loaded_at"] = now
+    state = _state_cache["state"]
+    return state.get("watermark") if state else None
+
+
+# ============================================================================
+# BUILDER
+# ============================================================================
+
+def _write_keys(db, query: Dict[str, Any]) -> int:
+    projection = {"orderNo": 1, "customer.customerName": 1, "customer.phoneNumber": 1, "searchKeys": 1}
+    ops, written = [], 0
+    for order in db.orders.find(query, projection).batch_size(BATCH_SIZE):
+        keys = search_keys(order)
+        if order.get("searchKeys") == keys:
+            continue
+        ops.append(UpdateOne({"_id": order["_id"]}, {"$set": {"searchKeys": keys}}))
+        if len(ops) >= BATCH_SIZE:
+            db.orders.bulk_write(ops, ordered=False)
+            written += len(ops)
+            ops = []
+    if ops:
+        db.orders.bulk_write(ops, ordered=False)
+        written += len(ops)
+    return written
+
+
+def _latest_order_update(db) -> Optional[datetime]:
+    latest = db.orders.find_one({"updatedAt": {"$type": "date"}}, {"updatedAt": 1}, sort=[("updatedAt", -1)])
+    return latest["updatedAt"] if latest else None
+
+
+def refresh_search_keys(db, full: bool = False) -> Dict[str, Any]:
+    """(Re)build searchKeys for every order, or only for those updated since the watermark"""
+    state = db[STATE_COLLECTION].find_one({"_id": STATE_ID})
+    previous = state.get("watermark") if state and not full else None
+    # Taken before the scan: anything updated meanwhile is picked up next run
+    watermark = _latest_order_update(db) or previous
+
+    if previous is None:
+        written = _write_keys(db, {})
+    else:
+        # Keys only change when the order changes (new orders carry a fresh updatedAt too)
+        # $gte: a write sharing the watermark's timestamp may have landed after the last scan
+        written = _write_keys(db, {"updatedAt": {"$gte": previous}})
+
+    db[STATE_COLLECTION].update_one(
+        {"_id": STATE_ID},
+        {"$set": {"watermark": watermark, "last_run_at": datetime.utcnow(), "last_mode": "backfill" if previous is None else "incremental"}},
+        upsert=True
+    )
+    return {"orders_updated": written, "watermark": watermark}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build/refresh order searchKeys")
+    parser.add_argument("--backfill", action="store_true", help="Recompute keys for every order")
+    parser.add_argument("--loop", type=int, default=0, help="Keep refreshing every N seconds")
+    args = parser.parse_args()
+
+    from database import db
+
+    full = args.backfill
+    while True:
+        logger.info(f"Search keys refresh: {refresh_search_keys(db, full=full)}")
+        full = False
+        if not args.loop:
+            break
+        time.sleep(args.loop)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,337 @@
+"""
+In-process response cache for the /api/analytics/* routes.
+
+Entries are keyed on the endpoint plus a canonical form of its parameters
+(None/blank dropped, dates normalised, keys sorted), so equivalent filters
+share one entry. Each entry is fresh for the endpoint TTL and then served
+stale for RESPONSE_CACHE_STALE_SECONDS while a single background refresh
+recomputes it. Concurrent misses for the same key share one computation.
+
+TTLs per endpoint can be overridden with RESPONSE_CACHE_TTLS, e.g.
+"kpis=30,recent-orders=10". Each uvicorn worker has its own cache, so with
+RESPONSE_CACHE_WATCH_ORDERS every worker tails the orders change stream and
+drops a store's entries as soon as one of its orders is written; otherwise
+they age out with the TTLs.
+"""
+import asyncio
+import functools
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, Sequence, Tuple, Union
+
+from pydantic.fields import FieldInfo
+
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from rollups import STORE_TIMEZONE, to_utc_naive
+
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "2048"))
+RESPONSE_CACHE_STALE_SECONDS = float(os.getenv("RESPONSE_CACHE_STALE_SECONDS", "300"))
+RESPONSE_CACHE_WATCH_ORDERS = os.getenv("RESPONSE_CACHE_WATCH_ORDERS", "false").lower() in ("1", "true", "yes")
+# Order events drained per invalidation, so a burst costs one sweep per store
+WATCH_BATCH_SIZE = 500
+
+DEFAULT_TTLS = {
+    "default": 60,
+    "store-name": 3600,
+    "recent-orders": 15,
+    "monthly-revenue": 300,
+    "avg-sales-per-month": 300,
+    "sales-by-time-period": 300,
+    "products-by-category": 300,
+    "total-products": 300,
+    "top-dish-searches": 300,
+    "multi-store-monthly-revenue": 300,
+    "revenue-timeseries": 300,
+    "sales-heatmap": 300,
+}
+
+DATE_PARAMS = {"date_from", "date_to"}
+# fresh=true recomputes (and re-caches) instead of reading the cache; not part of the key
+FRESH_PARAM = "fresh"
+
+
+def _parse_ttls(raw: str) -> Dict[str, float]:
+    ttls: Dict[str, float] = dict(DEFAULT_TTLS)
+    for part in filter(None, (p.strip() for p in raw.split(","))):
+        name, _, seconds = part.partition("=")
+        try:
+            ttls[name.strip()] = float(seconds)
+        except ValueError:
+            logger.warning(f"Ignoring bad RESPONSE_CACHE_TTLS entry: {part}")
+    return ttls
+
+
+RESPONSE_CACHE_TTLS = _parse_ttls(os.getenv("RESPONSE_CACHE_TTLS", ""))
+
+
+def _param(value: Any) -> Any:
+    if isinstance(value, FieldInfo):
+        # Handler called directly (not through FastAPI): use the declared default
+        value = value.default
+    if isinstance(value, str):
+        value = value.strip()
+    return value
+
+
+def canonical_params(params: Dict[str, Any], local_dates: bool = False) -> Dict[str, Any]:
+    """
+    Drop unset values and normalise dates so equivalent filters produce the same
+    key. With local_dates, naive dates are wall time in the request's `tz`
+    (default STORE_TIMEZONE), as the store-local endpoints read them.
+    """
+    zone = None
+    if local_dates:
+        try:
+            zone = ZoneInfo(_param(params.get("tz")) or STORE_TIMEZONE)
+        except (ZoneInfoNotFoundError, ValueError):
+            zone = False  # the handler answers 400; keep the dates as given
+    canonical = {}
+    for name, value in params.items():
+        value = _param(value)
+        if value is None or value == "" or name == FRESH_PARAM:
+            continue
+        if name in DATE_PARAMS and zone is not False:
+            try:
+                parsed = datetime.fromisoformat(value)
+                if zone is not None and parsed.tzinfo is None:
+                    parsed = parsed.replace(tzinfo=zone)
+                value = to_utc_naive(parsed).isoformat()
+            except ValueError:
+                pass
+        canonical[name] = value
+    return canonical
+
+
+def cache_key(endpoint: str, params: Dict[str, Any], local_dates: bool = False) -> str:
+    return json.dumps([endpoint, canonical_params(params, local_dates)], sort_keys=True, default=str)
+
+
+def _store_ids(store_id: Union[None, str, Sequence[str]]) -> Tuple[str, ...]:
+    """Stores an entry depends on: one for the per-store routes, several for the chain routes"""
+    if store_id is None:
+        return ()
+    if isinstance(store_id, str):
+        return (store_id,)
+    return tuple(store_id)
+
+
+class _Entry:
+    __slots__ = ("value", "endpoint", "store_ids", "fresh_until", "stale_until")
+
+    def __init__(self, value, endpoint, store_ids, fresh_until, stale_until):
+        self.value = value
+        self.endpoint = endpoint
+        self.store_ids = store_ids
+        self.fresh_until = fresh_until
+        self.stale_until = stale_until
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES, stale_seconds: float = RESPONSE_CACHE_STALE_SECONDS):
+        self.max_entries = max_entries
+        self.stale_seconds = stale_seconds
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        # Bumped on invalidation so a computation that started before it isn't stored
+        self._generations: Dict[Optional[str], int] = defaultdict(int)
+        self._counters: Dict[str, Dict[str, int]] = defaultdict(
+            lambda: {"hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0, "bypasses": 0, "errors": 0}
+        )
+        self.evictions = 0
+
+    async def get_or_compute(
+        self,
+        endpoint: str,
+        store_id: Union[None, str, Sequence[str]],
+        key: str,
+        ttl: float,
+        compute: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        counters = self._counters[endpoint]
+
+        if entry is not None and now < entry.fresh_until:
+            self._entries.move_to_end(key)
+            counters["hits"] += 1
+            return entry.value
+
+        if entry is not None and now < entry.stale_until:
+            self._entries.move_to_end(key)
+            counters["stale_hits"] += 1
+            if key not in self._inflight:
+                counters["refreshes"] += 1
+                task = self._start(endpoint, store_id, key, ttl, compute)
+                task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            return entry.value
+
+        counters["misses"] += 1
+        task = self._inflight.get(key) or self._start(endpoint, store_id, key, ttl, compute)
+        return await asyncio.shield(task)
+
+    async def recompute(
+        self,
+        endpoint: str,
+        store_id: Union[None, str, Sequence[str]],
+        key: str,
+        ttl: float,
+        compute: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        """Compute now, ignoring any cached value, and store the result for the next readers"""
+        self._counters[endpoint]["bypasses"] += 1
+        return await asyncio.shield(self._start(endpoint, store_id, key, ttl, compute))
+
+    def _generation(self, store_ids: Tuple[str, ...]) -> Tuple[int, ...]:
+        return (self._generations[None],) + tuple(self._generations[s] for s in store_ids)
+
+    def _start(self, endpoint, store_id, key, ttl, compute) -> asyncio.Future:
+        store_ids = _store_ids(store_id)
+        generation = self._generation(store_ids)
+
+        async def run():
+            try:
+                value = await compute()
+            except Exception:
+                self._counters[endpoint]["errors"] += 1
+                raise
+            if generation == self._generation(store_ids):
+                self._store(key, _Entry(value, endpoint, store_ids, time.monotonic() + ttl, time.monotonic() + ttl + self.stale_seconds))
+            return value
+
+        task = asyncio.ensure_future(run())
+        self._inflight[key] = task
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return task
+
+    def _store(self, key: str, entry: _Entry) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def generation(self, store_id: Union[None, str, Sequence[str]]) -> Tuple[int, ...]:
+        """Changes whenever the store (or the whole cache) is invalidated; for side caches to key on"""
+        return self._generation(_store_ids(store_id))
+
+    def invalidate_stores(self, store_ids: Sequence[Optional[str]]) -> int:
+        """invalidate_store for several stores; None in the list flushes everything"""
+        if None in store_ids:
+            return self.invalidate_store(None)
+        return sum(self.invalidate_store(store_id) for store_id in store_ids)
+
+    def invalidate_store(self, store_id: Optional[str] = None) -> int:
+        """Drop every entry of one store (or all entries); call when new orders land"""
+        self._generations[store_id] += 1
+        keys = [k for k, e in self._entries.items() if store_id is None or store_id in e.store_ids]
+        for k in keys:
+            del self._entries[k]
+        return len(keys)
+
+    def stats(self) -> Dict[str, Any]:
+        entries_by_endpoint: Dict[str, int] = defaultdict(int)
+        for entry in self._entries.values():
+            entries_by_endpoint[entry.endpoint] += 1
+        endpoints = {}
+        for name, c in self._counters.items():
+            lookups = c["hits"] + c["stale_hits"] + c["misses"]
+            endpoints[name] = {
+                **c,
+                "entries": entries_by_endpoint.get(name, 0),
+                "ttl_seconds": RESPONSE_CACHE_TTLS.get(name, RESPONSE_CACHE_TTLS["default"]),
+                "hit_ratio": round((c["hits"] + c["stale_hits"]) / lookups, 4) if lookups else 0
+            }
+        total = {k: sum(c[k] for c in self._counters.values()) for k in ("hits", "stale_hits", "misses")}
+        lookups = sum(total.values())
+        return {
+            "enabled": RESPONSE_CACHE_ENABLED,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "stale_seconds": self.stale_seconds,
+            "evictions": self.evictions,
+            "inflight": len(self._inflight),
+            "hit_ratio": round((total["hits"] + total["stale_hits"]) / lookups, 4) if lookups else 0,
+            "endpoints": endpoints
+        }
+
+
+response_cache = ResponseCache()
+
+
+def cached_response(endpoint: str, local_dates: bool = False):
+    """
+    Cache an async route handler's result per canonical (endpoint, params).
+    local_dates: the handler reads naive date_from/date_to in its `tz` zone.
+    """
+    ttl = RESPONSE_CACHE_TTLS.get(endpoint, RESPONSE_CACHE_TTLS["default"])
+
+    def decorator(fn):
+        signature = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            if not RESPONSE_CACHE_ENABLED:
+                return await fn(*args, **kwargs)
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            params = dict(bound.arguments)
+            key = cache_key(endpoint, params, local_dates)
+            store_id = params.get("store_id")
+            if store_id is None and isinstance(params.get("store_ids"), str):
+                store_id = [s.strip() for s in params["store_ids"].split(",") if s.strip()]
+            if _param(params.get(FRESH_PARAM)) is True:
+                return await response_cache.recompute(endpoint, store_id, key, ttl, lambda: fn(*args, **kwargs))
+            return await response_cache.get_or_compute(
+                endpoint, store_id, key, ttl, lambda: fn(*args, **kwargs)
+            )
+
+        return wrapper
+
+    return decorator
+
+
+def watch_order_changes(db, loop: asyncio.AbstractEventLoop, stop_event: threading.Event) -> None:
+    """
+    Drop a store's cached responses whenever one of its orders is written (needs
+    a replica set). Runs in a thread of every worker; the cache itself is only
+    touched on the worker's event loop.
+    """
+    pipeline = [
+        {"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete"]}}},
+        {"$project": {"operationType": 1, "fullDocument.seller": 1, "fullDocumentBeforeChange.seller": 1}}
+    ]
+    while not stop_event.is_set():
+        try:
+            with db.orders.watch(
+                pipeline,
+                full_document="updateLookup",
+                full_document_before_change="whenAvailable",
+                max_await_time_ms=1000
+            ) as stream:
+                logger.info("Watching orders for response cache invalidation")
+                while not stop_event.is_set():
+                    stores = set()
+                    change = stream.try_next()
+                    while change is not None:
+                        document = change.get("fullDocument") or change.get("fullDocumentBeforeChange") or {}
+                        # A delete without a pre-image can't name its store
+                        stores.add(str(document["seller"]) if document.get("seller") else None)
+                        if len(stores) >= WATCH_BATCH_SIZE:
+                            break
+                        change = stream.try_next()
+                    if stores:
+                        loop.call_soon_threadsafe(response_cache.invalidate_stores, list(stores))
+        except Exception as e:
+            logger.warning(f"Orders change stream unavailable, relying on response cache TTLs: {str(e)}")
+            stop_event.wait(30)
@@ -0,0 +1,682 @@
+"""
+Daily order rollups per store.
+
+order_daily_rollups holds one document per (seller, day, status, category) with the
+order count, revenue and a HyperLogLog sketch of the customer ids of that
+slice (customers_hll, see hyperloglog.py). category=None is the store-wide row; a
+category row counts every order that has at least one item from that category,
+which is the same semantics as the items._id $in filter used by the endpoints.
+
+Each row also carries `heat`: order count, revenue and amountReceived per
+store-local hour of the week (slot = weekday * 24 + hour, Monday = 0) of its
+orders, in STORE_TIMEZONE as of the build (`heat_tz`). A UTC day touches at
+most two local weekdays, so a row holds about 25 slots. Changing
+STORE_TIMEZONE needs a --backfill; until then readers fall back to raw orders.
+
+Build once with --backfill, then run incrementally (cron or --loop): every order
+whose updatedAt is at or past the stored watermark marks its (seller, day) dirty
+and those days are recomputed from raw orders (rebuilds are idempotent, so
+rescanning the watermark itself is harmless and catches writes that share it).
+A product whose category changed since the last build, compared against the
+snapshot in rollup_product_categories, marks every day with an order of it
+dirty too.
+
+Deleted orders (and products) leave no updatedAt behind. --reconcile compares
+each (seller, day) store-wide row with the raw orders, rebuilds the days that
+disagree, and diffs the whole category snapshot; --loop runs it every
+ROLLUP_RECONCILE_SECONDS.
+
+    python rollups.py --backfill
+    python rollups.py
+    python rollups.py --reconcile
+    python rollups.py --loop 300
+"""
+import argparse
+import logging
+import os
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+from zoneinfo import ZoneInfo
+
+from bson import ObjectId
+from pymongo import ReplaceOne
+
+from hyperloglog import HyperLogLog
+
+
+logger = logging.getLogger(__name__)
+
+ROLLUPS_COLLECTION = "order_daily_rollups"
+STATE_COLLECTION = "rollup_state"
+CATEGORIES_COLLECTION = "rollup_product_categories"
+STATE_ID = ROLLUPS_COLLECTION
+
+ONE_DAY = timedelta(days=1)
+DAYS_PER_QUERY = 31
+WRITE_BATCH_SIZE = 1000
+STATE_CACHE_SECONDS = 30
+
+# Store-local calendar for the heat slots and the revenue time series
+STORE_TIMEZONE = os.getenv("STORE_TIMEZONE", "UTC")
+ROLLUP_RECONCILE_SECONDS = float(os.getenv("ROLLUP_RECONCILE_SECONDS", "86400"))
+
+_state_cache: Dict[str, Any] = {"loaded_at": 0.0, "state": None}
+
+
+# ============================================================================
+# DATE HELPERS
+# ============================================================================
+
+def to_utc_naive(value: datetime) -> datetime:
+    """Mongo hands back naive UTC datetimes; normalise user input the same way"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def floor_day(value: datetime) -> datetime:
+    return datetime(value.year, value.month, value.day)
+
+
+def ceil_day(value: datetime) -> datetime:
+    day = floor_day(value)
+    return day if day == value else day + ONE_DAY
+
+
+def hour_of_week(value: datetime, zone: ZoneInfo) -> int:
+    """Heat slot of a naive UTC datetime: local weekday * 24 + local hour"""
+    local = value.replace(tzinfo=timezone.utc).astimezone(zone)
+    return local.weekday() * 24 + local.hour
+
+
+def hour_of_week_expr(field: str, tz: str) -> Dict[str, Any]:
+    """hour_of_week as an aggregation expression"""
+    return {
+        "$add": [
+            {"$multiply": [{"$subtract": [{"$isoDayOfWeek": {"date": field, "timezone": tz}}, 1]}, 24]},
+            {"$hour": {"date": field, "timezone": tz}}
+        ]
+    }
+
+
+# ============================================================================
+# BUILDER
+# ============================================================================
+
+def ensure_rollup_indexes(db) -> None:
+    # $merge-free upserts still need the unique key to stay one row per slice
+    from indexes import INDEXES
+    db[ROLLUPS_COLLECTION].create_indexes(INDEXES[ROLLUPS_COLLECTION])
+
+
+def product_category_map(db, seller: ObjectId) -> Dict[ObjectId, ObjectId]:
+    return {
+        p["_id"]: p["category"]
+        for p in db.products.find({"seller": seller}, {"category": 1})
+        if p.get("category")
+    }
+
+
+# UTC day of an order, as stored in the rollup rows
+_DAY_EXPR = {
+    "$dateFromParts": {
+        "year": {"$year": "$createdAt"},
+        "month": {"$month": "$createdAt"},
+        "day": {"$dayOfMonth": "$createdAt"}
+    }
+}
+
+
+def _day_ranges(days: List[datetime]) -> List[Dict[str, Any]]:
+    return [{"createdAt": {"$gte": day, "$lt": day + ONE_DAY}} for day in days]
+
+
+def _rollup_orders(orders: Iterable[Dict[str, Any]], categories: Dict[ObjectId, ObjectId], zone: ZoneInfo) -> Dict[Tuple, List]:
+    buckets: Dict[Tuple, List] = defaultdict(lambda: [0, 0, set(), defaultdict(lambda: [0, 0, 0])])
+    for order in orders:
+        day = floor_day(order["createdAt"])
+        slot = hour_of_week(order["createdAt"], zone)
+        status = order.get("status")
+        total = order.get("total") or 0
+        received = order.get("amountReceived") or 0
+        customer_id = (order.get("customer") or {}).get("id")
+        order_categories = {
+            categories.get(item.get("_id"))
+            for item in order.get("items") or []
+        }
+        order_categories.discard(None)
+        for category in [None, *order_categories]:
+            bucket = buckets[(day, status, category)]
+            bucket[0] += 1
+            bucket[1] += total
+            if customer_id is not None:
+                bucket[2].add(customer_id)
+            heat = bucket[3][slot]
+            heat[0] += 1
+            heat[1] += total
+            heat[2] += received
+    return buckets
+
+
+def rebuild_seller_days(db, seller: ObjectId, days: Optional[List[datetime]] = None) -> int:
+    """Recompute rollups for some (or all, when days is None) days of one seller"""
+    categories = product_category_map(db, seller)
+    zone = ZoneInfo(STORE_TIMEZONE)
+    build_id = uuid.uuid4().hex
+    projection = {"createdAt": 1, "status": 1, "total": 1, "amountReceived": 1, "items._id": 1, "customer.id": 1}
+    written = 0
+
+    if days is None:
+        batches = [None]
+    else:
+        days = sorted(set(days))
+        batches = [days[i:i + DAYS_PER_QUERY] for i in range(0, len(days), DAYS_PER_QUERY)]
+
+    for batch in batches:
+        query: Dict[str, Any] = {"seller": seller, "createdAt": {"$type": "date"}}
+        if batch is not None:
+            query["$or"] = _day_ranges(batch)
+
+        buckets = _rollup_orders(db.orders.find(query, projection), categories, zone)
+        ops = []
+        for (day, status, category), (orders, revenue, customers, heat) in buckets.items():
+            # Sketches are built at write time and flushed in chunks to keep memory flat
+            ops.append(ReplaceOne(
+                {"seller": seller, "category": category, "day": day, "status": status},
+                {
+                    "seller": seller,
+                    "category": category,
+                    "day": day,
+                    "status": status,
+                    "orders": orders,
+                    "revenue": revenue,
+                    "customers_hll": HyperLogLog().update(customers).to_bytes(),
+                    "heat": [
+                        {"slot": slot, "orders": o, "revenue": r, "received": a}
+                        for slot, (o, r, a) in sorted(heat.items())
+                    ],
+                    "heat_tz": STORE_TIMEZONE,
+                    "build_id": build_id
+                },
+                upsert=True
+            ))
+            if len(ops) >= WRITE_BATCH_SIZE:
+                db[ROLLUPS_COLLECTION].bulk_write(ops, ordered=False)
+                written += len(ops)
+                ops = []
+        if ops:
+            db[ROLLUPS_COLLECTION].bulk_write(ops, ordered=False)
+            written += len(ops)
+
+        # Upsert first, then sweep rows that no longer exist (e.g. a status that moved),
+        # so readers never see a day with its rows missing
+        stale = {"seller": seller, "build_id": {"$ne": build_id}}
+        if batch is not None:
+            stale["day"] = {"$in": batch}
+        db[ROLLUPS_COLLECTION].delete_many(stale)
+
+    return written
+
+
+def _latest_order_update(db) -> Optional[datetime]:
+    latest = db.orders.find_one(
+        {"updatedAt": {"$type": "date"}},
+        {"updatedAt": 1},
+        sort=[("updatedAt", -1)]
+    )
+    return latest["updatedAt"] if latest else None
+
+
+def _latest_product_update(db) -> Optional[datetime]:
+    latest = db.products.find_one({"updatedAt": {"$type": "date"}}, {"updatedAt": 1}, sort=[("updatedAt", -1)])
+    return latest["updatedAt"] if latest else None
+
+
+def get_rollup_state(db) -> Optional[Dict[str, Any]]:
+    return db[STATE_COLLECTION].find_one({"_id": STATE_ID})
+
+
+def _save_state(db, mode: str, **fields) -> None:
+    db[STATE_COLLECTION].update_one(
+        {"_id": STATE_ID},
+        {"$set": {**fields, "last_run_at": datetime.utcnow(), "last_mode": mode}},
+        upsert=True
+    )
+    _state_cache["loaded_at"] = 0.0
+
+
+def _category_changes(db, query: Dict[str, Any], full: bool = False) -> Dict[ObjectId, Optional[ObjectId]]:
+    """
+    Products matching `query` whose category differs from the snapshot the
+    rollups were built with, as {product id: current category}. With full,
+    snapshot entries of deleted products count as moved to no category.
+    """
+    current = {p["_id"]: p.get("category") for p in db.products.find(query, {"category": 1})}
+    snapshot_query = {} if full else {"_id": {"$in": list(current)}}
+    snapshot = {row["_id"]: row.get("category") for row in db[CATEGORIES_COLLECTION].find(snapshot_query)}
+    changed = {pid: category for pid, category in current.items() if snapshot.get(pid) != category}
+    if full:
+        changed.update({pid: None for pid, category in snapshot.items() if pid not in current and category})
+    return changed
+
+
+def _days_with_products(db, product_ids: List[ObjectId]) -> Dict[ObjectId, set]:
+    days: Dict[ObjectId, set] = defaultdict(set)
+    for i in range(0, len(product_ids), WRITE_BATCH_SIZE):
+        pipeline = [
+            {"$match": {"items._id": {"$in": product_ids[i:i + WRITE_BATCH_SIZE]}, "createdAt": {"$type": "date"}}},
+            {"$group": {"_id": "$seller", "days": {"$addToSet": _DAY_EXPR}}}
+        ]
+        for row in db.orders.aggregate(pipeline):
+            days[row["_id"]].update(row["days"])
+    return days
+
+
+def _save_category_snapshot(db, changed: Dict[ObjectId, Optional[ObjectId]]) -> None:
+    """Record the categories the rollups now reflect (call after the rebuild)"""
+    ops = [
+        ReplaceOne({"_id": pid}, {"_id": pid, "category": category}, upsert=True)
+        for pid, category in changed.items()
+    ]
+    for i in range(0, len(ops), WRITE_BATCH_SIZE):
+        db[CATEGORIES_COLLECTION].bulk_write(ops[i:i + WRITE_BATCH_SIZE], ordered=False)
+
+
+def _rebuild_dirty(db, dirty: Dict[ObjectId, set]) -> int:
+    return sum(rebuild_seller_days(db, seller, list(days)) for seller, days in dirty.items() if days)
+
+
+def backfill_rollups(db) -> Dict[str, Any]:
+    """Full rebuild. The watermarks are taken before the scan so concurrent writes are picked up next run"""
+    ensure_rollup_indexes(db)
+    watermark = _latest_order_update(db)
+    product_watermark = _latest_product_update(db)
+    categories = {p["_id"]: p.get("category") for p in db.products.find({}, {"category": 1})}
+    sellers = db.orders.distinct("seller")
+    written = 0
+    for seller in sellers:
+        written += rebuild_seller_days(db, seller)
+    db[CATEGORIES_COLLECTION].delete_many({})
+    _save_category_snapshot(db, categories)
+    _save_state(db, "backfill", watermark=watermark, product_watermark=product_watermark)
+    return {"mode": "backfill", "sellers": len(sellers), "rows_written": written, "watermark": watermark}
+
+
+def refresh_rollups(db) -> Dict[str, Any]:
+    """
+    Incremental pass over orders updated since the watermark and products whose
+    category moved; backfills when there is no state yet
+    """
+    state = get_rollup_state(db)
+    if not state or not state.get("watermark"):
+        return backfill_rollups(db)
+
+    # $gte: a write sharing the watermark's timestamp may have landed after the last scan
+    pipeline = [
+        {"$match": {"updatedAt": {"$gte": state["watermark"]}, "createdAt": {"$type": "date"}}},
+        {"$group": {"_id": "$seller", "days": {"$addToSet": _DAY_EXPR}, "maxUpdatedAt": {"$max": "$updatedAt"}}}
+    ]
+    dirty: Dict[ObjectId, set] = defaultdict(set)
+    watermark = state["watermark"]
+    for row in db.orders.aggregate(pipeline):
+        dirty[row["_id"]].update(row["days"])
+        watermark = max(watermark, row["maxUpdatedAt"])
+
+    product_watermark = _latest_product_update(db) or state.get("product_watermark")
+    previous = state.get("product_watermark")
+    moved = _category_changes(db, {"updatedAt": {"$gte": previous}} if previous else {})
+    for seller, days in _days_with_products(db, list(moved)).items():
+        dirty[seller].update(days)
+
+    written = _rebuild_dirty(db, dirty)
+    _save_category_snapshot(db, moved)
+    _save_state(db, "incremental", watermark=watermark, product_watermark=product_watermark)
+    return {
+        "mode": "incremental",
+        "sellers": len(dirty),
+        "days": sum(len(days) for days in dirty.values()),
+        "recategorized_products": len(moved),
+        "rows_written": written,
+        "watermark": watermark
+    }
+
+
+def reconcile_rollups(db) -> Dict[str, Any]:
+    """
+    Catch what leaves no updatedAt behind: rebuild every (seller, day) whose
+    store-wide rows disagree with the raw orders (deleted orders, or days whose
+    orders are all gone), and every day touched by a product whose category or
+    existence differs from the snapshot. Scans all orders, so run it rarely.
+    """
+    state = get_rollup_state(db)
+    if not state or not state.get("watermark"):
+        return backfill_rollups(db)
+    # Days past the watermark's day are answered from raw orders anyway
+    horizon = floor_day(state["watermark"])
+
+    def day_totals(collection, pipeline) -> Dict[Tuple, Tuple]:
+        return {
+            (row["_id"]["seller"], row["_id"]["day"]): (row["orders"], round(row["revenue"] or 0, 2))
+            for row in db[collection].aggregate(pipeline)
+        }
+
+    raw = day_totals("orders", [
+        {"$match": {"createdAt": {"$type": "date", "$lt": horizon}}},
+        {"$group": {"_id": {"seller": "$seller", "day": _DAY_EXPR}, "orders": {"$sum": 1}, "revenue": {"$sum": "$total"}}}
+    ])
+    rolled = day_totals(ROLLUPS_COLLECTION, [
+        {"$match": {"category": None, "day": {"$lt": horizon}}},
+        {"$group": {"_id": {"seller": "$seller", "day": "$day"}, "orders": {"$sum": "$orders"}, "revenue": {"$sum": "$revenue"}}}
+    ])
+
+    dirty: Dict[ObjectId, set] = defaultdict(set)
+    for key in raw.keys() | rolled.keys():
+        if raw.get(key) != rolled.get(key):
+            dirty[key[0]].add(key[1])
+    mismatched_days = sum(len(days) for days in dirty.values())
+
+    moved = _category_changes(db, {}, full=True)
+    for seller, days in _days_with_products(db, list(moved)).items():
+        dirty[seller].update(days)
+
+    written = _rebuild_dirty(db, dirty)
+    _save_category_snapshot(db, {pid: c for pid, c in moved.items() if c is not None})
+    gone = [pid for pid, c in moved.items() if c is None]
+    if gone:
+        db[CATEGORIES_COLLECTION].delete_many({"_id": {"$in": gone}})
+    _save_state(db, "reconcile", last_reconciled_at=datetime.utcnow())
+    return {
+        "mode": "reconcile",
+        "mismatched_days": mismatched_days,
+        "recategorized_products": len(moved),
+        "days": sum(len(days) for days in dirty.values()),
+        "rows_written": written
+    }
+
+
+# ============================================================================
+# READ SIDE (async, used by the API routes with the Motor database)
+# ============================================================================
+
+async def _cached_state(db) -> Optional[Dict[str, Any]]:
+    now = time.monotonic()
+    if now - _state_cache["loaded_at"] > STATE_CACHE_SECONDS:
+        _state_cache["state"] = await db[STATE_COLLECTION].find_one({"_id": STATE_ID})
+        _state_cache["loaded_at"] = now
+    return _state_cache["state"]
+
+
+async def plan_rollup_query(
+    db,
+    match_stage: Dict[str, Any],
+    store_id: Union[str, List[str]],
+    date_from: Optional[str],
+    date_to: Optional[str],
+    status: Optional[str],
+    category_id: Optional[str]
+) -> Optional[Dict[str, Any]]:
+    """
+    Split a filtered request into whole days answered from rollups and the
+    remaining edges (partial first/last day, anything past the watermark day)
+    answered from raw orders. Returns None when rollups can't help.
+    """
+    state = await _cached_state(db)
+    if not state or not state.get("watermark"):
+        return None
+
+    start = to_utc_naive(datetime.fromisoformat(date_from)) if date_from else None
+    end = to_utc_naive(datetime.fromisoformat(date_to)) if date_to else None
+
+    # Days before the watermark's day are complete in the rollups
+    horizon = floor_day(state["watermark"])
+    first_day = ceil_day(start) if start else None
+    # date_to is inclusive ($lte), so a day is whole once its last millisecond is <= date_to
+    last_day_end = floor_day(end + timedelta(milliseconds=1)) if end else None
+    upper = min(horizon, last_day_end) if last_day_end else horizon
+
+    if first_day and first_day >= upper:
+        return None
+
+    rollup_filter: Dict[str, Any] = {
+        # A list of stores (chain endpoints) reads all their rows at once
+        "seller": {"$in": [ObjectId(s) for s in store_id]} if isinstance(store_id, list) else ObjectId(store_id),
+        "category": ObjectId(category_id) if category_id else None,
+        "day": {"$lt": upper}
+    }
+    if first_day:
+        rollup_filter["day"]["$gte"] = first_day
+    if status:
+        rollup_filter["status"] = status
+
+    edges = []
+    if start and start < first_day:
+        edges.append({"createdAt": {"$gte": start, "$lt": first_day}})
+    if end is None or upper <= end:
+        tail = {"$gte": upper}
+        if end:
+            tail["$lte"] = end
+        edges.append({"createdAt": tail})
+
+    raw_match = None
+    if edges:
+        raw_match = {k: v for k, v in match_stage.items() if k != "createdAt"}
+        if len(edges) == 1:
+            raw_match.update(edges[0])
+        else:
+            raw_match["$or"] = edges
+
+    return {"rollup_filter": rollup_filter, "raw_match": raw_match}
+
+
+async def rollup_totals(db, plan: Dict[str, Any]) -> Dict[str, Any]:
+    """Order count and revenue for a plan from plan_rollup_query"""
+    totals = {"orders": 0, "revenue": 0}
+    pipeline = [
+        {"$match": plan["rollup_filter"]},
+        {"$group": {"_id": None, "orders": {"$sum": "$orders"}, "revenue": {"$sum": "$revenue"}}}
+    ]
+    async for row in db[ROLLUPS_COLLECTION].aggregate(pipeline):
+        totals["orders"] += row["orders"]
+        totals["revenue"] += row["revenue"]
+
+    if plan["raw_match"] is not None:
+        pipeline = [
+            {"$match": plan["raw_match"]},
+            {"$group": {"_id": None, "orders": {"$sum": 1}, "revenue": {"$sum": "$total"}}}
+        ]
+        async for row in db.orders.aggregate(pipeline):
+            totals["orders"] += row["orders"]
+            totals["revenue"] += row["revenue"]
+
+    return totals
+
+
+async def rollup_unique_customers(db, plan: Dict[str, Any]) -> Optional[int]:
+    """
+    Approximate distinct customers for a plan from plan_rollup_query: merges the
+    per-day sketches and adds the raw edge customers. None when a row in range
+    predates the sketches (rerun --backfill).
+    """
+    sketch = HyperLogLog()
+    cursor = db[ROLLUPS_COLLECTION].find(plan["rollup_filter"], {"customers_hll": 1, "_id": 0})
+    async for row in cursor:
+        if row.get("customers_hll") is None:
+            return None
+        sketch.merge(row["customers_hll"])
+
+    if plan["raw_match"] is not None:
+        pipeline = [
+            {"$match": plan["raw_match"]},
+            {"$group": {"_id": "$customer.id"}},
+            {"$match": {"_id": {"$ne": None}}}
+        ]
+        async for row in db.orders.aggregate(pipeline):
+            sketch.add(row["_id"])
+
+    return sketch.count()
+
+
+async def rollup_monthly(db, plan: Dict[str, Any], by_seller: bool = False) -> List[Dict[str, Any]]:
+    """
+    Per (year, month) order count and revenue, sorted, for a plan from
+    plan_rollup_query. With by_seller, per (seller, year, month) instead.
+    """
+    months: Dict[Tuple, Dict[str, Any]] = {}
+
+    async def add(rows):
+        async for row in rows:
+            key = (row["_id"]["year"], row["_id"]["month"])
+            if by_seller:
+                key = (row["_id"]["seller"],) + key
+            month = months.get(key)
+            if month is None:
+                month = months[key] = {"year": key[-2], "month": key[-1], "orders": 0, "revenue": 0}
+                if by_seller:
+                    month["seller"] = key[0]
+            month["orders"] += row["orders"]
+            month["revenue"] += row["revenue"]
+
+    def group_id(date_field: str) -> Dict[str, Any]:
+        _id = {"year": {"$year": date_field}, "month": {"$month": date_field}}
+        if by_seller:
+            _id["seller"] = "$seller"
+        return _id
+
+    await add(db[ROLLUPS_COLLECTION].aggregate([
+        {"$match": plan["rollup_filter"]},
+        {
+            "$group": {
+                "_id": group_id("$day"),
+                "orders": {"$sum": "$orders"},
+                "revenue": {"$sum": "$revenue"}
+            }
+        }
+    ]))
+    if plan["raw_match"] is not None:
+        await add(db.orders.aggregate([
+            {"$match": plan["raw_match"]},
+            {
+                "$group": {
+                    "_id": group_id("$createdAt"),
+                    "orders": {"$sum": 1},
+                    "revenue": {"$sum": "$total"}
+                }
+            }
+        ]))
+
+    return [months[key] for key in sorted(months)]
+
+
+async def rollup_daily(db, plan: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Per UTC day order count and revenue, sorted, for a plan from plan_rollup_query"""
+    days: Dict[datetime, Dict[str, Any]] = {}
+
+    async def add(rows):
+        async for row in rows:
+            day = days.setdefault(row["_id"], {"day": row["_id"], "orders": 0, "revenue": 0})
+            day["orders"] += row["orders"]
+            day["revenue"] += row["revenue"]
+
+    await add(db[ROLLUPS_COLLECTION].aggregate([
+        {"$match": plan["rollup_filter"]},
+        {"$group": {"_id": "$day", "orders": {"$sum": "$orders"}, "revenue": {"$sum": "$revenue"}}}
+    ]))
+    if plan["raw_match"] is not None:
+        await add(db.orders.aggregate([
+            {"$match": plan["raw_match"]},
+            {
+                "$group": {
+                    "_id": {"$dateTrunc": {"date": "$createdAt", "unit": "day"}},
+                    "orders": {"$sum": 1},
+                    "revenue": {"$sum": "$total"}
+                }
+            }
+        ]))
+
+    return [days[key] for key in sorted(days)]
+
+
+async def rollup_hour_of_week(db, plan: Dict[str, Any], tz: str) -> Optional[Dict[int, List[float]]]:
+    """
+    {slot: [orders, revenue, amount received]} for a plan from
+    plan_rollup_query, in timezone tz. None when a row in range has no heat
+    slots for tz (built before them, or under another STORE_TIMEZONE).
+    """
+    stale = await db[ROLLUPS_COLLECTION].find_one({**plan["rollup_filter"], "heat_tz": {"$ne": tz}}, {"_id": 1})
+    if stale is not None:
+        return None
+
+    slots: Dict[int, List[float]] = {}
+
+    async def add(rows):
+        async for row in rows:
+            slot = slots.setdefault(row["_id"], [0, 0, 0])
+            slot[0] += row["orders"]
+            slot[1] += row["revenue"]
+            slot[2] += row["received"]
+
+    await add(db[ROLLUPS_COLLECTION].aggregate([
+        {"$match": plan["rollup_filter"]},
+        {"$unwind": "$heat"},
+        {
+            "$group": {
+                "_id": "$heat.slot",
+                "orders": {"$sum": "$heat.orders"},
+                "revenue": {"$sum": "$heat.revenue"},
+                "received": {"$sum": "$heat.received"}
+            }
+        }
+    ]))
+    if plan["raw_match"] is not None:
+        await add(db.orders.aggregate(hour_of_week_pipeline(plan["raw_match"], tz)))
+
+    return slots
+
+
+def hour_of_week_pipeline(match_stage: Dict[str, Any], tz: str) -> List[Dict[str, Any]]:
+    """Raw-orders version of the heat slots, for requests the rollups can't serve"""
+    return [
+        {"$match": match_stage},
+        {
+            "$group": {
+                "_id": hour_of_week_expr("$createdAt", tz),
+                "orders": {"$sum": 1},
+                "revenue": {"$sum": "$total"},
+                "received": {"$sum": "$amountReceived"}
+            }
+        }
+    ]
+
+
+# ============================================================================
+# CLI
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Build/refresh order_daily_rollups")
+    parser.add_argument("--backfill", action="store_true", help="Rebuild every store from scratch")
+    parser.add_argument("--reconcile", action="store_true", help="Rebuild days that disagree with raw orders (deletes)")
+    parser.add_argument("--loop", type=int, default=0, help="Keep refreshing every N seconds")
+    args = parser.parse_args()
+
+    from database import db
+
+    if args.backfill:
+        logger.info(f"Rollup backfill: {backfill_rollups(db)}")
+    next_reconcile = 0.0 if args.reconcile else time.monotonic() + ROLLUP_RECONCILE_SECONDS
+    while True:
+        logger.info(f"Rollup refresh: {refresh_rollups(db)}")
+        if (args.reconcile or args.loop) and time.monotonic() >= next_reconcile:
+            logger.info(f"Rollup reconcile: {reconcile_rollups(db)}")
+            next_reconcile = time.monotonic() + ROLLUP_RECONCILE_SECONDS
+        if not args.loop:
+            break
+        time.sleep(args.loop)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
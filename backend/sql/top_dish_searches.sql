@@ -0,0 +1,98 @@
+-- Server-side ranking for /api/analytics/top-dish-searches.
+-- Apply once in the Supabase SQL editor (or psql against a local Postgres/PostgREST):
+--     psql "$DATABASE_URL" -f sql/top_dish_searches.sql
+--
+-- top_dish_searches(store, facet, since, until, limit, offset) returns the top terms of
+-- one facet for a store inside a time window, with the total number of distinct terms
+-- for pagination. Facets:
+--     query    normalised search text
+--     dish     elements of raw_data.dishbased
+--     cuisine  elements of raw_data.cuisinebased
+--     dietary  elements of raw_data.dietarybased
+--     time     elements of raw_data.timebased
+--     product  product_details.product_name of the searched product_id
+-- The facet arrays may be text[] or jsonb; anything that isn't an array counts as empty.
+
+create index if not exists raw_data_store_id_timestamp_idx
+    on raw_data (store_id, "timestamp" desc);
+
+create index if not exists product_details_product_id_idx
+    on product_details (product_id);
+
+-- The window and store filters compare raw_data's columns in their own types (the
+-- parameters are cast, never the columns) so the (store_id, "timestamp") index above
+-- stays usable. The column types are looked up when this file is applied: re-apply
+-- it after changing them.
+do $do$
+declare
+    store_id_type text;
+    timestamp_type text;
+begin
+    select format_type(a.atttypid, a.atttypmod) into store_id_type
+    from pg_attribute a where a.attrelid = 'raw_data'::regclass and a.attname = 'store_id';
+    select format_type(a.atttypid, a.atttypmod) into timestamp_type
+    from pg_attribute a where a.attrelid = 'raw_data'::regclass and a.attname = 'timestamp';
+
+    execute format($sql$
+        create or replace function top_dish_searches(
+            p_store_id text,
+            p_facet text default 'query',
+            p_since timestamptz default null,
+            p_until timestamptz default null,
+            p_limit integer default 10,
+            p_offset integer default 0
+        )
+        returns table (term text, searches bigint, last_searched timestamptz, total_terms bigint)
+        language sql
+        stable
+        as $fn$
+            with windowed as (
+                select r.*
+                from raw_data r
+                where r.store_id = p_store_id::%1$s
+                  and (p_since is null or r."timestamp" >= p_since::%2$s)
+                  and (p_until is null or r."timestamp" <= p_until::%2$s)
+            ),
+            terms as (
+                select lower(btrim(w.query)) as term, w."timestamp"::timestamptz as ts
+                from windowed w
+                where p_facet = 'query' and coalesce(btrim(w.query), '') <> ''
+
+                union all
+                select e.value, w."timestamp"::timestamptz
+                from windowed w
+                cross join lateral (
+                    select case p_facet
+                        when 'dish' then to_jsonb(w.dishbased)
+                        when 'cuisine' then to_jsonb(w.cuisinebased)
+                        when 'dietary' then to_jsonb(w.dietarybased)
+                        when 'time' then to_jsonb(w.timebased)
+                    end as arr
+                ) f
+                cross join lateral jsonb_array_elements_text(
+                    case when jsonb_typeof(f.arr) = 'array' then f.arr else '[]'::jsonb end
+                ) as e(value)
+                where p_facet in ('dish', 'cuisine', 'dietary', 'time') and e.value <> ''
+
+                union all
+                select p.product_name, w."timestamp"::timestamptz
+                from windowed w
+                join product_details p on p.product_id = w.product_id
+                where p_facet = 'product' and coalesce(p.product_name, '') <> ''
+            ),
+            ranked as (
+                select t.term, count(*) as searches, max(t.ts) as last_searched
+                from terms t
+                group by t.term
+            )
+            select ranked.term, ranked.searches, ranked.last_searched, count(*) over () as total_terms
+            from ranked
+            order by ranked.searches desc, ranked.last_searched desc nulls last, ranked.term
+            limit greatest(p_limit, 0)
+            offset greatest(p_offset, 0)
+        $fn$
+    $sql$, store_id_type, timestamp_type);
+end
+$do$;
+
+grant execute on function top_dish_searches(text, text, timestamptz, timestamptz, integer, integer) to anon, authenticated, service_role;
@@ -0,0 +1,314 @@
+"""
+Precomputed product substitute graph.
+
+For every product of a store, scores every APPROVED product of the same store
+as a substitute and keeps the top K in product_substitutes:
+
+    score = 0.60 * name similarity   (TF-IDF cosine over character 3-grams of ProductName)
+          + 0.25 * same category
+          + 0.15 * price proximity   (1 - |a - b| / max(a, b) on offerPrice)
+
+Scoring is vectorised (scipy sparse n-gram matrix, NumPy blocks), so a store
+with a few thousand products rebuilds in seconds. Refreshes are incremental
+per store: only stores with products updated at or since the watermark are
+rescored, and only rows whose top K changed are written. A hard-deleted
+product leaves no updatedAt behind, so --sweep (and --loop, every
+SUBSTITUTE_GRAPH_SWEEP_SECONDS) also rescores stores whose graph rows belong
+to products that no longer exist, which drops them from their neighbours too.
+
+    python substitute_graph.py --backfill
+    python substitute_graph.py
+    python substitute_graph.py --sweep
+    python substitute_graph.py --loop 600
+"""
+import argparse
+import logging
+import os
+import time
+from collections import Counter
+from datetime import datetime
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import ReplaceOne
+
+if TYPE_CHECKING:
+    from scipy import sparse
+
+
+logger = logging.getLogger(__name__)
+
+GRAPH_COLLECTION = "product_substitutes"
+STATE_COLLECTION = "substitute_graph_state"
+STATE_ID = GRAPH_COLLECTION
+
+SUBSTITUTE_GRAPH_K = int(os.getenv("SUBSTITUTE_GRAPH_K", "10"))
+SUBSTITUTE_GRAPH_SWEEP_SECONDS = float(os.getenv("SUBSTITUTE_GRAPH_SWEEP_SECONDS", "3600"))
+NAME_WEIGHT = 0.60
+CATEGORY_WEIGHT = 0.25
+PRICE_WEIGHT = 0.15
+NGRAM = 3
+BLOCK_ROWS = 1024
+WRITE_BATCH_SIZE = 1000
+
+PRODUCT_FIELDS = {"ProductName": 1, "category": 1, "offerPrice": 1, "status": 1}
+
+
+# ============================================================================
+# SCORING
+# ============================================================================
+
+def _ngrams(name: str) -> Counter:
+    text = f" {' '.join(name.casefold().split())} "
+    return Counter(text[i:i + NGRAM] for i in range(max(len(text) - NGRAM + 1, 1)))
+
+
+def ngram_matrix(names: List[str]) -> "sparse.csr_matrix":
+    """Rows are L2-normalised TF-IDF vectors of character n-grams"""
+    # NumPy / SciPy load here, not at import: the API workers only use the read side
+    import numpy as np
+    from scipy import sparse
+
+    vocabulary: Dict[str, int] = {}
+    rows, cols, values = [], [], []
+    for row, name in enumerate(names):
+        for gram, count in _ngrams(name or "").items():
+            rows.append(row)
+            cols.append(vocabulary.setdefault(gram, len(vocabulary)))
+            values.append(count)
+
+    matrix = sparse.csr_matrix(
+        (np.asarray(values, dtype=np.float32), (rows, cols)),
+        shape=(len(names), max(len(vocabulary), 1))
+    )
+    document_frequency = np.bincount(matrix.indices, minlength=matrix.shape[1])
+    idf = np.log((1 + len(names)) / (1 + document_frequency)).astype(np.float32) + 1
+    matrix = matrix @ sparse.diags(idf)
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.csr_matrix(sparse.diags(1 / norms) @ matrix)
+
+
+def _price(product: Dict[str, Any]) -> float:
+    try:
+        return float(product.get("offerPrice") or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def rank_substitutes(products: List[Dict[str, Any]], k: int = SUBSTITUTE_GRAPH_K) -> Dict[ObjectId, List[Dict[str, Any]]]:
+    """Top-k approved substitutes (index, score parts) for every product of one store"""
+    import numpy as np
+
+    candidate_idx = np.array([i for i, p in enumerate(products) if p.get("status") == "APPROVED"], dtype=np.int64)
+    if not len(products) or not len(candidate_idx):
+        return {p["_id"]: [] for p in products}
+
+    names = ngram_matrix([p.get("ProductName") or "" for p in products])
+    candidate_names = names[candidate_idx].T.tocsc()
+    prices = np.array([_price(p) for p in products], dtype=np.float64)
+    categories = np.array([str(p.get("category") or "") for p in products], dtype=object)
+    candidate_prices = prices[candidate_idx]
+    candidate_categories = categories[candidate_idx]
+    # Position of each product among the candidates (-1 when it isn't one), to drop self matches
+    candidate_position = np.full(len(products), -1, dtype=np.int64)
+    candidate_position[candidate_idx] = np.arange(len(candidate_idx))
+
+    graph: Dict[ObjectId, List[Dict[str, Any]]] = {}
+    for start in range(0, len(products), BLOCK_ROWS):
+        stop = min(start + BLOCK_ROWS, len(products))
+        name_score = np.asarray((names[start:stop] @ candidate_names).todense())
+
+        block_categories = categories[start:stop, None]
+        same_category = (block_categories == candidate_categories[None, :]) & (block_categories != "")
+
+        a = prices[start:stop, None]
+        b = candidate_prices[None, :]
+        high = np.maximum(a, b)
+        price_score = np.where((a > 0) & (b > 0), 1 - np.abs(a - b) / np.where(high > 0, high, 1), 0.0)
+
+        score = NAME_WEIGHT * name_score + CATEGORY_WEIGHT * same_category + PRICE_WEIGHT * price_score
+        block_rows = np.arange(stop - start)
+        self_position = candidate_position[start:stop]
+        has_self = self_position >= 0
+        score[block_rows[has_self], self_position[has_self]] = -np.inf
+
+        top = min(k, score.shape[1])
+        if top < score.shape[1]:
+            best = np.argpartition(-score, top - 1, axis=1)[:, :top]
+        else:
+            best = np.tile(np.arange(score.shape[1]), (stop - start, 1))
+        for row, columns in enumerate(best):
+            columns = columns[np.argsort(-score[row, columns], kind="stable")]
+            graph[products[start + row]["_id"]] = [
+                {
+                    "index": int(candidate_idx[col]),
+                    "score": round(float(score[row, col]), 4),
+                    "name_similarity": round(float(name_score[row, col]), 4),
+                    "same_category": bool(same_category[row, col]),
+                    "price_proximity": round(float(price_score[row, col]), 4)
+                }
+                for col in columns if np.isfinite(score[row, col])
+            ]
+    return graph
+
+
+# ============================================================================
+# BUILDER
+# ============================================================================
+
+def _entry(product: Dict[str, Any], parts: Dict[str, Any], category_names: Dict[Any, str]) -> Dict[str, Any]:
+    return {
+        "product_id": product["_id"],
+        "product_name": product.get("ProductName"),
+        "offer_price": product.get("offerPrice"),
+        "category": product.get("category"),
+        "category_name": category_names.get(product.get("category")),
+        "score": parts["score"],
+        "name_similarity": parts["name_similarity"],
+        "same_category": parts["same_category"],
+        "price_proximity": parts["price_proximity"]
+    }
+
+
+def rebuild_store_graph(db, seller: ObjectId, k: int = SUBSTITUTE_GRAPH_K) -> int:
+    """Rescore one store; writes only rows whose substitutes changed and drops rows of removed products"""
+    products = list(db.products.find({"seller": seller}, PRODUCT_FIELDS))
+    category_ids = list({p["category"] for p in products if p.get("category")})
+    category_names = {
+        c["_id"]: c.get("name")
+        for c in db.categories.find({"_id": {"$in": category_ids}}, {"name": 1})
+    }
+    ranked = rank_substitutes(products, k)
+
+    existing = {
+        row["_id"]: row.get("substitutes")
+        for row in db[GRAPH_COLLECTION].find({"seller": seller}, {"substitutes": 1})
+    }
+    now = datetime.utcnow()
+    ops, written = [], 0
+    for product in products:
+        substitutes = [_entry(products[parts["index"]], parts, category_names) for parts in ranked[product["_id"]]]
+        if existing.get(product["_id"]) == substitutes:
+            continue
+        ops.append(ReplaceOne(
+            {"_id": product["_id"]},
+            {"_id": product["_id"], "seller": seller, "substitutes": substitutes, "updated_at": now},
+            upsert=True
+        ))
+        if len(ops) >= WRITE_BATCH_SIZE:
+            db[GRAPH_COLLECTION].bulk_write(ops, ordered=False)
+            written += len(ops)
+            ops = []
+    if ops:
+        db[GRAPH_COLLECTION].bulk_write(ops, ordered=False)
+        written += len(ops)
+
+    current = {p["_id"] for p in products}
+    removed = [pid for pid in existing if pid not in current]
+    if removed:
+        db[GRAPH_COLLECTION].delete_many({"_id": {"$in": removed}})
+    return written
+
+
+def _latest_product_update(db) -> Optional[datetime]:
+    latest = db.products.find_one({"updatedAt": {"$type": "date"}}, {"updatedAt": 1}, sort=[("updatedAt", -1)])
+    return latest["updatedAt"] if latest else None
+
+
+def stores_with_deleted_products(db) -> List[ObjectId]:
+    """Stores with a graph row whose product is gone (every product has its own row)"""
+    sellers = set()
+    cursor = db[GRAPH_COLLECTION].find({}, {"seller": 1}).batch_size(WRITE_BATCH_SIZE)
+    batch: Dict[ObjectId, ObjectId] = {}
+
+    def check():
+        alive = {p["_id"] for p in db.products.find({"_id": {"$in": list(batch)}}, {"_id": 1})}
+        sellers.update(seller for pid, seller in batch.items() if pid not in alive)
+        batch.clear()
+
+    for row in cursor:
+        batch[row["_id"]] = row["seller"]
+        if len(batch) >= WRITE_BATCH_SIZE:
+            check()
+    if batch:
+        check()
+    return list(sellers)
+
+
+def sweep_deleted_products(db) -> Dict[str, Any]:
+    """Rescore the stores stores_with_deleted_products finds; rebuild_store_graph drops the dead rows"""
+    sellers = stores_with_deleted_products(db)
+    written = sum(rebuild_store_graph(db, seller) for seller in sellers)
+    return {"sellers": len(sellers), "rows_written": written}
+
+
+def refresh_substitute_graph(db, full: bool = False) -> Dict[str, Any]:
+    """Rescore every store, or only stores with products updated at or since the watermark"""
+    state = db[STATE_COLLECTION].find_one({"_id": STATE_ID})
+    previous = state.get("watermark") if state and not full else None
+    # Taken before the scan: anything updated meanwhile is picked up next run
+    watermark = _latest_product_update(db) or previous
+
+    if previous is None:
+        sellers = db.products.distinct("seller")
+    else:
+        # $gte: a write sharing the watermark's timestamp may have landed after the last scan
+        sellers = db.products.distinct("seller", {"updatedAt": {"$gte": previous}})
+
+    written = 0
+    for seller in sellers:
+        written += rebuild_store_graph(db, seller)
+
+    db[STATE_COLLECTION].update_one(
+        {"_id": STATE_ID},
+        {"$set": {"watermark": watermark, "last_run_at": datetime.utcnow(), "last_mode": "backfill" if previous is None else "incremental"}},
+        upsert=True
+    )
+    return {"sellers": len(sellers), "rows_written": written, "watermark": watermark}
+
+
+# ============================================================================
+# READ SIDE (async, used by quick-analysis)
+# ============================================================================
+
+async def get_substitute_rows(db, product_ids: List[ObjectId]) -> Dict[ObjectId, List[Dict[str, Any]]]:
+    """Ranked substitutes per product id, for the products the graph has a row for"""
+    cursor = db[GRAPH_COLLECTION].find({"_id": {"$in": product_ids}}, {"substitutes": 1})
+    return {row["_id"]: row["substitutes"] async for row in cursor}
+
+
+# ============================================================================
+# CLI
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Build/refresh the product substitute graph")
+    parser.add_argument("--backfill", action="store_true", help="Rescore every store")
+    parser.add_argument("--store-id", help="Rescore a single store")
+    parser.add_argument("--sweep", action="store_true", help="Also rescore stores with deleted products")
+    parser.add_argument("--loop", type=int, default=0, help="Keep refreshing every N seconds")
+    args = parser.parse_args()
+
+    from database import db
+
+    if args.store_id:
+        logger.info(f"Rows written: {rebuild_store_graph(db, ObjectId(args.store_id))}")
+        return
+
+    full = args.backfill
+    next_sweep = 0.0 if args.sweep else time.monotonic() + SUBSTITUTE_GRAPH_SWEEP_SECONDS
+    while True:
+        logger.info(f"Substitute graph refresh: {refresh_substitute_graph(db, full=full)}")
+        full = False
+        if (args.sweep or args.loop) and time.monotonic() >= next_sweep:
+            logger.info(f"Substitute graph sweep: {sweep_deleted_products(db)}")
+            next_sweep = time.monotonic() + SUBSTITUTE_GRAPH_SWEEP_SECONDS
+        if not args.loop:
+            break
+        time.sleep(args.loop)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,67 @@
+"""HyperLogLog estimates and register-wise merging"""
+import pytest
+
+from hyperloglog import REGISTERS, HyperLogLog
+
+
+def sketch(values):
+    return HyperLogLog().update(values)
+
+
+@pytest.mark.parametrize("n", [0, 1, 10, 1000, 20000, 200000])
+def test_estimate_is_within_three_standard_errors(n):
+    estimate = sketch(f"customer-{i}" for i in range(n)).count()
+    # 1.04 / sqrt(2**12) is about 1.6%
+    assert abs(estimate - n) <= max(1, 0.05 * n)
+
+
+def test_duplicates_are_not_counted_twice():
+    values = [f"customer-{i % 500}" for i in range(10000)]
+    assert sketch(values).count() == sketch(set(values)).count()
+
+
+def test_merge_equals_the_sketch_of_the_union():
+    monday = [f"customer-{i}" for i in range(0, 6000)]
+    tuesday = [f"customer-{i}" for i in range(4000, 9000)]
+
+    merged = sketch(monday).merge(sketch(tuesday).to_bytes())
+
+    assert merged.registers == sketch(monday + tuesday).registers
+    assert abs(merged.count() - 9000) <= 0.05 * 9000
+
+
+def test_merge_is_order_independent():
+    days = [sketch(f"customer-{d}-{i}" for i in range(50 * (d + 1))).to_bytes() for d in range(7)]
+
+    forward = HyperLogLog()
+    for data in days:
+        forward.merge(data)
+    backward = HyperLogLog()
+    for data in reversed(days):
+        backward.merge(data)
+
+    assert forward.registers == backward.registers
+    assert abs(forward.count() - sum(50 * (d + 1) for d in range(7))) <= 0.05 * 1400
+
+
+def test_quiet_days_serialise_sparsely():
+    quiet = sketch(f"customer-{i}" for i in range(20))
+    busy = sketch(f"customer-{i}" for i in range(50000))
+
+    assert len(quiet.to_bytes()) == 3 * (REGISTERS - quiet.registers.count(0))
+    assert len(busy.to_bytes()) == REGISTERS
+
+
+@pytest.mark.parametrize("n", [20, 50000])
+def test_to_bytes_round_trips(n):
+    original = sketch(f"customer-{i}" for i in range(n))
+    assert HyperLogLog().merge(original.to_bytes()).registers == original.registers
+
+
+def test_sparse_and_dense_sketches_merge():
+    sparse = sketch(f"a-{i}" for i in range(30))
+    dense = sketch(f"b-{i}" for i in range(30000))
+
+    merged = HyperLogLog().merge(dense.to_bytes()).merge(sparse.to_bytes())
+
+    assert merged.registers == sketch([f"a-{i}" for i in range(30)] + [f"b-{i}" for i in range(30000)]).registers
@@ -0,0 +1,226 @@
+"""
+Live KPI counters against a real MongoDB: ledger diffing, the transactional
+batch (lease, resume token) and reconciliation.
+
+Transactions and change streams need a replica set; a single node is enough:
+
+    mongod --replSet rs0 --dbpath /tmp/rs0 && mongosh --eval "rs.initiate()"
+    LIVE_KPIS_TEST_MONGODB_URI="mongodb://localhost:27017/?replicaSet=rs0" python -m pytest -q tests/test_live_kpis.py
+
+The tests skip without LIVE_KPIS_TEST_MONGODB_URI. They drop and recreate
+the LIVE_KPIS_TEST_MONGODB_DB database (default live_kpis_test).
+"""
+import os
+
+import pytest
+from bson import ObjectId
+from pymongo import MongoClient, ReturnDocument
+
+from live_kpis import (
+    COUNTERS_COLLECTION,
+    CUSTOMERS_COLLECTION,
+    LEDGER_COLLECTION,
+    STATE_COLLECTION,
+    STATE_ID,
+    WATCH_PIPELINE,
+    LeaseLost,
+    apply_batch,
+    apply_change,
+    ensure_live_kpi_indexes,
+    reconcile
+)
+
+TEST_MONGODB_URI = os.getenv("LIVE_KPIS_TEST_MONGODB_URI")
+TEST_MONGODB_DB = os.getenv("LIVE_KPIS_TEST_MONGODB_DB", "live_kpis_test")
+
+SELLER = ObjectId("65a000000000000000000001")
+OWNER = "test-consumer"
+
+
+@pytest.fixture
+def db():
+    if not TEST_MONGODB_URI:
+        pytest.skip("LIVE_KPIS_TEST_MONGODB_URI is not set (needs a replica set)")
+    client = MongoClient(TEST_MONGODB_URI, serverSelectionTimeoutMS=5000)
+    client.drop_database(TEST_MONGODB_DB)
+    database = client[TEST_MONGODB_DB]
+    # Transactions can't always create collections, so make them up front
+    for name in ("orders", COUNTERS_COLLECTION, CUSTOMERS_COLLECTION, LEDGER_COLLECTION, STATE_COLLECTION):
+        database.create_collection(name)
+    ensure_live_kpi_indexes(database)
+    database[STATE_COLLECTION].insert_one({"_id": STATE_ID, "owner": OWNER, "ready": True})
+    yield database
+    client.drop_database(TEST_MONGODB_DB)
+    client.close()
+
+
+def customer(customer_id="c1"):
+    return {"id": customer_id, "customerName": f"Customer {customer_id}", "phoneNumber": "9990000000"}
+
+
+def insert(db, **fields):
+    """Write an order and return the change event the stream would deliver"""
+    order = {"_id": ObjectId(), "seller": SELLER, "status": "pending", "total": 10, "customer": customer(), **fields}
+    db.orders.insert_one(order)
+    return {"operationType": "insert", "documentKey": {"_id": order["_id"]}, "fullDocument": order}
+
+
+def update(db, order_id, **fields):
+    document = db.orders.find_one_and_update({"_id": order_id}, {"$set": fields}, return_document=ReturnDocument.AFTER)
+    return {"operationType": "update", "documentKey": {"_id": order_id}, "fullDocument": document}
+
+
+def delete(db, order_id):
+    db.orders.delete_one({"_id": order_id})
+    return {"operationType": "delete", "documentKey": {"_id": order_id}}
+
+
+def counters(db):
+    return db[COUNTERS_COLLECTION].find_one({"_id": SELLER}) or {}
+
+
+def customer_row(db, customer_id):
+    return db[CUSTOMERS_COLLECTION].find_one({"_id": {"seller": SELLER, "customer": customer_id}})
+
+
+# ============================================================================
+# LEDGER DIFFING
+# ============================================================================
+
+def test_insert_counts_order_and_customer(db):
+    change = insert(db, total=25)
+
+    assert apply_change(db, change) is True
+    stored = counters(db)
+    assert (stored["orders"], stored["revenue"], stored["customers"]) == (1, 25, 1)
+    assert stored["status"]["pending"] == {"orders": 1, "revenue": 25}
+    assert db[LEDGER_COLLECTION].find_one({"_id": change["documentKey"]["_id"]})["total"] == 25
+    assert customer_row(db, "c1")["orders"] == 1
+
+
+def test_update_moves_the_order_to_its_new_status_and_total(db):
+    change = insert(db)
+    apply_change(db, change)
+    order_id = change["documentKey"]["_id"]
+
+    assert apply_change(db, update(db, order_id, status="delivered", total=40)) is True
+    stored = counters(db)
+    assert (stored["orders"], stored["revenue"], stored["customers"]) == (1, 40, 1)
+    assert stored["status"]["pending"] == {"orders": 0, "revenue": 0}
+    assert stored["status"]["delivered"] == {"orders": 1, "revenue": 40}
+    assert customer_row(db, "c1")["spent"] == 40
+
+
+def test_update_of_uncounted_fields_changes_nothing(db):
+    change = insert(db)
+    apply_change(db, change)
+    before = counters(db)
+
+    assert apply_change(db, update(db, change["documentKey"]["_id"], orderNumber="A-17")) is False
+    assert counters(db) == before
+
+
+def test_customer_change_moves_the_unique_customer(db):
+    change = insert(db)
+    apply_change(db, change)
+
+    apply_change(db, update(db, change["documentKey"]["_id"], customer=customer("c2")))
+
+    assert counters(db)["customers"] == 1
+    assert customer_row(db, "c1") is None
+    assert customer_row(db, "c2")["orders"] == 1
+
+
+def test_delete_uncounts_the_order(db):
+    kept = insert(db, customer=customer("c2"), total=5)
+    deleted = insert(db, total=20)
+    apply_change(db, kept)
+    apply_change(db, deleted)
+
+    assert apply_change(db, delete(db, deleted["documentKey"]["_id"])) is True
+    stored = counters(db)
+    assert (stored["orders"], stored["revenue"], stored["customers"]) == (1, 5, 1)
+    assert customer_row(db, "c1") is None
+    assert db[LEDGER_COLLECTION].find_one({"_id": deleted["documentKey"]["_id"]}) is None
+
+
+def test_replayed_and_unknown_events_are_noops(db):
+    change = insert(db)
+    apply_change(db, change)
+    before = counters(db)
+
+    assert apply_change(db, change) is False
+    assert apply_change(db, {"operationType": "delete", "documentKey": {"_id": ObjectId()}}) is False
+    # Updated then deleted before the updateLookup: the delete event does the work
+    assert apply_change(db, {"operationType": "update", "documentKey": {"_id": change["documentKey"]["_id"]}, "fullDocument": None}) is False
+    assert counters(db) == before
+
+
+# ============================================================================
+# BATCHES: LEASE AND RESUME TOKEN
+# ============================================================================
+
+def test_lease_lost_mid_batch_applies_nothing(db):
+    applied = insert(db)
+    apply_batch(db, [applied], {"_data": "before"}, OWNER)
+    before = counters(db)
+
+    # Another worker took the lease while this batch was being read
+    db[STATE_COLLECTION].update_one({"_id": STATE_ID}, {"$set": {"owner": "other-worker"}})
+    pending = [insert(db, total=99), update(db, applied["documentKey"]["_id"], status="delivered")]
+    with pytest.raises(LeaseLost):
+        apply_batch(db, pending, {"_data": "after"}, OWNER)
+
+    assert counters(db) == before
+    assert db[LEDGER_COLLECTION].count_documents({}) == 1
+    assert db[STATE_COLLECTION].find_one({"_id": STATE_ID})["resume_token"] == {"_data": "before"}
+
+
+def test_batch_saves_the_resume_token_of_its_last_event(db):
+    with db.orders.watch(WATCH_PIPELINE, full_document="updateLookup") as stream:
+        first = insert(db)
+        update(db, first["documentKey"]["_id"], status="delivered")
+        changes = [stream.next(), stream.next()]
+    apply_batch(db, changes, changes[-1]["_id"], OWNER)
+
+    token = db[STATE_COLLECTION].find_one({"_id": STATE_ID})["resume_token"]
+    assert token == changes[-1]["_id"]
+    assert counters(db)["status"]["delivered"]["orders"] == 1
+
+    # Resuming after a restart starts at the first event the counters haven't seen
+    later = insert(db)
+    with db.orders.watch(WATCH_PIPELINE, full_document="updateLookup", resume_after=token) as stream:
+        assert stream.next()["documentKey"]["_id"] == later["documentKey"]["_id"]
+
+
+# ============================================================================
+# RECONCILE
+# ============================================================================
+
+def test_reconcile_drains_pending_events_before_calling_it_drift(db):
+    apply_change(db, insert(db))
+    # Written but not applied yet: the consumer's next batch holds it
+    pending = [insert(db, customer=customer("c2"), total=7)]
+
+    def drain():
+        while pending:
+            apply_change(db, pending.pop())
+
+    result = reconcile(db, drain)
+
+    assert result["repaired"] == []
+    assert (counters(db)["orders"], counters(db)["customers"]) == (2, 2)
+
+
+def test_reconcile_rebuilds_drifted_counters(db):
+    apply_change(db, insert(db, total=12))
+    db[COUNTERS_COLLECTION].update_one({"_id": SELLER}, {"$inc": {"orders": 3, "revenue": 50}})
+    drained = []
+
+    result = reconcile(db, lambda: drained.append(True))
+
+    assert drained == [True]
+    assert result["repaired"] == [str(SELLER)]
+    stored = counters(db)
+    assert (stored["orders"], stored["revenue"], stored["customers"]) == (1, 12, 1)
+    assert db[STATE_COLLECTION].find_one({"_id": STATE_ID})["last_repaired"] == [str(SELLER)]
@@ -0,0 +1,109 @@
+"""plan_rollup_query: which days come from rollups and which edges from raw orders"""
+import asyncio
+import time
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+
+import rollups
+
+STORE = "65a000000000000000000001"
+OTHER_STORE = "65a000000000000000000002"
+CATEGORY = "65a0000000000000000000c1"
+
+
+@pytest.fixture
+def watermark(monkeypatch):
+    """Prime the state cache so plan_rollup_query never reads Mongo"""
+    def set_watermark(value):
+        monkeypatch.setattr(rollups, "_state_cache", {"loaded_at": time.monotonic(), "state": {"watermark": value}})
+    return set_watermark
+
+
+def plan(date_from=None, date_to=None, store_id=STORE, status=None, category_id=None, match_stage=None):
+    if match_stage is None:
+        match_stage = {"seller": ObjectId(STORE), "createdAt": {"$gte": "ignored"}}
+    return asyncio.run(rollups.plan_rollup_query(None, match_stage, store_id, date_from, date_to, status, category_id))
+
+
+def test_no_rollup_state_means_no_plan(monkeypatch):
+    monkeypatch.setattr(rollups, "_state_cache", {"loaded_at": time.monotonic(), "state": None})
+    assert plan("2024-01-01", "2024-01-31") is None
+
+
+def test_whole_days_need_no_raw_orders(watermark):
+    watermark(datetime(2024, 2, 1, 6))
+    result = plan("2024-01-01T00:00:00", "2024-01-04T23:59:59.999")
+
+    assert result["rollup_filter"]["day"] == {"$gte": datetime(2024, 1, 1), "$lt": datetime(2024, 1, 5)}
+    assert result["raw_match"] is None
+
+
+def test_partial_first_and_last_day_are_raw_edges(watermark):
+    watermark(datetime(2024, 2, 1, 6))
+    result = plan("2024-01-01T10:00:00", "2024-01-05T12:00:00")
+
+    assert result["rollup_filter"]["day"] == {"$gte": datetime(2024, 1, 2), "$lt": datetime(2024, 1, 5)}
+    assert result["raw_match"] == {
+        "seller": ObjectId(STORE),
+        "$or": [
+            {"createdAt": {"$gte": datetime(2024, 1, 1, 10), "$lt": datetime(2024, 1, 2)}},
+            {"createdAt": {"$gte": datetime(2024, 1, 5), "$lte": datetime(2024, 1, 5, 12)}},
+        ],
+    }
+
+
+def test_days_from_the_watermark_day_on_are_raw(watermark):
+    # The watermark's own day may still be missing orders, so it is read raw
+    watermark(datetime(2024, 1, 3, 8, 30))
+    result = plan("2024-01-01", "2024-01-10T00:00:00")
+
+    assert result["rollup_filter"]["day"] == {"$gte": datetime(2024, 1, 1), "$lt": datetime(2024, 1, 3)}
+    assert result["raw_match"] == {
+        "seller": ObjectId(STORE),
+        "createdAt": {"$gte": datetime(2024, 1, 3), "$lte": datetime(2024, 1, 10)},
+    }
+
+
+def test_open_range_reads_rollups_up_to_the_horizon(watermark):
+    watermark(datetime(2024, 1, 3, 8, 30))
+    result = plan()
+
+    assert result["rollup_filter"]["day"] == {"$lt": datetime(2024, 1, 3)}
+    assert result["raw_match"]["createdAt"] == {"$gte": datetime(2024, 1, 3)}
+
+
+def test_range_without_a_whole_day_falls_back(watermark):
+    watermark(datetime(2024, 2, 1))
+    assert plan("2024-01-01T10:00:00", "2024-01-02T09:00:00") is None
+    # Nothing before the watermark's day either
+    assert plan("2024-02-01T00:00:00", "2024-02-05T00:00:00") is None
+
+
+def test_aware_dates_are_compared_in_utc(watermark):
+    watermark(datetime(2024, 2, 1))
+    # 2024-01-02 00:00 in Kolkata is 2024-01-01 18:30 UTC
+    result = plan("2024-01-02T00:00:00+05:30", "2024-01-03T23:59:59.999+00:00")
+
+    assert result["rollup_filter"]["day"] == {"$gte": datetime(2024, 1, 2), "$lt": datetime(2024, 1, 4)}
+    assert result["raw_match"]["createdAt"] == {"$gte": datetime(2024, 1, 1, 18, 30), "$lt": datetime(2024, 1, 2)}
+
+
+def test_filters_select_the_matching_rollup_rows(watermark):
+    watermark(datetime(2024, 2, 1))
+    result = plan("2024-01-01", "2024-01-10", store_id=[STORE, OTHER_STORE], status="delivered", category_id=CATEGORY)
+
+    rollup_filter = result["rollup_filter"]
+    assert rollup_filter["seller"] == {"$in": [ObjectId(STORE), ObjectId(OTHER_STORE)]}
+    assert rollup_filter["category"] == ObjectId(CATEGORY)
+    assert rollup_filter["status"] == "delivered"
+
+
+def test_store_wide_rows_have_no_category(watermark):
+    watermark(datetime(2024, 2, 1))
+    rollup_filter = plan("2024-01-01", "2024-01-10")["rollup_filter"]
+
+    assert rollup_filter["seller"] == ObjectId(STORE)
+    assert rollup_filter["category"] is None
+    assert "status" not in rollup_filter
@@ -0,0 +1,164 @@
+"""
+Local stand-in for the Azure OpenAI chat completions API, with simulated latency
+and failures, for exercising the AI endpoints without a real deployment.
+
+    python tools/stub_llm_server.py --port 8099 --latency-ms 1500 --jitter-ms 500 --fail-rate 0.1
+
+Then start the API against it:
+
+    AZURE_ENDPOINT=http://127.0.0.1:8099 AZURE_KEY=stub uvicorn main:app
+
+Every request sleeps latency +/- jitter. A --fail-rate share answers 500, a
+--hang-rate share sleeps --hang-ms (to trip LLM_TIMEOUT_SECONDS) and a
+--bad-json-rate share returns content that is not JSON.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+_COMPLETIONS_PATH = re.compile(r"^(/openai/deployments/[^/]+)?/chat/completions")
+
+stats = {"requests": 0, "in_flight": 0, "max_in_flight": 0}
+stats_lock = threading.Lock()
+
+
+def completion_body(model: str, content: str) -> dict:
+    return {
+        "id": f"chatcmpl-stub-{random.getrandbits(32):08x}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": content}
+            }
+        ],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    }
+
+
+_SUBSTITUTE_OPTIONS = re.compile(r"Available Options: (\[.*?\])\s*Return JSON array", re.S)
+_SUBSTITUTE_COUNT = re.compile(r"best (\d+)")
+
+
+def stub_substitutes(prompt: str) -> list:
+    """A JSON array in SUBSTITUTION_USER_PROMPT's shape, picked from the options it lists"""
+    options = _SUBSTITUTE_OPTIONS.search(prompt)
+    count = _SUBSTITUTE_COUNT.search(prompt)
+    try:
+        alternatives = json.loads(options.group(1)) if options else []
+    except json.JSONDecodeError:
+        alternatives = []
+    top_n = int(count.group(1)) if count else 5
+    return [
+        {
+            "product_id": option.get("id"),
+            "product_name": option.get("name"),
+            "similarity_score": round(0.9 - i * 0.1, 2),
+            "price_difference": 0,
+            "reason": "Stub response: listed option in the same category."
+        }
+        for i, option in enumerate(alternatives[:top_n])
+    ]
+
+
+def stub_content(prompt: str) -> str:
+    """Plausible JSON for each prompt family used by api.py"""
+    if "substitute" in prompt.lower():
+        return json.dumps(stub_substitutes(prompt))
+    return json.dumps({
+        "recommendation": "Run a limited-time bundle offer to move surplus stock.",
+        "reasoning": "Stub response: stock is high relative to recent demand."
+    })
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    options: argparse.Namespace
+
+    def _send_json(self, status: int, body: dict) -> None:
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path.startswith("/stats"):
+            with stats_lock:
+                self._send_json(200, dict(stats))
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        if not _COMPLETIONS_PATH.match(self.path):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        prompt = " ".join(m.get("content") or "" for m in request.get("messages", []))
+        opts = self.options
+
+        with stats_lock:
+            stats["requests"] += 1
+            stats["in_flight"] += 1
+            stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+        try:
+            roll = random.random()
+            if roll < opts.hang_rate:
+                time.sleep(opts.hang_ms / 1000)
+            else:
+                jitter = random.uniform(-opts.jitter_ms, opts.jitter_ms)
+                time.sleep(max(0.0, opts.latency_ms + jitter) / 1000)
+
+            roll = random.random()
+            if roll < opts.fail_rate:
+                self._send_json(500, {"error": {"message": "stub failure", "type": "server_error"}})
+            elif roll < opts.fail_rate + opts.bad_json_rate:
+                self._send_json(200, completion_body(request.get("model", "stub"), "not json"))
+            else:
+                self._send_json(200, completion_body(request.get("model", "stub"), stub_content(prompt)))
+        except (BrokenPipeError, ConnectionResetError):
+            # Client gave up (timeout); nothing to answer
+            pass
+        finally:
+            with stats_lock:
+                stats["in_flight"] -= 1
+
+    def log_message(self, format, *args):
+        if not self.options.quiet:
+            super().log_message(format, *args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub Azure OpenAI chat completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency-ms", type=float, default=1000)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Share of requests answered with HTTP 500")
+    parser.add_argument("--bad-json-rate", type=float, default=0.0, help="Share of requests with non-JSON content")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="Share of requests that sleep --hang-ms")
+    parser.add_argument("--hang-ms", type=float, default=60000)
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args()
+
+    StubHandler.options = args
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    print(f"Stub LLM listening on http://{args.host}:{args.port} (GET /stats for counters)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -15,6 +15,24 @@ const buildQueryParams = (params: Record<string, any>): URLSearchParams => {
 };
 
 // API Functions
+export async function fetchKpis(storeId: string, params = {}) {
+  const queryParams = buildQueryParams(params);
+  const url = `${API_BASE}/api/analytics/kpis/${storeId}?${queryParams}`;
+  const res = await fetch(url, {
+    headers: {
+      'ngrok-skip-browser-warning': 'true',
+      'Content-Type': 'application/json'
+    }
+  });
+
+  const ct = res.headers.get("content-type") || "";
+  if (!ct.includes("application/json")) {
+    throw new Error(await res.text());
+  }
+
+  return res.json();
+}
+
 export async function fetchTotalProducts(storeId: string, params = {}) {
   const queryParams = buildQueryParams(params);
   const url = `${API_BASE}/api/analytics/total-products/${storeId}?${queryParams}`;
@@ -141,38 +159,48 @@ export async function fetchTopCustomers(storeId: string, params = {}) {
   return res.json();
 }
 
-export async function fetchTopStockAlerts(storeId: string) {
-  const url = `${API_BASE}/api/analytics/top-stock-alerts/${storeId}`;
-  const res = await fetch(url, {
-    headers: {
-      'ngrok-skip-browser-warning': 'true',
-      'Content-Type': 'application/json'
-    }
-  });
+// AI endpoints run as background jobs: submit, then poll until the job finishes
+const AI_JOB_POLL_MS = 1000;
+const AI_JOB_TIMEOUT_MS = 180000;
+
+async function runAiJob(path: string) {
+  const headers = {
+    'ngrok-skip-browser-warning': 'true',
+    'Content-Type': 'application/json'
+  };
+  const res = await fetch(`${API_BASE}${path}`, { method: 'POST', headers });
 
   const ct = res.headers.get("content-type") || "";
   if (!ct.includes("application/json")) {
     throw new Error(await res.text());
   }
 
-  return res.json();
-}
-
-export async function fetchQuickAnalysis(storeId: string) {
-  const url = `${API_BASE}/api/analytics/quick-analysis/${storeId}`;
-  const res = await fetch(url, {
-    headers: {
-      'ngrok-skip-browser-warning': 'true',
-      'Content-Type': 'application/json'
+  let job = await res.json();
+  const deadline = Date.now() + AI_JOB_TIMEOUT_MS;
+  while (job.status !== 'done' && job.status !== 'failed') {
+    if (Date.now() > deadline) {
+      throw new Error('AI job timed out');
     }
-  });
+    await new Promise((resolve) => setTimeout(resolve, AI_JOB_POLL_MS));
+    const poll = await fetch(`${API_BASE}${job.status_url || `/api/jobs/${job.job_id}`}`, { headers });
+    if (!poll.ok || !(poll.headers.get("content-type") || "").includes("application/json")) {
+      throw new Error(await poll.text());
+    }
+    job = { ...job, ...(await poll.json()) };
+  }
 
-  const ct = res.headers.get("content-type") || "";
-  if (!ct.includes("application/json")) {
-    throw new Error(await res.text());
+  if (job.status === 'failed') {
+    throw new Error(job.error || 'AI job failed');
   }
+  return job.result;
+}
 
-  return res.json();
+export async function fetchTopStockAlerts(storeId: string) {
+  return runAiJob(`/api/analytics/top-stock-alerts/${storeId}/jobs`);
+}
+
+export async function fetchQuickAnalysis(storeId: string) {
+  return runAiJob(`/api/analytics/quick-analysis/${storeId}/jobs`);
 }
 
 export async function fetchMonthlyRevenue(storeId: string, params = {}) {
@@ -229,8 +257,9 @@ export async function fetchRecentOrders(storeId: string, query = {}) {
   return res.json();
 }
 
-export async function fetchTopDishSearches(storeId: string) {
-  const url = `${API_BASE}/api/analytics/top-dish-searches/${storeId}`;
+export async function fetchTopDishSearches(storeId: string, params = {}) {
+  const queryParams = buildQueryParams({ facets: 'dish,product', limit: 5, ...params });
+  const url = `${API_BASE}/api/analytics/top-dish-searches/${storeId}?${queryParams}`;
   const res = await fetch(url, {
     headers: {
       'ngrok-skip-browser-warning': 'true',
@@ -281,44 +310,35 @@ export async function fetchStoreName(storeId: string) {
   return res.json();
 }
 
-// Helper Functions
-export const aggregateDishSearches = (dishQueryData: any[]) => {
-  const dishCounts: Record<string, number> = {};
-  
-  dishQueryData.forEach(item => {
-    if (item.dishbased && Array.isArray(item.dishbased)) {
-      item.dishbased.forEach((dish: string) => {
-        if (dish) {
-          dishCounts[dish] = (dishCounts[dish] || 0) + 1;
-        }
-      });
-    }
-  });
-  
-  return Object.entries(dishCounts)
-    .map(([name, count]) => ({ name, searches: count }))
-    .sort((a, b) => b.searches - a.searches)
-    .slice(0, 5);
+// Server-sent events: KPI changes and new orders pushed for one store
+export type LiveHandlers = {
+  onHello?: (data: any) => void;
+  onKpis?: (data: any) => void;
+  onOrder?: (order: any) => void;
+  onResync?: (data: any) => void;
 };
 
-export const aggregateIngredientDemand = (dishQueryData: any[]) => {
-  const ingredientCounts: Record<string, number> = {};
-  
-  dishQueryData.forEach(item => {
-    if (item.product_name && Array.isArray(item.product_name)) {
-      item.product_name.forEach((product: string) => {
-        if (product) {
-          ingredientCounts[product] = (ingredientCounts[product] || 0) + 1;
-        }
-      });
+export function openLiveUpdates(storeId: string, handlers: LiveHandlers): EventSource {
+  const source = new EventSource(`${API_BASE}/api/analytics/live/${storeId}`);
+  const listen = (event: string, handler?: (data: any) => void) => {
+    if (handler) {
+      source.addEventListener(event, (e) => handler(JSON.parse((e as MessageEvent).data)));
     }
-  });
-  
-  return Object.entries(ingredientCounts)
-    .map(([name, queries]) => ({ name, queries }))
-    .sort((a, b) => b.queries - a.queries)
-    .slice(0, 5);
-};
+  };
+  listen('hello', handlers.onHello);
+  listen('kpis', handlers.onKpis);
+  listen('order', handlers.onOrder);
+  listen('resync', handlers.onResync);
+  return source;
+}
+
+// Helper Functions
+// Ranking happens server-side; these only map the facet rows for the charts
+export const aggregateDishSearches = (dishQueryData: any) =>
+  (dishQueryData?.dish?.data || []).map((row: any) => ({ name: row.term, searches: row.searches }));
+
+export const aggregateIngredientDemand = (dishQueryData: any) =>
+  (dishQueryData?.product?.data || []).map((row: any) => ({ name: row.term, queries: row.searches }));
 
 // Utility Functions
 export const formatCurrency = (value: number) => {
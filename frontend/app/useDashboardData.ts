@@ -1,15 +1,9 @@
 // useDashboardData.ts - Custom Hook for Dashboard Data Management
 
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import {
   STORE_ID,
-  fetchTotalProducts,
-  fetchTotalSales,
-  fetchTotalRevenue,
-  fetchAvgOrderValue,
-  fetchTotalCustomers,
-  fetchUniqueCustomers,
-  fetchTopCustomers,
+  fetchKpis,
   fetchMonthlyRevenue,
   fetchProductsByCategory,
   fetchRecentOrders,
@@ -17,7 +11,8 @@ import {
   fetchTopSellingProducts,
   fetchTopStockAlerts,
   fetchQuickAnalysis,
-  fetchStoreName
+  fetchStoreName,
+  openLiveUpdates
 } from './api';
 
 export const useDashboardData = () => {
@@ -76,9 +71,11 @@ export const useDashboardData = () => {
   const [ordersPagination, setOrdersPagination] = useState<any>(null);
   const [ordersPerPage, setOrdersPerPage] = useState(5);
   const [currentPage, setCurrentPage] = useState(1);  
+  const [ordersRefreshKey, setOrdersRefreshKey] = useState(0);
+  const ordersFetchedKeyRef = useRef(0);
 
   // Dish Query Data State
-  const [dishQueryData, setDishQueryData] = useState<any[]>([]);
+  const [dishQueryData, setDishQueryData] = useState<any>({});
   const [dishQueriesLoading, setDishQueriesLoading] = useState(true);
 
   // Filter States (applied filters)
@@ -116,32 +113,17 @@ export const useDashboardData = () => {
 
         const params = getFilterParams();
 
-        const [
-          productsData,
-          salesData,
-          revenueData,
-          avgOrderData,
-          customersData,
-          uniqueCustomersData,
-          topCustomersData
-        ] = await Promise.all([
-          fetchTotalProducts(STORE_ID, params),
-          fetchTotalSales(STORE_ID, params),
-          fetchTotalRevenue(STORE_ID, params),
-          fetchAvgOrderValue(STORE_ID, params),
-          fetchTotalCustomers(STORE_ID, params),
-          fetchUniqueCustomers(STORE_ID, params),
-          fetchTopCustomers(STORE_ID, params)
-        ]);
-
-        setTotalProducts(productsData.products_count || 0);
-        setTotalSales(salesData.sales_count || 0);
-        setTotalRevenue(revenueData.total_revenue || 0);
-        setAverageValue(avgOrderData.avg_order_value || 0);
-        setTotalCustomers(customersData.total_customers || 0);
-        setUniqueCustomers(uniqueCustomersData.unique_customers || 0);
-        setTopCustomers(topCustomersData.top_customer?.total_spent || 0);
-        setTopCustomersName(topCustomersData.top_customer?.customerName || '');
+        // One request / one orders scan for every header card
+        const data = await fetchKpis(STORE_ID, params);
+
+        setTotalProducts(data.products_count || 0);
+        setTotalSales(data.sales_count || 0);
+        setTotalRevenue(data.total_revenue || 0);
+        setAverageValue(data.avg_order_value || 0);
+        setTotalCustomers(data.total_customers || 0);
+        setUniqueCustomers(data.unique_customers || 0);
+        setTopCustomers(data.top_customer?.total_spent || 0);
+        setTopCustomersName(data.top_customer?.customerName || '');
 
       } catch (err) {
         console.error('Error fetching KPIs:', err);
@@ -220,6 +202,11 @@ export const useDashboardData = () => {
         if (searchText.trim()) queryParams.search = searchText.trim();
         if (dateFrom) queryParams.date_from = dateFrom;
         if (dateTo) queryParams.date_to = dateTo;
+        // Live resync / reconnect: skip the server cache, it predates the orders we missed
+        if (ordersRefreshKey !== ordersFetchedKeyRef.current) {
+          ordersFetchedKeyRef.current = ordersRefreshKey;
+          queryParams.fresh = true;
+        }
         
         const data = await fetchRecentOrders(STORE_ID, queryParams);
         setRecentOrders(data.orders || []);
@@ -232,7 +219,48 @@ export const useDashboardData = () => {
     };
 
     fetchOrders();
-  }, [filterStatus, searchText, currentPage, ordersPerPage, dateFrom, dateTo]);
+  }, [filterStatus, searchText, currentPage, ordersPerPage, dateFrom, dateTo, ordersRefreshKey]);
+
+  // Live updates: the server pushes KPI changes and new orders over one SSE connection
+  const liveViewRef = useRef({ filtered: false, currentPage: 1, ordersPerPage: 5 });
+  liveViewRef.current = {
+    filtered: Boolean(filterStatus || dateFrom || dateTo || searchText.trim()),
+    currentPage,
+    ordersPerPage
+  };
+
+  useEffect(() => {
+    let connected = false;
+    const source = openLiveUpdates(STORE_ID, {
+      onHello: () => {
+        // Orders placed while disconnected were never pushed; refetch after a reconnect
+        if (connected) setOrdersRefreshKey(key => key + 1);
+        connected = true;
+      },
+      onKpis: (data) => {
+        // Pushed figures are store-wide; a filtered dashboard keeps its own
+        if (liveViewRef.current.filtered) return;
+        if (data.sales_count !== undefined) setTotalSales(data.sales_count);
+        if (data.total_revenue !== undefined) setTotalRevenue(data.total_revenue);
+        if (data.avg_order_value !== undefined) setAverageValue(data.avg_order_value);
+        if (data.total_customers !== undefined) setTotalCustomers(data.total_customers);
+        if (data.unique_customers !== undefined) setUniqueCustomers(data.unique_customers);
+        if (data.top_customer !== undefined) {
+          setTopCustomers(data.top_customer?.total_spent || 0);
+          setTopCustomersName(data.top_customer?.customerName || '');
+        }
+      },
+      onOrder: (order) => {
+        const { filtered, currentPage, ordersPerPage } = liveViewRef.current;
+        if (filtered || currentPage !== 1) return;
+        setRecentOrders(prev => [order, ...prev].slice(0, ordersPerPage));
+      },
+      // The server dropped orders it couldn't deliver in time
+      onResync: () => setOrdersRefreshKey(key => key + 1)
+    });
+
+    return () => source.close();
+  }, []);
 
   // Fetch Top Dish Searches
   useEffect(() => {
@@ -240,7 +268,7 @@ export const useDashboardData = () => {
       try {
         setDishQueriesLoading(true);
         const data = await fetchTopDishSearches(STORE_ID);
-        setDishQueryData(data.data || []);
+        setDishQueryData(data.facets || {});
       } catch (err) {
         console.error('Error fetching dish queries:', err);
       } finally {